@@ -0,0 +1,30 @@
+## Benchmark of SREnKF and EnKF analyses of many independent ensembles of the
+## same shape, run one at a time in a loop against one call on the stacked
+## (batch, x_dim, ens_num) array.
+##
+## Run with Ens_Assim installed: python benchmarks/batched_analysis.py
+import time
+import numpy as np
+from ens_assim.assimilate.assimilate import SREnKF, EnKF
+from ens_assim.measure.measure import Measure
+
+x_dim = 40
+meas_dim = 20
+ens_num = 10
+batch_sizes = [10, 100, 1000]
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    measure = Measure(np.eye(meas_dim), np.random.normal(0, 1, (meas_dim, 1)), np.arange(0, x_dim, 2))
+    print('{:>8} {:>8} {:>10} {:>10}'.format('batch', 'filter', 'loop', 'stacked'))
+    for batch in batch_sizes:
+        stack = np.random.normal(0, 1, (batch, x_dim, ens_num))
+        for model in [SREnKF(), EnKF()]:
+            loop = timed(lambda: [model.analyze(state, measure) for state in stack])
+            stacked = timed(lambda: model.analyze(stack, measure))
+            print('{:>8} {:>8} {:>9.4f}s {:>9.4f}s'.format(batch, type(model).__name__, loop, stacked))
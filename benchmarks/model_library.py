@@ -0,0 +1,37 @@
+## Benchmark of forecasts of the Lorenz 96 and Kuramoto-Sivashinsky models
+## of ens_assim.model as the state dimension grows, for use as standard
+## workloads when checking for performance regressions.
+##
+## Run with Ens_Assim installed: python benchmarks/model_library.py
+import time
+import numpy as np
+from ens_assim.model.model import Lorenz96, KuramotoSivashinsky
+
+ens_num = 20
+num_steps = 20
+
+def time_model(model, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.advance()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    print('{:>22} {:>8} {:>10} {:>16}'.format('model', 'x_dim', 'time', 'us/member/step'))
+    for x_dim in [40, 1000, 10000, 100000]:
+        model = Lorenz96(8. + np.random.normal(0, 1, (x_dim, ens_num)))
+        model.set_solver_dict({'h':.05, 'in_place':True, 'output':'final'})
+        model.set_num_steps(num_steps)
+        elapsed = time_model(model)
+        print('{:>22} {:>8} {:>9.4f}s {:>16.2f}'.format('Lorenz96', x_dim, elapsed, 1e6*elapsed/(ens_num*num_steps)))
+    for x_dim in [64, 256, 1024, 4096]:
+        grid = np.arange(x_dim)/x_dim
+        u0 = np.cos(2*np.pi*grid)*(1 + np.sin(2*np.pi*grid))
+        model = KuramotoSivashinsky(u0[:,None] + np.random.normal(0, .1, (x_dim, ens_num)), length=x_dim/4)
+        model.set_solver_dict({'h':.25, 'output':'final'})
+        model.set_num_steps(num_steps)
+        elapsed = time_model(model)
+        print('{:>22} {:>8} {:>9.4f}s {:>16.2f}'.format('KuramotoSivashinsky', x_dim, elapsed, 1e6*elapsed/(ens_num*num_steps)))
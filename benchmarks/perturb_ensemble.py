@@ -0,0 +1,44 @@
+## Benchmark of the percent and absolute perturbations as perturb.py computed them
+## before, with a scipy.sparse.diags product per call or per ensemble member, against
+## the broadcast UncorrelatedPerturbation, called fresh and reused with a Generator.
+##
+## Run with Ens_Assim installed: python benchmarks/perturb_ensemble.py
+import time
+import numpy as np
+from scipy.sparse import diags
+from ens_assim.perturb import UncorrelatedPerturbation, absolute_uncorr_perturb, percent_uncorr_perturb
+
+x_dim = 40
+ens_sizes = [10, 100, 1000, 10000]
+repeats = 10
+
+def loop_absolute_perturb(state, absolute_std):
+    return state + diags(absolute_std)@np.random.normal(0, 1, state.shape)
+
+def loop_percent_perturb(state, percent_std):
+    random_pert = np.random.normal(0, 1, state.shape)
+    for i in range(state.shape[1]):
+        state[:,i] = state[:,i] + (diags(state[:,i]*percent_std)@np.expand_dims(random_pert[:,i],1)).flatten()
+    return state
+
+def timed(f):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        f()
+    return (time.perf_counter() - start)/repeats
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    std = np.random.random(x_dim)
+    columns = ['loop abs', 'abs', 'loop pct', 'pct', 'engine pct']
+    print('{:>8} '.format('ens_num') + ' '.join('{:>12}'.format(name) for name in columns))
+    for ens_num in ens_sizes:
+        state = np.random.normal(0, 1, (x_dim, ens_num))
+        engine = UncorrelatedPerturbation(std, relative=True, rng=np.random.default_rng(0))
+        out = np.empty_like(state)
+        times = [timed(lambda: loop_absolute_perturb(state, std)),
+                 timed(lambda: absolute_uncorr_perturb(state, std)),
+                 timed(lambda: loop_percent_perturb(state.copy(), std)),
+                 timed(lambda: percent_uncorr_perturb(state, std)),
+                 timed(lambda: engine.perturb(state, out))]
+        print('{:>8} '.format(ens_num) + ' '.join('{:>11.6f}s'.format(t) for t in times))
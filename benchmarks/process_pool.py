@@ -0,0 +1,54 @@
+## Benchmark of the 'process' backend of ODE against the serial backend for
+## an expensive, non vectorized rhs, for an increasing number of workers.
+##
+## Run with Ens_Assim installed: python benchmarks/process_pool.py
+import os
+import time
+import numpy as np
+from ens_assim.model.model import ODE, rk4
+
+RHO = 28
+BETA = 8/3
+SIGMA = 10
+INNER = 200
+
+def expensive_rhs(t, x):
+    # Stands in for a black box model, costing a pure python loop per call
+    dx = np.array([SIGMA*(x[1,:]-x[0,:]),x[0,:]*(RHO-x[2,:]),x[0,:]*x[1,:]-BETA*x[2,:]])
+    acc = 0.
+    for i in range(INNER):
+        acc += i
+    return dx
+
+num_steps = 50
+ens_num = 64
+
+def time_model(model, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.advance()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    x0 = np.random.normal(0, 5, (3, ens_num))
+    model = ODE(x0)
+    model.set_solver(rk4)
+    model.set_solver_dict({'h':.01, 'vectorized':False})
+    model.set_num_steps(num_steps)
+    model.set_rhs(expensive_rhs)
+    model.set_t0(0)
+
+    serial = time_model(model)
+    print('{:>8} {:>10} {:>8}'.format('workers', 'time', 'speedup'))
+    print('{:>8} {:>9.3f}s {:>8.2f}'.format('serial', serial, 1.))
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        model.set_backend('process', workers)
+        model.advance()
+        elapsed = time_model(model)
+        print('{:>8} {:>9.3f}s {:>8.2f}'.format(workers, elapsed, serial/elapsed))
+        workers *= 2
+    model.set_backend('serial')
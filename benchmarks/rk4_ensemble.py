@@ -0,0 +1,41 @@
+## Benchmark of the batched rk4 sweep against the per member fallback
+## for the Lorenz 63 system as the ensemble size grows.
+##
+## Run with Ens_Assim installed: python benchmarks/rk4_ensemble.py
+import time
+import numpy as np
+from ens_assim.model.model import rk4
+
+RHO = 28
+BETA = 8/3
+SIGMA = 10
+
+rhs = lambda t,x: np.array([SIGMA*(x[1,:]-x[0,:]),x[0,:]*(RHO-x[2,:]),x[0,:]*x[1,:]-BETA*x[2,:]])
+
+num_steps = 100
+ens_sizes = [10, 100, 1000, 10000]
+max_member_ens = 1000
+configs = [('per member', {'h':.01, 'vectorized':False}),
+           ('batched', {'h':.01}),
+           ('chunked 2048', {'h':.01, 'chunk_size':2048})]
+
+def time_solver(x0, solver_dict, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        rk4(0, x0, rhs, num_steps, solver_dict)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    print('{:>8} '.format('ens_num') + ''.join('{:>14}'.format(name) for name, _ in configs))
+    for ens_num in ens_sizes:
+        x0 = np.random.normal(0, 5, (3, ens_num))
+        row = '{:>8} '.format(ens_num)
+        for name, solver_dict in configs:
+            if not solver_dict.get('vectorized', True) and ens_num > max_member_ens:
+                row += '{:>14}'.format('-')
+            else:
+                row += '{:>13.4f}s'.format(time_solver(x0, solver_dict))
+        print(row)
@@ -0,0 +1,49 @@
+## Benchmark of the time and memory allocated by rk4 with an allocating rhs
+## against an in place rhs with stage buffers kept in a reused workspace,
+## for the Lorenz 96 system.
+##
+## Run with Ens_Assim installed: python benchmarks/rk4_in_place.py
+import time
+import tracemalloc
+import numpy as np
+from ens_assim.model.model import rk4
+
+FORCING = 8.
+
+def rhs(t, x):
+    return (np.roll(x,-1,axis=0)-np.roll(x,2,axis=0))*np.roll(x,1,axis=0) - x + FORCING
+
+def rhs_in_place(t, x, out):
+    out[:-1] = x[1:]
+    out[-1] = x[0]
+    out[2:] -= x[:-2]
+    out[:2] -= x[-2:]
+    out[1:] *= x[:-1]
+    out[0] *= x[-1]
+    out -= x
+    out += FORCING
+
+x_dim = 40
+num_steps = 50
+ens_sizes = [10, 100, 1000, 10000]
+configs = [('allocating', rhs, {'h':.01, 'output':'final'}),
+           ('in place', rhs_in_place, {'h':.01, 'output':'final', 'in_place':True})]
+
+def measure(x0, f, solver_dict, workspace):
+    rk4(0, x0, f, num_steps, solver_dict, workspace)
+    tracemalloc.start()
+    rk4(0, x0, f, num_steps, solver_dict, workspace)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    rk4(0, x0, f, num_steps, solver_dict, workspace)
+    return time.perf_counter() - start, peak
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    print('{:>8} {:>12} {:>10} {:>12}'.format('ens_num', 'rhs', 'time', 'peak MiB'))
+    for ens_num in ens_sizes:
+        x0 = FORCING + np.random.normal(0, 1, (x_dim, ens_num))
+        for name, f, solver_dict in configs:
+            elapsed, peak = measure(x0, f, solver_dict, {})
+            print('{:>8} {:>12} {:>9.4f}s {:>12.3f}'.format(ens_num, name, elapsed, peak/2**20))
@@ -0,0 +1,29 @@
+## Benchmark of drawing the resampled particles with a scipy.stats.rv_discrete,
+## as SIR did before, against the searchsorted resampling schemes. rv_discrete
+## builds a particles x particles array per draw, so the counts are kept small.
+##
+## Run with Ens_Assim installed: python benchmarks/sir_resample.py
+import time
+import numpy as np
+import scipy.stats as spstats
+from ens_assim.resample import RESAMPLERS
+
+particle_counts = [100, 1000, 10000]
+
+def rv_discrete_resample(weights, size):
+    return spstats.rv_discrete(values=(np.arange(len(weights)), weights)).rvs(size=size)
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    schemes = [('rv_discrete', rv_discrete_resample)] + list(RESAMPLERS.items())
+    print('{:>10} '.format('particles') + ' '.join('{:>12}'.format(name) for name, _ in schemes))
+    for num in particle_counts:
+        weights = np.random.random(num)
+        weights = weights/np.sum(weights)
+        times = [timed(lambda: resample(weights, num)) for _, resample in schemes]
+        print('{:>10} '.format(num) + ' '.join('{:>11.5f}s'.format(t) for t in times))
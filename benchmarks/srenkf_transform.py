@@ -0,0 +1,51 @@
+## Benchmark of the SREnKF transform computed with an inverse, a cholesky and a
+## solve with the innovation covariance, as before, against the single eigh of
+## I + Yb^T R^-1 Yb used by SREnKF, timing each cubic operation separately.
+##
+## Run with Ens_Assim installed: python benchmarks/srenkf_transform.py
+import time
+import numpy as np
+import scipy.linalg
+from ens_assim.assimilate.assimilate import SREnKF
+from ens_assim.measure.measure import Measure
+
+x_dim = 400
+repeats = 5
+configs = [(20, 50), (50, 200), (100, 400), (200, 400)]
+
+def timed(f):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        value = f()
+    return (time.perf_counter() - start)/repeats, value
+
+def old_transform(Xb, Yb, R):
+    ens_num = Xb.shape[1]
+    S = Yb @ Yb.T + R
+    solve, K = timed(lambda: np.linalg.solve(S.T, (Xb @ Yb.T).T).T)
+    inv, T = timed(lambda: np.linalg.inv(np.eye(ens_num) + Yb.T @ np.linalg.solve(R, Yb)))
+    chol, _ = timed(lambda: scipy.linalg.cholesky(T))
+    return solve, inv, chol
+
+def new_transform(Yb, R):
+    ens_num = Yb.shape[1]
+    A = np.eye(ens_num) + Yb.T @ np.linalg.solve(R, Yb)
+    eigh, _ = timed(lambda: np.linalg.eigh(A))
+    return eigh
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    print('{:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'ens_num', 'obs', 'S solve', 'inv', 'cholesky', 'old total', 'eigh', 'analyze'))
+    for ens_num, meas_dim in configs:
+        state = np.random.normal(0, 1, (x_dim, ens_num))
+        R = np.eye(meas_dim)
+        measure = Measure(R, np.random.normal(0, 1, (meas_dim, 1)), np.arange(meas_dim))
+        x_mean = np.mean(state, 1, keepdims=1)
+        Xb = (state - x_mean)/np.sqrt(ens_num-1)
+        Yb = Xb[:meas_dim]
+        solve, inv, chol = old_transform(Xb, Yb, R)
+        eigh = new_transform(Yb, R)
+        analyze, _ = timed(lambda: SREnKF().analyze(state, measure))
+        print('{:>8} {:>8} {:>9.5f}s {:>9.5f}s {:>9.5f}s {:>9.5f}s {:>9.5f}s {:>11.5f}s'.format(
+            ens_num, meas_dim, solve, inv, chol, solve + inv + chol, eigh, analyze))
@@ -1,9 +1,10 @@
 import numpy as np
 import sys
 from ens_assim.measure.measure import Measure
-from ens_assim.assimilate.assimilate import SREnKF
+from ens_assim.assimilate.assimilate import AsyncSREnKF
 from ens_assim.model.model import Model, ODE, rk4
 from ens_assim import perturb, calc_stats
+from ens_assim.rng import spawn, NoiseBlock
 import matplotlib.pyplot as plt
 
 RHO = 28
@@ -13,7 +14,6 @@ SIGMA = 10
 data_std = np.array([1.]) 
 obs_dim = [1]
 data_dim = len(obs_dim)
-H = lambda x: x[obs_dim,:]
 data_covariance = np.diag(data_std)@np.diag(data_std)
 
 rhs = lambda t,x: np.array([SIGMA*(x[1,:]-x[0,:]),x[0,:]*(RHO-x[2,:]),x[0,:]*x[1,:]-BETA*x[2,:]])
@@ -27,12 +27,14 @@ solver = rk4
 solver_dict = {'h':.05}
 
 num_steps = 200
+window = 5
 ens_num = 10
 t0 = 0
+seed = 0
 
 model = ODE(x0)
-measurement = Measure(covariance=data_covariance, operator=H)
-assim_al = SREnKF()
+measurement = Measure(covariance=data_covariance, operator=obs_dim)
+assim_al = AsyncSREnKF()
 
 model.set_solver(solver)
 model.set_solver_dict(solver_dict)
@@ -40,11 +42,13 @@ model.set_num_steps(num_steps)
 model.set_rhs(rhs)
 model.set_t0(t0)
 
-truth = np.squeeze(model.advance())
-data = H(truth)
+truth, _ = model.advance()
+truth = truth[:,0,:]
+data = measurement.apply_operator(truth)
 
 x_prior = np.tile(x0,(1,ens_num))
-x_prior = perturb.absolute_uncorr_perturb(x_prior,initial_model_std)
+cycle_rngs = spawn(seed, 1 + num_steps//window)
+x_prior = perturb.absolute_uncorr_perturb(x_prior,initial_model_std,cycle_rngs[0])
 
 x_assim = np.zeros((x_dim,ens_num,num_steps+1))
 x_assim[:,:,0] = x_prior
@@ -55,19 +59,23 @@ x_std = np.zeros((x_dim,num_steps+1))
 x_mean[:,0] = x0.flatten()
 x_std[:,0] = initial_model_std
 
-model.set_num_steps(1)
-
-for steps in range(num_steps):
-    print("step: ", steps)
-    meas = perturb.absolute_uncorr_perturb(np.expand_dims(data[:,steps], axis=1),data_std)
-    measurement.set_measurement(meas)
-    x_post = assim_al.analyze(x_prior, measurement)
-    x_assim[:,:,steps+1] = x_post
-    model.set_initial_conditions(x_post)
-    x_mean[:,steps+1] = calc_stats.get_mean(x_post).squeeze()
-    x_std[:,steps+1] = calc_stats.get_std(x_post).squeeze()
-    x_prior = model.advance().squeeze()
-    x_prior = perturb.absolute_uncorr_perturb(x_prior,model_std)
+for start in range(0, num_steps, window):
+    print("window: ", start)
+    window_rng = NoiseBlock(window*data_dim + x_dim*ens_num, cycle_rngs[1 + start//window])
+    model.set_initial_conditions(x_prior)
+    x_forecast, t_window = model.advance_by(window)
+    measures = []
+    for k in range(window):
+        meas = perturb.absolute_uncorr_perturb(np.expand_dims(data[:,start+k], axis=1),data_std,window_rng)
+        measures.append(Measure(covariance=data_covariance, measurement=meas, operator=obs_dim, time=t_window[k]))
+    assim_al.set_times(t_window)
+    x_post = assim_al.analyze(x_forecast, measures)
+    x_assim[:,:,start+1:start+window] = x_forecast[:,:,:-1]
+    x_assim[:,:,start+window] = x_post
+    for k in range(start+1, start+window+1):
+        x_mean[:,k] = calc_stats.get_mean(x_assim[:,:,k]).squeeze()
+        x_std[:,k] = calc_stats.get_std(x_assim[:,:,k]).squeeze()
+    x_prior = perturb.absolute_uncorr_perturb(x_post,model_std,window_rng)
 
 #Plotting the results
 t = np.array([t0 + solver_dict['h']*time for time in range(num_steps+1)])
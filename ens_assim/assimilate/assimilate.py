@@ -8,10 +8,19 @@ import numpy.linalg as linalg
 import scipy as sp
 import scipy.linalg
 import scipy.stats as spstats
+import scipy.special
+import scipy.spatial
+import scipy.sparse
+import scipy.sparse.linalg
 import os
+import concurrent.futures
 from abc import ABC, abstractmethod
 import sys
-from ens_assim.measure.measure import Measure
+from ens_assim.measure.measure import Measure, apply_columns
+from ens_assim import parallel
+from ens_assim.resample import RESAMPLERS
+from ens_assim.rng import as_generator
+from ens_assim.localize import gaspari_cohn, as_coordinates, distance, taper_matrix
 import types
 
 class Assimilate(ABC):
@@ -78,13 +87,56 @@ class SREnKF(Assimilate):
     """
     The class for performing the square root EnKF, as seen in
     Law, Stuart, Zygalakis 2015
+
+    The analysis is done in ensemble space as in the ETKF of Hunt,
+    Kostelich, Szunyogh 2007: by the Woodbury identity every solve
+    is with the N x N matrix A = I + Yb^T R^-1 Yb, whose single
+    symmetric eigendecomposition gives the mean update weights and
+    the symmetric square root A^-1/2 of the transform, with no other
+    inverse or factorization. R is applied through
+    Measure.get_covariance, which keeps its factorization between
+    analyses while R is unchanged
+
+    A stack of independent ensembles of shape (batch, x_dim, ens_num)
+    may be passed instead of a single ensemble, with a measurement of
+    shape (meas_dim, 1) shared by the stack or (batch, meas_dim, 1).
+    The analyses are then done together with batched np.linalg calls
+
+    With localization set, the gain uses the tapered covariances
+    rho_xy o (Xb Yb^T) and rho_yy o (Yb Yb^T) and the anomalies are
+    updated with half the gain as in the DEnKF of 'Sakov and Oke
+    2008', since a localized gain has no ensemble space transform
+
+    Without localization the analysis ensemble is Eb M for the
+    N x N transform M = 11^T/N + P (w 1^T/sqrt(N-1) + T), with
+    P = I - 11^T/N the centering matrix, w the mean weights and T
+    the symmetric square root. M is kept in transform, so it can be
+    applied to other ensembles, as by the EnKS
+
+    With inflation set, the anomalies are inflated in place with the
+    adaptive inflation of ens_assim.inflate before the analysis. A
+    multiplicative inflation sqrt(lam) scales the centered part of
+    M, so M still maps the uninflated background to the analysis.
+    Additive inflation adds random anomalies that no transform of
+    the background gives, so transform is then None
         
 
     Attributes
     ----------
+    localization
+        the sparse tapers (rho_xy, rho_yy), None if not localized
+    inflation
+        the adaptive inflation, None if not inflated
+    transform
+        the transform M of the last analysis, None if localized
+        or additively inflated
 
     Methods
     -------
+    set_localization(state_coords, obs_coords, radius, taper=gaspari_cohn, boxsize=None)
+        Sets the covariance localization
+    set_inflation(inflation)
+        Sets the adaptive inflation
     analyze(state, measure)
         Performs the assimilation algorithm
     """
@@ -95,7 +147,47 @@ class SREnKF(Assimilate):
         Parameters
         ----------
         """
-        pass
+        self.localization = None
+        self.inflation = None
+        self.transform = None
+
+    def set_inflation(self, inflation):
+        """
+        Sets the adaptive inflation of the background anomalies,
+        estimated and applied in every analysis
+
+        Parameters
+        ----------
+        inflation: AdaptiveInflation or None
+            The inflation, None for no inflation
+
+        Raises
+        ------
+        """
+        self.inflation = inflation
+
+    def set_localization(self, state_coords, obs_coords, radius, taper=gaspari_cohn, boxsize=None):
+        """
+        Sets the covariance localization, see _localization
+
+        Parameters
+        ----------
+        state_coords: np.ndarray
+            The coordinates of the state components
+        obs_coords: np.ndarray
+            The coordinates of the observations
+        radius: float or None
+            The localization radius, None to turn localization off
+        taper: type.LambdaType
+            The function taper(dist, radius) giving the weights
+        boxsize: float, np.ndarray or None
+            The period of each coordinate, None if not periodic
+
+        Raises
+        ------
+        """
+        self.localization = _localization(state_coords, obs_coords, radius, taper, boxsize)
+
     def analyze(self,state,measure):
         """
         Performs the SREnKF on state with given measurements
@@ -103,7 +195,8 @@ class SREnKF(Assimilate):
         Parameters
         ----------
         state: numpy.ndarray
-            The given states to perform assimilation on
+            The given states to perform assimilation on, of shape
+            (x_dim, ens_num) or a stack (batch, x_dim, ens_num)
         measure: Measure
             The given Class containing information about measurement
 
@@ -112,41 +205,319 @@ class SREnKF(Assimilate):
         """
         super().analyze(state, measure)
 
-        if len(measure.measurement) == 0:
+        if np.size(measure.measurement) == 0:
             ens_anal = state
+            self.transform = np.broadcast_to(np.eye(state.shape[-1]), state.shape[:-2] + (state.shape[-1],)*2)
+        elif self.localization is not None:
+            ens_anal = self._analyze_localized(state, measure)
+            self.transform = None
         else:
-            ens_num = state.shape[1]
-            ens_bg = state
-            H = measure.operator
-            y0 = measure.measurement
-            R = measure.covariance
-            x_mean = np.mean(ens_bg,1,keepdims=1)                                 
-            Xb = (ens_bg-x_mean)/np.sqrt(ens_num-1)                             
-            Hens_bg = H(ens_bg)
-            Yb = (Hens_bg - np.mean(Hens_bg,1,keepdims=1))/np.sqrt(ens_num-1)
+            ens_anal, self.transform = self._analyze_transform(state, measure)
 
-            S = (Yb @ Yb.T)+R
-            CHt = (Xb @ Yb.T)
-            K = np.linalg.solve(S.T,CHt.T).T
-            m_anal = x_mean + K @ (y0 - H(x_mean))
-            
-            T = np.linalg.inv(np.eye(ens_num,ens_num) + (Yb.T @ np.linalg.solve(R,Yb)))
+        return ens_anal
+
+    def _analyze_transform(self, state, measure):
+        """
+        Performs the SREnKF with every solve in the N x N
+        ensemble space. The cached factorization of R gives
+        R^-1 Yb and R^-1 (y0 - H(x_mean)), and one eigh of
+        A = I + Yb^T R^-1 Yb gives the update and its transform,
+        see _transform_update
+
+        Parameters
+        ----------
+        state: numpy.ndarray
+            The given states to perform assimilation on
+        measure: Measure
+            The given Class containing information about measurement
+
+        Raises
+        ------
+        """
+        ens_num = state.shape[-1]
+        y0 = measure.measurement
+        R = measure.get_covariance()
+        x_mean = np.mean(state,-1,keepdims=1)
+        Xb = (state-x_mean)/np.sqrt(ens_num-1)
+        Hens_bg, Hx_mean = _observe(measure, state, x_mean)
+        Yb = (Hens_bg - np.mean(Hens_bg,-1,keepdims=1))/np.sqrt(ens_num-1)
+        _inflate(self.inflation, Xb, Yb, y0 - Hx_mean, measure)
+
+        RiYb = _solve(R, Yb)
+        Rid = _solve(R, y0 - Hx_mean)
+
+        scale = 1.
+        if self.inflation is not None and self.inflation.kind == 'multiplicative':
+            scale = np.sqrt(self.inflation.value)
+        ens_anal, transform = _transform_update(x_mean, Xb, np.eye(ens_num) + _T(Yb) @ RiYb, _T(Yb) @ Rid, scale)
+        if self.inflation is not None and self.inflation.kind == 'additive':
+            transform = None
+        return ens_anal, transform
+
+    def _analyze_localized(self, state, measure):
+        """
+        Performs the SREnKF with the localized gain, updating the
+        mean with the gain and the anomalies with half the gain
+
+        Parameters
+        ----------
+        state: numpy.ndarray
+            The given states to perform assimilation on
+        measure: Measure
+            The given Class containing information about measurement
+
+        Raises
+        ------
+        """
+        ens_num = state.shape[-1]
+        x_mean = np.mean(state,-1,keepdims=1)
+        Xb = (state-x_mean)/np.sqrt(ens_num-1)
+        Hens_bg, Hx_mean = _observe(measure, state, x_mean)
+        Yb = (Hens_bg - np.mean(Hens_bg,-1,keepdims=1))/np.sqrt(ens_num-1)
+        _inflate(self.inflation, Xb, Yb, measure.measurement - Hx_mean, measure)
+
+        mean_gain, pert_gain = _localized_apply(self.localization, Xb, Yb, measure.get_covariance(),
+                                                measure.measurement - Hx_mean, Yb)
+        return x_mean + mean_gain + np.sqrt(ens_num-1)*(Xb - .5*pert_gain)
 
-            try:
-                Tsqrt = scipy.linalg.cholesky(T)           
-            except:
-                Tsqrt = scipy.linalg.sqrtm(T)
-                            
-            X_anal =  Xb@Tsqrt
- 
-            ens_anal = np.real(m_anal + np.sqrt(ens_num-1)*X_anal) #removes any complex part introduced from eig
+class EnKS(SREnKF):
+    """
+    The class for performing the fixed-lag ensemble Kalman smoother
+    of 'Evensen and van Leeuwen 2000' on top of the SREnKF. The
+    analysis ensembles of the last lag cycles are kept in a ring
+    buffer, and every new analysis transform M is applied to each of
+    them, E <- E M, so a cycle costs O(lag x_dim N^2) and the memory
+    is bounded by lag+1 ensembles. Localization and additive
+    inflation are not supported, since the analysis then has no
+    ensemble transform
+
+    Attributes
+    ----------
+    lag
+        the number of past cycles smoothed
 
+    Methods
+    -------
+    set_lag(lag)
+        Sets the lag of the smoother
+    analyze(state, measure)
+        Performs the assimilation algorithm
+    get_smoothed(lag=0)
+        Gets the smoothed ensemble of lag cycles ago
+    """
+    def __init__(self):
+        """
+        Initializes Class
+        
+        Parameters
+        ----------
+        """
+        super().__init__()
+        self.set_lag(0)
+
+    def set_lag(self, lag):
+        """
+        Sets the lag of the smoother and empties the buffer
+
+        Parameters
+        ----------
+        lag: int
+            The number of past cycles smoothed
+
+        Raises
+        ------
+        """
+        self.lag = lag
+        self._buffer = None
+        self._head = 0
+        self._count = 0
+
+    def analyze(self,state,measure):
+        """
+        Performs the SREnKF on state with given measurements,
+        smooths the buffered ensembles with its transform and
+        adds the analysis to the buffer
+
+        Parameters
+        ----------
+        state: numpy.ndarray
+            The given states to perform assimilation on
+        measure: Measure
+            The given Class containing information about measurement
+
+        Raises
+        ------
+        ValueError
+            if localization or additive inflation is set
+        """
+        if self.localization is not None:
+            raise ValueError('EnKS does not support localization')
+        if self.inflation is not None and self.inflation.kind == 'additive':
+            raise ValueError('EnKS does not support additive inflation')
+        ens_anal = super().analyze(state, measure)
+        if self._buffer is None or self._buffer.shape[1:] != ens_anal.shape:
+            self._buffer = np.empty((self.lag+1,) + ens_anal.shape)
+            self._count = 0
+        for k in range(min(self._count, self.lag)):
+            i = (self._head - 1 - k) % (self.lag+1)
+            self._buffer[i] = self._buffer[i] @ self.transform
+        self._buffer[self._head] = ens_anal
+        self._head = (self._head + 1) % (self.lag+1)
+        self._count = min(self._count + 1, self.lag+1)
         return ens_anal
 
+    def get_smoothed(self, lag=0):
+        """
+        Gets the smoothed ensemble of lag cycles ago, given the
+        observations up to the last analysis. A lag of 0 gives
+        the last analysis
+
+        Parameters
+        ----------
+        lag: int
+            The number of cycles ago
+
+        Raises
+        ------
+        ValueError
+            if lag is not between 0 and the number of buffered cycles
+        """
+        if not 0 <= lag < self._count:
+            raise ValueError('lag must be between 0 and {}'.format(self._count-1))
+        return self._buffer[(self._head - 1 - lag) % (self.lag+1)]
+
+class AsyncSREnKF(Assimilate):
+    """
+    The class for performing the asynchronous (4D) square root
+    EnKF of 'Sakov, Evensen and Bertino 2010', the 4D-ETKF of
+    'Hunt et al. 2004'. The observations of a whole window are
+    assimilated in one analysis: H is applied to the forecast
+    trajectory at the time of each observation, the ensemble space
+    terms Yk^T Rk^-1 Yk and Yk^T Rk^-1 (yk - H(xk)) are summed over
+    the observation times, and one eigh of
+    I + sum_k Yk^T Rk^-1 Yk gives the transform, which is applied
+    to the ensemble at the end of the window
+
+    Attributes
+    ----------
+    times
+        the times of the trajectory passed to analyze
+    transform
+        the transform of the last analysis, see SREnKF
+
+    Methods
+    -------
+    set_times(times)
+        Sets the times of the trajectory
+    analyze(state, measure)
+        Performs the assimilation algorithm
+    """
+    def __init__(self):
+        """
+        Initializes Class
+        
+        Parameters
+        ----------
+        """
+        self.times = None
+        self.transform = None
+
+    def set_times(self, times):
+        """
+        Sets the times of the trajectory, as returned with it
+        by ODE.advance or ODE.advance_by
+
+        Parameters
+        ----------
+        times: np.ndarray
+            The times of the trajectory
+
+        Raises
+        ------
+        """
+        self.times = np.asarray(times)
+
+    def analyze(self,state,measure):
+        """
+        Performs the asynchronous SREnKF on the forecast trajectory
+        with the measurements of the window, returning the analysis
+        ensemble at the last time of the trajectory
+
+        Parameters
+        ----------
+        state: numpy.ndarray
+            The forecast trajectory, of shape (x_dim, ens_num, num_times)
+        measure: list
+            The Measures of the window, each with its time set to one
+            of the times of the trajectory
+
+        Raises
+        ------
+        ValueError
+            if a measurement time is not a time of the trajectory
+        """
+        ens_bg = state[:,:,-1]
+        ens_num = ens_bg.shape[1]
+        x_mean = np.mean(ens_bg,1,keepdims=1)
+        Xb = (ens_bg-x_mean)/np.sqrt(ens_num-1)
+        A = np.eye(ens_num)
+        b = np.zeros((ens_num,1))
+        for meas in measure:
+            if np.size(meas.measurement) == 0:
+                continue
+            k = self._time_index(meas.time)
+            x_k = state[:,:,k]
+            Hens_k, Hx_k = _observe(meas, x_k, np.mean(x_k,1,keepdims=1))
+            Yk = (Hens_k - np.mean(Hens_k,1,keepdims=1))/np.sqrt(ens_num-1)
+            R = meas.get_covariance()
+            RiYk = R.solve(Yk)
+            A += Yk.T @ RiYk
+            b += RiYk.T @ (meas.measurement - Hx_k)
+        ens_anal, self.transform = _transform_update(x_mean, Xb, A, b)
+        return ens_anal
+
+    def _time_index(self, time):
+        """
+        Gets the index of the trajectory time equal to time
+
+        Parameters
+        ----------
+        time: float
+            The time of a measurement
+
+        Raises
+        ------
+        ValueError
+            if time is not a time of the trajectory
+        """
+        if self.times is None or time is None:
+            raise ValueError('set_times and the measurement times must be set')
+        matches = np.flatnonzero(np.isclose(self.times, time, rtol=1e-9, atol=1e-12))
+        if len(matches) == 0:
+            raise ValueError('measurement time {} is not a time of the trajectory'.format(time))
+        return matches[0]
+
 class RSREnKF(Assimilate):
     """
     The class for performing the square root EnKF with regularization
     term
+
+    The analysis mean x_mean + Xb w minimizes, over the ensemble
+    space weights w,
+
+        1/2 w^T w + 1/2 |y0 - H(x_mean) - Yb w|^2_R^-1
+            + lam0 regularize(w_mat (x_mean + Xb w))
+
+    by quasi-Newton iterations started from the Gauss-Newton Hessian
+    A = I + Yb^T R^-1 Yb of the quadratic terms, whose inverse is
+    corrected with BFGS updates for the curvature of the regularizer,
+    with an Armijo backtracking line search. The eigh of A, done once
+    per analysis, gives the first inverse Hessian and the symmetric
+    square root transform of the anomalies, as in SREnKF. Each
+    iteration only costs N x N products.
+    The iterations start from the better of the unregularized solution
+    and the weights of the previous analysis, so a slowly changing
+    regularized mean converges in a few iterations
         
     Attributes
     ----------
@@ -158,6 +529,14 @@ class RSREnKF(Assimilate):
         the weight matrix associated with the regularization norm
     lam0 
         the regularization weight
+    max_iter
+        the maximum number of iterations per analysis
+    tol
+        the tolerance on the norm of the gradient
+    w
+        the weights of the last analysis mean
+    iterations
+        the number of iterations of the last analysis
 
     Methods
     -------
@@ -165,6 +544,8 @@ class RSREnKF(Assimilate):
         Performs the assimilation algorithm
     set_regularizer(regularize, regularize_prime, w_mat, lam0)
         Sets parameters associated with regularization
+    set_iterations(max_iter, tol)
+        Sets the iteration budget of the regularized solve
     """
     def __init__(self):
         """
@@ -177,6 +558,10 @@ class RSREnKF(Assimilate):
         self.regularize_prime = None
         self.w_mat = None
         self.lam0 = None
+        self.max_iter = 20
+        self.tol = 1e-8
+        self.w = None
+        self.iterations = 0
 
     def set_regularizer(self, regularize, regularize_prime, w_mat, lam0):
         """
@@ -184,19 +569,41 @@ class RSREnKF(Assimilate):
 
         Parameters
         ----------
-        regularize: numpy.ndarray
-            The given states to perform assimilation on
-        regularize_prime: Measure
-            The given Class containing information about measurement
-        w_mat: numpy.ndarray
-            The weight matrix for which the norm is performed in
-        lam0: numpy.ndarray
+        regularize: type.LambdaType
+            The regularization function, of a (k, 1) array z = w_mat x
+        regularize_prime: type.LambdaType
+            The gradient of regularize, a (k, 1) array
+        w_mat: numpy.ndarray or None
+            The weight matrix for which the norm is performed in,
+            None for the identity
+        lam0: float
             The base regularizaton parameter
 
         Raises
         ------
         """
-        pass
+        self.regularize = regularize
+        self.regularize_prime = regularize_prime
+        self.w_mat = w_mat
+        self.lam0 = lam0
+        self.w = None
+
+    def set_iterations(self, max_iter, tol):
+        """
+        Sets the iteration budget of the regularized solve
+
+        Parameters
+        ----------
+        max_iter: int
+            The maximum number of iterations per analysis
+        tol: float
+            The tolerance on the norm of the gradient
+
+        Raises
+        ------
+        """
+        self.max_iter = max_iter
+        self.tol = tol
 
     def analyze(self,state, measure):
         """
@@ -213,16 +620,111 @@ class RSREnKF(Assimilate):
         ------
         """
         super().analyze(state, measure)
+        if np.size(measure.measurement) == 0:
+            return state
+
+        ens_num = state.shape[1]
+        R = measure.get_covariance()
+        x_mean = np.mean(state,1,keepdims=1)
+        Xb = (state-x_mean)/np.sqrt(ens_num-1)
+        Hens_bg, Hx_mean = _observe(measure, state, x_mean)
+        Yb = (Hens_bg - np.mean(Hens_bg,1,keepdims=1))/np.sqrt(ens_num-1)
+        innov = measure.measurement - Hx_mean
+
+        RiYb = R.solve(Yb)
+        G = Yb.T @ RiYb
+        b = RiYb.T @ innov
+        eigval, eigvec = np.linalg.eigh(np.eye(ens_num) + G)
+        solve = lambda v: eigvec @ ((eigvec.T @ v)/eigval[:,None])
+        if self.w_mat is None:
+            WXb, Wx_mean = Xb, x_mean
+        else:
+            WXb, Wx_mean = self.w_mat @ Xb, self.w_mat @ x_mean
+
+        def cost(w):
+            reg = 0. if self.lam0 is None else self.lam0*np.sum(self.regularize(Wx_mean + WXb @ w))
+            return (.5*(w.T @ w) + .5*(w.T @ G @ w) - b.T @ w).item() + reg
+
+        def gradient(w):
+            grad = w + G @ w - b
+            if self.lam0 is not None:
+                grad = grad + self.lam0*(WXb.T @ self.regularize_prime(Wx_mean + WXb @ w))
+            return grad
+
+        w = solve(b)
+        J = cost(w)
+        if self.w is not None and self.w.shape == w.shape and cost(self.w) < J:
+            w = self.w
+            J = cost(w)
+
+        self.iterations = 0
+        grad = gradient(w)
+        Hinv = (eigvec/eigval) @ eigvec.T
+        while self.iterations < self.max_iter and np.linalg.norm(grad) > self.tol:
+            step = -Hinv @ grad
+            slope = (grad.T @ step).item()
+            alpha = 1.
+            while alpha > 1e-10:
+                J_new = cost(w + alpha*step)
+                if J_new <= J + 1e-4*alpha*slope:
+                    break
+                alpha = alpha/2
+            else:
+                break
+            grad_new = gradient(w + alpha*step)
+            s_k = alpha*step
+            y_k = grad_new - grad
+            sy = (s_k.T @ y_k).item()
+            if sy > 0:
+                V = np.eye(ens_num) - (s_k @ y_k.T)/sy
+                Hinv = V @ Hinv @ V.T + (s_k @ s_k.T)/sy
+            w = w + s_k
+            J = J_new
+            grad = grad_new
+            self.iterations += 1
+        self.w = w
+
+        Tsqrt = (eigvec/np.sqrt(eigval)) @ eigvec.T
+        return x_mean + Xb @ w + np.sqrt(ens_num-1)*(Xb @ Tsqrt)
 
 class EnKF(Assimilate):
     """
     Performs a perturbed observation EnKF based on 'Evensen 2003'
 
+    When there are more observations than ensemble members the
+    gain is applied through the Woodbury identity, so the only
+    dense solve is with the N x N matrix I + Yb^T R^-1 Yb and R is
+    only applied through Measure.get_covariance
+
+    A stack of independent ensembles of shape (batch, x_dim, ens_num)
+    may be passed, as for SREnKF, and is analyzed with batched
+    np.linalg calls
+
+    With localization set, the gain is formed from the tapered
+    covariances rho_xy o (Xb Yb^T) and rho_yy o (Yb Yb^T), computed
+    only at the nonzeros of the sparse tapers. With inflation set,
+    the members are inflated about their mean before the analysis
+
+    The perturbed observations are drawn from rng, the global
+    numpy.random state unless set_rng is called
+
     Attributes
     ----------
+    localization
+        the sparse tapers (rho_xy, rho_yy), None if not localized
+    inflation
+        the adaptive inflation, None if not inflated
+    rng
+        the random stream of the perturbed observations
 
     Methods
     -------
+    set_localization(state_coords, obs_coords, radius, taper=gaspari_cohn, boxsize=None)
+        Sets the covariance localization
+    set_inflation(inflation)
+        Sets the adaptive inflation
+    set_rng(rng)
+        Sets the random stream of the perturbed observations
     analyze(state, measure)
         Performs the assimilation algorithm
     """
@@ -233,7 +735,61 @@ class EnKF(Assimilate):
         Parameters
         ----------
         """
-        pass
+        self.localization = None
+        self.inflation = None
+        self.rng = None
+
+    def set_rng(self, rng):
+        """
+        Sets the random stream of the perturbed observations
+
+        Parameters
+        ----------
+        rng: None, int, np.random.Generator or NoiseBlock
+            The stream or its seed, see ens_assim.rng.as_generator
+
+        Raises
+        ------
+        """
+        self.rng = as_generator(rng)
+
+    def set_inflation(self, inflation):
+        """
+        Sets the adaptive inflation of the background anomalies,
+        estimated and applied in every analysis
+
+        Parameters
+        ----------
+        inflation: AdaptiveInflation or None
+            The inflation, None for no inflation
+
+        Raises
+        ------
+        """
+        self.inflation = inflation
+
+    def set_localization(self, state_coords, obs_coords, radius, taper=gaspari_cohn, boxsize=None):
+        """
+        Sets the covariance localization, see _localization
+
+        Parameters
+        ----------
+        state_coords: np.ndarray
+            The coordinates of the state components
+        obs_coords: np.ndarray
+            The coordinates of the observations
+        radius: float or None
+            The localization radius, None to turn localization off
+        taper: type.LambdaType
+            The function taper(dist, radius) giving the weights
+        boxsize: float, np.ndarray or None
+            The period of each coordinate, None if not periodic
+
+        Raises
+        ------
+        """
+        self.localization = _localization(state_coords, obs_coords, radius, taper, boxsize)
+
     def analyze(self,state,measure):
         """
         Performs the EnKF on state with given measurements
@@ -241,7 +797,8 @@ class EnKF(Assimilate):
         Parameters
         ----------
         state: numpy.ndarray
-            The given states to perform assimilation on
+            The given states to perform assimilation on, of shape
+            (x_dim, ens_num) or a stack (batch, x_dim, ens_num)
         measure: Measure
             The given Class containing information about measurement
 
@@ -249,51 +806,396 @@ class EnKF(Assimilate):
         ------
         """
         super().analyze(state, measure)
-        if len(measure.measurement) == 0:
+        if np.size(measure.measurement) == 0:
             ens_anal = state
         else:
-            meas_dim = len(measure.measurement)
-            ens_num = state.shape[1]
+            meas_dim = measure.get_covariance().dim
+            ens_num = state.shape[-1]
             ens_bg = state
-            H = measure.operator
             y0 = measure.measurement
-            R = measure.covariance
-            x_mean = np.mean(ens_bg,1,keepdims=1)                                 
+            R = measure.get_covariance()
+            x_mean = np.mean(ens_bg,-1,keepdims=1)                                 
             Xb = (ens_bg-x_mean)/np.sqrt(ens_num-1)                             
-            Hens_bg = H(ens_bg)
-            Yb = (Hens_bg - np.mean(Hens_bg,1,keepdims=1))/np.sqrt(ens_num-1)
-            sqrtR = np.linalg.cholesky(R)
+            Hens_bg = measure.apply_operator(ens_bg)
+            Hx_mean = np.mean(Hens_bg,-1,keepdims=1)
+            Yb = (Hens_bg - Hx_mean)/np.sqrt(ens_num-1)
+            if self.inflation is not None:
+                _inflate(self.inflation, Xb, Yb, y0 - Hx_mean, measure)
+                ens_bg = x_mean + np.sqrt(ens_num-1)*Xb
+                Hens_bg = Hx_mean + np.sqrt(ens_num-1)*Yb
                 
-            Yo = y0 + sqrtR @ np.random.normal(0,1,(meas_dim,ens_num))
-            
-            P = ( Yb @ Yb.T + R)
-            YTPi = np.linalg.solve(P.T,Yb).T            
-            K = Xb @ YTPi
-            ens_anal = ens_bg + K @ (Yo - Hens_bg)
+            Yo = y0 + _sample(R, state.shape[:-2], ens_num, self.rng)
+
+            if self.localization is not None:
+                gain, = _localized_apply(self.localization, Xb, Yb, R, Yo - Hens_bg)
+                ens_anal = ens_bg + gain
+            elif meas_dim > ens_num:
+                RiYb = _solve(R, Yb)
+                A = np.eye(ens_num) + _T(Yb) @ RiYb
+                ens_anal = ens_bg + Xb @ np.linalg.solve(A, _T(RiYb) @ (Yo - Hens_bg))
+            else:
+                P = ( Yb @ _T(Yb) + R.to_dense())
+                YTPi = _T(np.linalg.solve(_T(P),Yb))
+                K = Xb @ YTPi
+                ens_anal = ens_bg + K @ (Yo - Hens_bg)
 
         return ens_anal
 
+class EnSRF(Assimilate):
+    """
+    Performs the serial ensemble square root filter of
+    'Whitaker and Hamill 2002' for a diagonal measurement error
+    covariance. The observations are assimilated one at a time
+    on the stacked ensemble [X; H(X)], so each scalar update is a
+    rank one update of the whole stack and no matrix is inverted
+    or factorized. The cost is O(p N (n + p)) for p observations,
+    n states and N members
+
+    The observed ensemble is updated along with the state, so H is
+    applied once per analysis. For a nonlinear H this is the usual
+    linearization of the serial filter
+
+    Attributes
+    ----------
+
+    Methods
+    -------
+    analyze(state, measure)
+        Performs the assimilation algorithm
+    """
+    def __init__(self):
+        """
+        Initializes Class
+        
+        Parameters
+        ----------
+        """
+        pass
+    def analyze(self,state,measure):
+        """
+        Performs the EnSRF on state with given measurements
+
+        Parameters
+        ----------
+        state: numpy.ndarray
+            The given states to perform assimilation on
+        measure: Measure
+            The given Class containing information about measurement
+
+        Raises
+        ------
+        ValueError
+            if the measurement error covariance is not diagonal
+        """
+        super().analyze(state, measure)
+        if len(measure.measurement) == 0:
+            return state
+
+        variances = _diagonal_variances(measure, 'EnSRF')
+
+        x_dim, ens_num = state.shape
+        y0 = np.ravel(measure.measurement)
+        stack = np.vstack([state, measure.apply_operator(state)]).astype(float)
+        mean = np.mean(stack,1)
+        pert = stack - mean[:,None]
+
+        for j in range(len(y0)):
+            hpert = pert[x_dim+j]
+            var = (hpert @ hpert)/(ens_num-1)
+            gain = (pert @ hpert)/((ens_num-1)*(var+variances[j]))
+            mean += gain*(y0[j]-mean[x_dim+j])
+            alpha = 1/(1+np.sqrt(variances[j]/(var+variances[j])))
+            pert -= alpha*np.outer(gain, hpert)
+
+        return mean[:x_dim,None] + pert[:x_dim]
+
+class LETKF(Assimilate):
+    """
+    Performs the local ensemble transform Kalman filter of
+    'Hunt, Kostelich and Szunyogh 2007'. Every state component
+    is analyzed independently with the observations within the
+    localization radius, whose inverse error variances are
+    multiplied by a taper of their distance (R localization).
+    Each local analysis is an eigh of an N x N matrix
+
+    The observations near each state component are found once,
+    with a KD-tree of the observation coordinates, when the
+    coordinates or radius are set. With the 'process' backend
+    the state components are split across a pool of worker
+    processes which read the ensemble and write the analysis
+    through shared memory
+
+    Attributes
+    ----------
+    state_coords
+        the coordinates of the state components
+    obs_coords
+        the coordinates of the observations
+    boxsize
+        the period of each coordinate, None if not periodic
+    radius
+        the localization radius
+    taper
+        the function taper(dist, radius) weighting the observations
+    backend
+        the backend, 'serial' or 'process'
+    max_workers
+        the number of worker processes
+
+    Methods
+    -------
+    set_coordinates(state_coords, obs_coords, boxsize=None)
+        Sets the coordinates of the state and observations
+    set_radius(radius, taper=gaspari_cohn)
+        Sets the localization radius and taper
+    set_backend(backend, max_workers=None)
+        Sets the backend of the local analyses
+    analyze(state, measure)
+        Performs the assimilation algorithm
+    """
+    def __init__(self):
+        """
+        Initializes Class
+        
+        Parameters
+        ----------
+        """
+        self.state_coords = None
+        self.obs_coords = None
+        self.boxsize = None
+        self.radius = None
+        self.taper = gaspari_cohn
+        self.backend = 'serial'
+        self.max_workers = None
+        self._local = None
+        self._pool = None
+
+    def set_coordinates(self, state_coords, obs_coords, boxsize=None):
+        """
+        Sets the coordinates of the state and observations, and
+        builds the KD-tree of the observation coordinates
+
+        Parameters
+        ----------
+        state_coords: np.ndarray
+            The coordinates of the state components, of size
+            (x_dim, num_dims) or (x_dim,) in one dimension
+        obs_coords: np.ndarray
+            The coordinates of the observations, of size
+            (meas_dim, num_dims) or (meas_dim,) in one dimension
+        boxsize: float, np.ndarray or None
+            The period of each coordinate, None if not periodic
+
+        Raises
+        ------
+        """
+        self.state_coords = as_coordinates(state_coords)
+        self.obs_coords = as_coordinates(obs_coords)
+        self.boxsize = boxsize
+        if boxsize is None:
+            self._tree = scipy.spatial.cKDTree(self.obs_coords)
+        else:
+            self._tree = scipy.spatial.cKDTree(np.mod(self.obs_coords, boxsize), boxsize=boxsize)
+        self._local = None
+        self._close_pool()
+
+    def set_radius(self, radius, taper=gaspari_cohn):
+        """
+        Sets the localization radius and taper
+
+        Parameters
+        ----------
+        radius: float
+            The localization radius, observations further away
+            from a state component are not used in its analysis
+        taper: type.LambdaType
+            The function taper(dist, radius) giving the weights of
+            observations at distances dist
+
+        Raises
+        ------
+        """
+        self.radius = radius
+        self.taper = taper
+        self._local = None
+        self._close_pool()
+
+    def set_backend(self, backend, max_workers=None):
+        """
+        Sets the backend of the local analyses
+
+        Parameters
+        ----------
+        backend : str
+            The backend, 'serial' or 'process'
+        max_workers : int or None
+            The number of worker processes, None for the
+            number of cpus
+
+        Raises
+        ------
+        ValueError
+            If backend is not 'serial' or 'process'
+        """
+        if backend not in ('serial', 'process'):
+            raise ValueError('backend must be "serial" or "process"')
+        self.backend = backend
+        self.max_workers = max_workers
+        self._close_pool()
+
+    def analyze(self,state,measure):
+        """
+        Performs the LETKF on state with given measurements
+
+        Parameters
+        ----------
+        state: numpy.ndarray
+            The given states to perform assimilation on
+        measure: Measure
+            The given Class containing information about measurement
+
+        Raises
+        ------
+        ValueError
+            if the coordinates or radius are not set, or the
+            measurement error covariance is not diagonal
+        """
+        super().analyze(state, measure)
+        if len(measure.measurement) == 0:
+            return state
+        if self.state_coords is None or self.radius is None:
+            raise ValueError('set_coordinates and set_radius must be called before analyze')
+
+        variances = _diagonal_variances(measure, 'LETKF')
+        x_mean = np.mean(state,1,keepdims=1)
+        Hens_bg, Hx_mean = _observe(measure, state, x_mean)
+        Yb = Hens_bg - np.mean(Hens_bg,1,keepdims=1)
+        innov = np.ravel(measure.measurement - Hx_mean)
+        local = self._get_local()
+
+        if self.backend == 'serial':
+            ens_anal = np.empty(state.shape)
+            _local_analysis(range(state.shape[0]), local, state, Yb, innov, variances, ens_anal)
+            return ens_anal
+
+        if self._pool is None:
+            self._pool = parallel.make_pool(self.max_workers, _init_worker, (local,))
+        state_shm, _ = parallel.create(state.shape, state)
+        Yb_shm, _ = parallel.create(Yb.shape, Yb)
+        out_shm, out = parallel.create(state.shape)
+        try:
+            futures = [self._pool.submit(_analyze_points, state_shm.name, Yb_shm.name, out_shm.name,
+                                         state.shape, Yb.shape, points, innov, variances)
+                       for points in parallel.split(state.shape[0], parallel.num_workers(self.max_workers))]
+            for future in futures:
+                future.result()
+            ens_anal = out.copy()
+        finally:
+            del out
+            for shm in (state_shm, Yb_shm, out_shm):
+                shm.close()
+                shm.unlink()
+        return ens_anal
+
+    def _get_local(self):
+        """
+        Gets, for every state component, the indices of the
+        observations within the radius and their taper weights,
+        querying the KD-tree on the first call after the
+        coordinates or radius are set
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        if self._local is None:
+            coords = self.state_coords
+            if self.boxsize is not None:
+                coords = np.mod(coords, self.boxsize)
+            neighbours = self._tree.query_ball_point(coords, self.radius)
+            self._local = []
+            for i, obs in enumerate(neighbours):
+                obs = np.array(sorted(obs), dtype=int)
+                dist = distance(self.state_coords[i], self.obs_coords[obs], self.boxsize)
+                weights = self.taper(dist, self.radius)
+                self._local.append((obs[weights > 0], weights[weights > 0]))
+        return self._local
+
+    def _close_pool(self):
+        """
+        Shuts down the process pool, if any
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        if getattr(self, '_pool', None) is not None:
+            self._pool.shutdown()
+            self._pool = None
+
 class SIR(Assimilate):
     """
     Performs a Sequential Importance Resampling Particle Filter
 
+    The weights are kept as log-weights and normalized with the
+    log-sum-exp, so they do not underflow when the likelihoods are
+    tiny. When the effective sample size falls below the threshold
+    the particles are resampled with one of the schemes of
+    ens_assim.resample, each a binary search in the cumulative
+    weights, and the chosen indices are kept in indices
+
+    If neither a likelihood nor a log-likelihood is set, the
+    gaussian log-likelihood Measure.log_likelihood is used, which
+    evaluates every particle with one whitening solve against the
+    cached factorization of the measurement error covariance. With
+    set_workers the particles are split in chunks over a thread
+    pool, for measurement operators expensive enough to pay for it.
+    The resampling draws come from rng, the global numpy.random
+    state unless set_rng is called
+
     Attributes
     ----------
     weights
-        weights for the resampling
+        normalized weights of the particles
+    log_weights
+        normalized log-weights of the particles
     likelihood
         likelihood function of the data
+    log_likelihood
+        log-likelihood function of the data
     threshold
         threshold for effective sample size
+    resampling
+        name of the resampling scheme
+    indices
+        indices of the particles kept by the last analysis
+    max_workers
+        number of threads evaluating the likelihood, None for serial
+    rng
+        the random stream of the resampling
 
     Methods
     -------
     set_weights(weights)
         Sets the base weight for each particle
+    set_log_weights(log_weights)
+        Sets the base log-weight for each particle
     set_likelihood(likelihood)
         Sets the likelihood function for the data
+    set_log_likelihood(log_likelihood)
+        Sets the log-likelihood function for the data
     set_threshold(threshold)
         Sets the threshold for effective sample size of the SIR
+    set_resampling(resampling)
+        Sets the resampling scheme
+    set_workers(max_workers)
+        Sets the number of threads evaluating the likelihood
+    set_rng(rng)
+        Sets the random stream of the resampling
     analyze(state, measure)
         Performs the assimilation algorithm
     """
@@ -305,8 +1207,14 @@ class SIR(Assimilate):
         ----------
         """
         self.weights = None
+        self.log_weights = None
         self.likelihood = None
+        self.log_likelihood = None
         self.threshold = None
+        self.resampling = 'multinomial'
+        self.indices = None
+        self.max_workers = None
+        self.rng = None
 
     def set_weights(self, weights):
         """
@@ -320,8 +1228,25 @@ class SIR(Assimilate):
         Raises
         ------
         """
+        with np.errstate(divide='ignore'):
+            self.set_log_weights(np.log(weights))
+
+    def set_log_weights(self, log_weights):
+        """
+        Sets the log-weights for the particles, which
+        need not be normalized
+
+        Parameters
+        ----------
+        log_weights: np.ndarray
+            log-weight for each particle
 
-        self.weights = weights
+        Raises
+        ------
+        """
+        log_weights = np.ravel(log_weights)
+        self.log_weights = log_weights - scipy.special.logsumexp(log_weights)
+        self.weights = np.exp(self.log_weights)
     
     def set_likelihood(self, likelihood):
         """
@@ -339,6 +1264,22 @@ class SIR(Assimilate):
         """
 
         self.likelihood = likelihood
+
+    def set_log_likelihood(self, log_likelihood):
+        """
+        Sets the log-likelihood for the data, which is used
+        instead of the likelihood when set
+
+        Parameters
+        ----------
+        log_likelihood: type.LambdaType
+            lambda function for the log-likelihood of the data
+            of each particle
+
+        Raises
+        ------
+        """
+        self.log_likelihood = log_likelihood
             
     def set_threshold(self, threshold):
         """
@@ -357,6 +1298,53 @@ class SIR(Assimilate):
 
         self.threshold = threshold
 
+    def set_resampling(self, resampling):
+        """
+        Sets the resampling scheme
+
+        Parameters
+        ----------
+        resampling: str
+            'multinomial', 'systematic', 'stratified' or 'residual'
+
+        Raises
+        ------
+        ValueError
+            If resampling is not a known scheme
+        """
+        if resampling not in RESAMPLERS:
+            raise ValueError('resampling must be one of ' + ', '.join(RESAMPLERS))
+        self.resampling = resampling
+
+    def set_workers(self, max_workers):
+        """
+        Sets the number of threads the particles are split over
+        when evaluating the likelihood
+
+        Parameters
+        ----------
+        max_workers: int or None
+            The number of threads, None to evaluate serially
+
+        Raises
+        ------
+        """
+        self.max_workers = max_workers
+
+    def set_rng(self, rng):
+        """
+        Sets the random stream of the resampling
+
+        Parameters
+        ----------
+        rng: None, int, np.random.Generator or NoiseBlock
+            The stream or its seed, see ens_assim.rng.as_generator
+
+        Raises
+        ------
+        """
+        self.rng = as_generator(rng)
+
     def analyze(self,state,measure):
         """
         Performs the SIR on state with given measurements
@@ -371,26 +1359,388 @@ class SIR(Assimilate):
         Raises
         ------
         """
-        weights = self.weights/np.sum(self.weights)
-        
+        ens_num = state.shape[1]
+        if self.log_weights is None:
+            self.set_log_weights(np.zeros(ens_num))
+        self.indices = np.arange(ens_num)
+
         if len(measure.measurement) == 0:
             ens_anal = state
-            weights = self.weights
         else:
             ens_bg = state
-            ens_num = state.shape[1]
-            w = self.weights*self.likelihood(ens_bg)
-            w = w/np.sum(w)
-            w = w.flatten()
-            if (1/np.sum(w**2) < self.threshold):
-                xk = np.arange(ens_num)
-                resample_dist = spstats.rv_discrete(values=(xk,w))
-                choice = resample_dist.rvs(size=ens_num)
-                state = ens_bg[:,choice]
-                weights = (1/ens_num)*np.ones((1,ens_num))
-                ens_anal = state
+            log_lik = self._log_likelihood(ens_bg, measure)
+            self.set_log_weights(self.log_weights + np.ravel(log_lik))
+            if (1/np.sum(self.weights**2) < self.threshold):
+                self.indices = RESAMPLERS[self.resampling](self.weights, ens_num, self.rng)
+                ens_anal = ens_bg[:,self.indices]
+                self.set_log_weights(np.zeros(ens_num))
             else:
                 ens_anal = state
-                weights = w
-            self.weights = weights
         return ens_anal
+
+    def _log_likelihood(self, state, measure):
+        """
+        Evaluates the log-likelihood of every particle, from the
+        log-likelihood, the likelihood, or Measure.log_likelihood,
+        split over a thread pool if set_workers was called
+
+        Parameters
+        ----------
+        state : numpy.ndarray:
+            The particles
+        measure: Measure
+            The given Class containing information about measurement
+
+        Raises
+        ------
+        """
+        if self.log_likelihood is not None:
+            log_likelihood = self.log_likelihood
+        elif self.likelihood is not None:
+            def log_likelihood(x):
+                with np.errstate(divide='ignore'):
+                    return np.log(self.likelihood(x))
+        else:
+            # factorize R before any thread needs it
+            measure.get_covariance().logdet()
+            log_likelihood = measure.log_likelihood
+
+        if self.max_workers is None:
+            return np.ravel(log_likelihood(state))
+        chunks = parallel.split(state.shape[1], self.max_workers)
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as pool:
+            log_lik = list(pool.map(lambda chunk: np.ravel(log_likelihood(state[:,chunk])), chunks))
+        return np.concatenate(log_lik)
+
+def _observe(measure, ens, x_mean):
+    """
+    Applies the measurement operator to the ensemble and gets
+    H(x_mean). For a linear operator H(x_mean) is the mean of
+    H(ens), so the operator is only applied once
+
+    Parameters
+    ----------
+    measure: Measure
+        The given Class containing information about measurement
+    ens: numpy.ndarray
+        The ensemble, of size (x_dim, ens_num)
+    x_mean: numpy.ndarray
+        The ensemble mean, of size (x_dim, 1)
+
+    Raises
+    ------
+    """
+    Hens = measure.apply_operator(ens)
+    if measure.linear:
+        return Hens, np.mean(Hens,-1,keepdims=1)
+    return Hens, measure.apply_operator(x_mean)
+
+def _transform_update(x_mean, Xb, A, b, scale=1.):
+    """
+    Performs the ensemble transform update with one eigh
+    A = V diag(lam) V^T of the symmetric ensemble space matrix
+    A = I + Yb^T R^-1 Yb, giving the mean weights
+    V diag(1/lam) V^T b and the symmetric square root
+    V diag(lam^-1/2) V^T of the transform. The eigenvalues of A
+    are at least 1, so the square root is real and well defined.
+    Returns the analysis ensemble and the N x N transform M which
+    maps the background ensemble to it. If the anomalies Xb were
+    inflated by the factor scale, the centered part of M is scaled
+    by it, so M still maps the uninflated background ensemble
+
+    Parameters
+    ----------
+    x_mean: numpy.ndarray
+        The background mean
+    Xb: numpy.ndarray
+        The scaled background anomalies
+    A: numpy.ndarray
+        The ensemble space matrix I + Yb^T R^-1 Yb
+    b: numpy.ndarray
+        The ensemble space innovation Yb^T R^-1 (y0 - H(x_mean))
+    scale: float
+        The factor the anomalies Xb were inflated by
+
+    Raises
+    ------
+    """
+    ens_num = Xb.shape[-1]
+    eigval, eigvec = np.linalg.eigh(A)
+    w = eigvec @ ((_T(eigvec) @ b)/eigval[...,:,None])
+    Tsqrt = (eigvec/np.sqrt(eigval)[...,None,:]) @ _T(eigvec)
+    center = np.eye(ens_num) - 1/ens_num
+    transform = 1/ens_num + scale*(center @ (w/np.sqrt(ens_num-1) + Tsqrt))
+    return x_mean + Xb @ w + np.sqrt(ens_num-1)*(Xb @ Tsqrt), transform
+
+def _inflate(inflation, Xb, Yb, innov, measure):
+    """
+    Inflates the scaled anomalies in place with the adaptive
+    inflation, if any
+
+    Parameters
+    ----------
+    inflation: AdaptiveInflation or None
+        The inflation
+    Xb: numpy.ndarray
+        The scaled background anomalies
+    Yb: numpy.ndarray
+        The scaled background observation anomalies
+    innov: numpy.ndarray
+        The innovation y0 - H(x_mean)
+    measure: Measure
+        The given Class containing information about measurement
+
+    Raises
+    ------
+    """
+    if inflation is not None:
+        inflation.apply(Xb, Yb, innov, measure)
+
+def _diagonal_variances(measure, name):
+    """
+    Gets the measurement error variances of a filter which
+    needs a diagonal measurement error covariance
+
+    Parameters
+    ----------
+    measure: Measure
+        The given Class containing information about measurement
+    name: str
+        The name of the filter, for the error message
+
+    Raises
+    ------
+    ValueError
+        if the measurement error covariance is not diagonal
+    """
+    R = measure.get_covariance()
+    if not R.is_diagonal():
+        raise ValueError(name + ' needs a diagonal measurement error covariance')
+    return R.diagonal()
+
+def _local_analysis(points, local, state, Yb, innov, variances, out):
+    """
+    Performs the local ensemble transform analyses of the
+    given state components, writing them into out
+
+    Parameters
+    ----------
+    points: iterable
+        The state components to analyze
+    local: list
+        The indices and taper weights of the local observations
+        of every state component
+    state: numpy.ndarray
+        The background ensemble
+    Yb: numpy.ndarray
+        The background observation anomalies
+    innov: numpy.ndarray
+        The innovation y0 - H(x_mean)
+    variances: numpy.ndarray
+        The measurement error variances
+    out: numpy.ndarray
+        The analysis ensemble
+
+    Raises
+    ------
+    """
+    ens_num = state.shape[1]
+    for i in points:
+        obs, weights = local[i]
+        if len(obs) == 0:
+            out[i] = state[i]
+            continue
+        x_mean = np.mean(state[i])
+        Yl = Yb[obs]
+        C = Yl.T * (weights/variances[obs])
+        eigval, eigvec = np.linalg.eigh((ens_num-1)*np.eye(ens_num) + C @ Yl)
+        w = eigvec @ ((eigvec.T @ (C @ innov[obs]))/eigval)
+        W = (eigvec*np.sqrt((ens_num-1)/eigval)) @ eigvec.T
+        out[i] = x_mean + (state[i]-x_mean) @ (w[:,None] + W)
+
+_WORKER = {}
+
+def _init_worker(local):
+    """
+    Stores the local observations in a pool worker
+
+    Parameters
+    ----------
+    local: list
+        The indices and taper weights of the local observations
+        of every state component
+
+    Raises
+    ------
+    """
+    _WORKER['local'] = local
+
+def _analyze_points(state_name, Yb_name, out_name, state_shape, Yb_shape, points, innov, variances):
+    """
+    Performs the local analyses of a slice of state components
+    in a pool worker, reading and writing the shared memory
+    arrays in place
+
+    Parameters
+    ----------
+    state_name, Yb_name, out_name: str
+        The names of the shared background, observation
+        anomalies and analysis
+    state_shape, Yb_shape: tuple
+        The shapes of the shared background and observation anomalies
+    points: slice
+        The state components analyzed by this worker
+    innov: numpy.ndarray
+        The innovation y0 - H(x_mean)
+    variances: numpy.ndarray
+        The measurement error variances
+
+    Raises
+    ------
+    """
+    state_shm, state = parallel.attach(state_name, state_shape)
+    Yb_shm, Yb = parallel.attach(Yb_name, Yb_shape)
+    out_shm, out = parallel.attach(out_name, state_shape)
+    try:
+        _local_analysis(range(state_shape[0])[points], _WORKER['local'], state, Yb, innov, variances, out)
+    finally:
+        del state, Yb, out
+        state_shm.close()
+        Yb_shm.close()
+        out_shm.close()
+
+def _localization(state_coords, obs_coords, radius, taper, boxsize):
+    """
+    Computes the sparse tapers rho_xy, between the state components
+    and the observations, and rho_yy, between the observations,
+    used to localize the covariances Xb Yb^T and Yb Yb^T. The tapers
+    are computed once, from the coordinates, and kept between
+    analyses
+
+    Parameters
+    ----------
+    state_coords: np.ndarray
+        The coordinates of the state components
+    obs_coords: np.ndarray
+        The coordinates of the observations
+    radius: float or None
+        The localization radius, None to turn localization off
+    taper: type.LambdaType
+        The function taper(dist, radius) giving the weights
+    boxsize: float, np.ndarray or None
+        The period of each coordinate, None if not periodic
+
+    Raises
+    ------
+    """
+    if radius is None:
+        return None
+    return (taper_matrix(state_coords, obs_coords, radius, taper, boxsize),
+            taper_matrix(obs_coords, obs_coords, radius, taper, boxsize))
+
+def _tapered_product(rho, A, B):
+    """
+    Computes the Schur product rho o (A B^T) at the nonzeros
+    of the sparse taper rho only
+
+    Parameters
+    ----------
+    rho: scipy.sparse.spmatrix
+        The sparse taper
+    A, B: numpy.ndarray
+        The anomalies, with one row per row and column of rho
+
+    Raises
+    ------
+    """
+    rho = rho.tocoo()
+    values = rho.data*np.einsum('ij,ij->i', A[rho.row], B[rho.col])
+    return scipy.sparse.csr_matrix((values, (rho.row, rho.col)), shape=rho.shape)
+
+def _localized_apply(localization, Xb, Yb, R, *rhs):
+    """
+    Applies the localized gain (rho_xy o (Xb Yb^T)) S^-1, with the
+    sparse innovation covariance S = rho_yy o (Yb Yb^T) + R, to
+    each right hand side, factorizing S once. Stacks of ensembles
+    are analyzed one at a time, since the sparse products do not
+    batch
+
+    Parameters
+    ----------
+    localization: tuple
+        The sparse tapers (rho_xy, rho_yy)
+    Xb: numpy.ndarray
+        The scaled background anomalies
+    Yb: numpy.ndarray
+        The scaled background observation anomalies
+    R: Covariance
+        The measurement error covariance
+    rhs: numpy.ndarray
+        The right hand sides, in observation space
+
+    Raises
+    ------
+    """
+    if Xb.ndim > 2:
+        rhs = [np.broadcast_to(b, Yb.shape[:-1] + b.shape[-1:]) for b in rhs]
+        gains = [_localized_apply(localization, Xb[i], Yb[i], R, *[b[i] for b in rhs])
+                 for i in np.ndindex(Xb.shape[:-2])]
+        return [np.reshape(np.stack(g), Xb.shape[:-1] + g[0].shape[-1:]) for g in zip(*gains)]
+    rho_xy, rho_yy = localization
+    PXY = _tapered_product(rho_xy, Xb, Yb)
+    S = _tapered_product(rho_yy, Yb, Yb) + R.to_sparse()
+    solve = scipy.sparse.linalg.splu(scipy.sparse.csc_matrix(S)).solve
+    return [PXY @ solve(b) for b in rhs]
+
+def _T(A):
+    """
+    Transposes the last two axes of a matrix or stack of matrices
+
+    Parameters
+    ----------
+    A: numpy.ndarray
+        The matrix or stack of matrices
+
+    Raises
+    ------
+    """
+    return np.swapaxes(A, -1, -2)
+
+def _solve(R, y):
+    """
+    Applies the inverse of the covariance R to the columns of y,
+    or of every matrix in a stack y
+
+    Parameters
+    ----------
+    R: Covariance
+        The measurement error covariance
+    y: numpy.ndarray
+        The (dim, k) array, or (..., dim, k) stack
+
+    Raises
+    ------
+    """
+    return apply_columns(R.solve, y)
+
+def _sample(R, batch, size, rng=None):
+    """
+    Draws size samples of the measurement error for every
+    ensemble in a stack of shape batch
+
+    Parameters
+    ----------
+    R: Covariance
+        The measurement error covariance
+    batch: tuple
+        The shape of the stack, () for a single ensemble
+    size: int
+        The number of samples per ensemble
+    rng: None, np.random.Generator or NoiseBlock
+        The random stream, None for the global numpy.random
+
+    Raises
+    ------
+    """
+    noise = R.sample(int(np.prod(batch))*size, rng)
+    return np.moveaxis(noise.reshape((R.dim,) + tuple(batch) + (size,)), 0, -2)
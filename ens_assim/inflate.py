@@ -0,0 +1,277 @@
+## This file contains the adaptive inflation of the ensemble filters, estimated each
+## cycle from the innovation statistics of the analysis
+##
+## Written by: Andrew Pensoneault
+import numpy as np
+import scipy.sparse
+from ens_assim.measure.measure import DiagonalCovariance, apply_columns
+from ens_assim.rng import as_generator
+
+## The number of columns of H or R^-1 formed at once by _operator_trace
+BLOCK_SIZE = 256
+
+class AdaptiveInflation(object):
+    """
+    Adaptive inflation of the background anomalies, estimated from
+    the innovation statistics d = y0 - H(x_mean) as in 'Li, Kalnay
+    and Miyoshi 2009'. The innovations satisfy
+
+        E[d^T R^-1 d] = lam tr(R^-1 Yb Yb^T) + p
+
+    for multiplicative inflation lam, and
+
+        E[d^T R^-1 d] = tr(R^-1 Yb Yb^T) + alpha tr(R^-1 H H^T) + p
+
+    for additive inflation with covariance alpha I, so each cycle
+    gives an estimate of lam or alpha from quantities the analysis
+    already has. The estimates are clipped to the bounds and
+    averaged over the cycles with the given memory, and the running
+    value is applied to the anomalies in place. Additive inflation
+    needs a linear measurement operator, and draws its noise from
+    rng, the global numpy.random state unless set_rng is called
+
+    Attributes
+    ----------
+    kind
+        'multiplicative' or 'additive'
+    value
+        the current inflation factor lam, or additive variance alpha
+    memory
+        the weight of the previous value in the running average
+    bounds
+        the lower and upper bounds of the estimates
+    rng
+        the random stream of the additive noise
+
+    Methods
+    -------
+    set_memory(memory)
+        Sets the weight of the previous value in the running average
+    set_bounds(lower, upper)
+        Sets the bounds of the estimates
+    set_rng(rng)
+        Sets the random stream of the additive noise
+    estimate(Xb, Yb, innov, measure)
+        Updates the running value from the innovation statistics
+    apply(Xb, Yb, innov, measure)
+        Updates the running value and inflates the anomalies in place
+    """
+    def __init__(self, kind='multiplicative', initial=None, memory=.9):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        kind: str
+            'multiplicative' or 'additive'
+        initial: float or None
+            the initial value, None for no inflation
+        memory: float
+            the weight of the previous value in the running average
+
+        Raises
+        ------
+        ValueError
+            If kind is not 'multiplicative' or 'additive'
+        """
+        if kind not in ('multiplicative', 'additive'):
+            raise ValueError('kind must be "multiplicative" or "additive"')
+        self.kind = kind
+        if initial is None:
+            initial = 1. if kind == 'multiplicative' else 0.
+        self.value = initial
+        self.set_memory(memory)
+        if kind == 'multiplicative':
+            self.set_bounds(1., np.inf)
+        else:
+            self.set_bounds(0., np.inf)
+        self.rng = None
+        self._operator = None
+
+    def set_memory(self, memory):
+        """
+        Sets the weight of the previous value in the running average
+
+        Parameters
+        ----------
+        memory: float
+            the weight, 0 to use each cycle's estimate as is
+
+        Raises
+        ------
+        """
+        self.memory = memory
+
+    def set_bounds(self, lower, upper):
+        """
+        Sets the bounds of the estimates
+
+        Parameters
+        ----------
+        lower: float
+            the lower bound
+        upper: float
+            the upper bound
+
+        Raises
+        ------
+        """
+        self.bounds = (lower, upper)
+
+    def set_rng(self, rng):
+        """
+        Sets the random stream of the additive noise
+
+        Parameters
+        ----------
+        rng: None, int, np.random.Generator or NoiseBlock
+            The stream or its seed, see ens_assim.rng.as_generator
+
+        Raises
+        ------
+        """
+        self.rng = as_generator(rng)
+
+    def estimate(self, Xb, Yb, innov, measure):
+        """
+        Updates the running value from the innovation statistics
+        of one analysis, and returns it. For a stack of ensembles
+        the statistics are summed over the stack
+
+        Parameters
+        ----------
+        Xb: np.ndarray
+            the scaled background anomalies
+        Yb: np.ndarray
+            the scaled background observation anomalies
+        innov: np.ndarray
+            the innovation y0 - H(x_mean)
+        measure: Measure
+            the given Class containing information about measurement
+
+        Raises
+        ------
+        ValueError
+            If additive inflation is used with a nonlinear operator
+        """
+        R = measure.get_covariance()
+        innov = np.broadcast_to(innov, Yb.shape[:-1] + innov.shape[-1:])
+        dRd = np.sum(innov*apply_columns(R.solve, innov))
+        spread = np.sum(Yb*apply_columns(R.solve, Yb))
+        num_obs = innov.size
+        if self.kind == 'multiplicative':
+            estimate = (dRd - num_obs)/spread
+        else:
+            batch = int(np.prod(Yb.shape[:-2]))
+            estimate = (dRd - num_obs - spread)/(batch*self._operator_trace(measure, R, Xb.shape[-2]))
+        estimate = min(max(estimate, self.bounds[0]), self.bounds[1])
+        self.value = self.memory*self.value + (1-self.memory)*estimate
+        return self.value
+
+    def apply(self, Xb, Yb, innov, measure):
+        """
+        Updates the running value from the innovation statistics
+        and inflates the scaled anomalies Xb and Yb in place. The
+        observation anomalies are inflated with the linearization
+        of the measurement operator
+
+        Parameters
+        ----------
+        Xb: np.ndarray
+            the scaled background anomalies
+        Yb: np.ndarray
+            the scaled background observation anomalies
+        innov: np.ndarray
+            the innovation y0 - H(x_mean)
+        measure: Measure
+            the given Class containing information about measurement
+
+        Raises
+        ------
+        ValueError
+            If additive inflation is used with a nonlinear operator
+        """
+        value = self.estimate(Xb, Yb, innov, measure)
+        if self.kind == 'multiplicative':
+            Xb *= np.sqrt(value)
+            Yb *= np.sqrt(value)
+        elif value > 0:
+            ens_num = Xb.shape[-1]
+            noise = as_generator(self.rng).normal(0, np.sqrt(value), Xb.shape)
+            noise = (noise - np.mean(noise,-1,keepdims=1))/np.sqrt(ens_num-1)
+            Xb += noise
+            Yb += measure.apply_operator(noise)
+
+    def _operator_trace(self, measure, R, x_dim):
+        """
+        Computes tr(R^-1 H H^T) for a linear measurement operator,
+        keeping it while the operator and covariance are unchanged.
+        Index selections only need the entries of R^-1 between
+        observations of the same state component, and dense matrices
+        are used as they are. Sparse matrices, LinearOperators and
+        callables are expanded BLOCK_SIZE state columns at a time, so
+        no x_dim x x_dim array is formed
+
+        Parameters
+        ----------
+        measure: Measure
+            the given Class containing information about measurement
+        R: Covariance
+            the measurement error covariance
+        x_dim: int
+            the state dimension
+
+        Raises
+        ------
+        ValueError
+            If the measurement operator is not linear
+        """
+        if not measure.linear:
+            raise ValueError('additive inflation needs a linear measurement operator')
+        operator = measure.operator
+        if self._operator is not None and self._operator[0] is operator and self._operator[1] is R:
+            return self._operator[2]
+        if isinstance(operator, np.ndarray) and operator.ndim == 1:
+            trace = _index_trace(np.arange(x_dim)[operator], R)
+        elif isinstance(operator, np.ndarray):
+            trace = np.sum(operator*R.solve(operator))
+        else:
+            if scipy.sparse.issparse(operator):
+                operator = scipy.sparse.csc_matrix(operator)
+            trace = 0.
+            for start in range(0, x_dim, BLOCK_SIZE):
+                size = min(BLOCK_SIZE, x_dim - start)
+                if scipy.sparse.issparse(operator):
+                    H = operator[:,start:start+size].toarray()
+                else:
+                    H = measure.apply_operator(np.eye(x_dim, size, -start))
+                trace += np.sum(H*R.solve(H))
+        self._operator = (measure.operator, R, trace)
+        return trace
+
+def _index_trace(indices, R):
+    """
+    Computes tr(R^-1 H H^T) for the operator selecting the state
+    components indices, the sum of the entries of R^-1 between
+    observations of the same component. For a diagonal R it is the
+    sum of the inverse variances, otherwise R^-1 is formed
+    BLOCK_SIZE columns at a time
+
+    Parameters
+    ----------
+    indices: np.ndarray
+        the state component of each observation
+    R: Covariance
+        the measurement error covariance
+
+    Raises
+    ------
+    """
+    if isinstance(R, DiagonalCovariance):
+        return np.sum(1/R.diagonal())
+    trace = 0.
+    for start in range(0, R.dim, BLOCK_SIZE):
+        size = min(BLOCK_SIZE, R.dim - start)
+        same = indices[:,None] == indices[None,start:start+size]
+        trace += np.sum(R.solve(np.eye(R.dim, size, -start))[same])
+    return trace
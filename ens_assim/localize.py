@@ -0,0 +1,110 @@
+## This file contains the tapers and distances used to localize the analysis of the
+## ensemble filters to nearby observations
+##
+## Written by: Andrew Pensoneault
+import numpy as np
+import scipy.sparse
+import scipy.spatial
+
+def gaspari_cohn(dist, radius):
+    """
+    Computes the fifth order piecewise rational taper of
+    'Gaspari and Cohn 1999'. The taper is 1 at distance 0,
+    decreases smoothly and vanishes at and beyond radius
+
+    Parameters
+    ----------
+    dist: np.ndarray
+        The nonnegative distances
+    radius: float
+        The distance where the taper reaches 0, twice the
+        half width c of Gaspari and Cohn
+
+    Raises
+    ------
+    """
+    z = np.abs(np.asarray(dist, dtype=float))/(radius/2)
+    taper = np.zeros_like(z)
+    near = z <= 1
+    far = (z > 1) & (z < 2)
+    zn = z[near]
+    taper[near] = (((-.25*zn + .5)*zn + .625)*zn - 5/3)*zn**2 + 1
+    zf = z[far]
+    taper[far] = ((((zf/12 - .5)*zf + .625)*zf + 5/3)*zf - 5)*zf + 4 - 2/(3*zf)
+    return taper
+
+def as_coordinates(coords):
+    """
+    Gets coordinates as a (num_points, num_dims) float array,
+    a 1-D array of coordinates is taken as one dimensional
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        The coordinates
+
+    Raises
+    ------
+    """
+    coords = np.asarray(coords, dtype=float)
+    if coords.ndim == 1:
+        coords = coords[:,None]
+    return coords
+
+def distance(x, y, boxsize=None):
+    """
+    Computes the euclidean distances between the rows of x
+    and the rows of y, with the minimum image convention in
+    each periodic dimension if boxsize is given
+
+    Parameters
+    ----------
+    x, y: np.ndarray
+        The coordinates, of size (num_points, num_dims) and
+        broadcastable against each other
+    boxsize: float, np.ndarray or None
+        The period of each dimension, None if not periodic
+
+    Raises
+    ------
+    """
+    diff = np.abs(x - y)
+    if boxsize is not None:
+        diff = np.mod(diff, boxsize)
+        diff = np.minimum(diff, boxsize - diff)
+    return np.sqrt(np.sum(diff**2, axis=-1))
+
+def taper_matrix(coords_a, coords_b, radius, taper=gaspari_cohn, boxsize=None):
+    """
+    Computes the sparse matrix of taper weights between the points
+    at coords_a and the points at coords_b. Only the pairs closer
+    than radius are found, with KD-trees, so the cost and storage
+    grow with the number of nonzero weights
+
+    Parameters
+    ----------
+    coords_a, coords_b: np.ndarray
+        The coordinates of the points, see as_coordinates
+    radius: float
+        The localization radius
+    taper: type.LambdaType
+        The function taper(dist, radius) giving the weights of
+        points at distances dist
+    boxsize: float, np.ndarray or None
+        The period of each coordinate, None if not periodic
+
+    Raises
+    ------
+    """
+    coords_a = as_coordinates(coords_a)
+    coords_b = as_coordinates(coords_b)
+    if boxsize is not None:
+        coords_a = np.mod(coords_a, boxsize)
+        coords_b = np.mod(coords_b, boxsize)
+    tree_a = scipy.spatial.cKDTree(coords_a, boxsize=boxsize)
+    tree_b = scipy.spatial.cKDTree(coords_b, boxsize=boxsize)
+    pairs = tree_a.sparse_distance_matrix(tree_b, radius, output_type='ndarray')
+    weights = taper(pairs['v'], radius)
+    keep = weights != 0
+    return scipy.sparse.csr_matrix((weights[keep], (pairs['i'][keep], pairs['j'][keep])),
+                                   shape=(len(coords_a), len(coords_b)))
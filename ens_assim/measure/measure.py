@@ -2,7 +2,12 @@
 ## measure.py and give it a method get_current_meas
 ##
 ## Written by: Andrew Pensoneault
+from abc import ABC, abstractmethod
 import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+from ens_assim.rng import as_generator
 
 class Measure(object):
     """
@@ -10,6 +15,14 @@ class Measure(object):
 
     Attributes
     ----------
+    covariance
+        the measurement error covariance as given, assigning it
+        goes through set_covariance
+    operator
+        the measurement operator, assigning it goes through
+        set_operator
+    linear
+        whether the measurement operator is linear
 
     Methods
     -------
@@ -17,26 +30,39 @@ class Measure(object):
         sets the measurement error covariance
     set_measurement(measure)
         sets the measurement for the data
-    set_operator(operator)
+    set_operator(operator, linear=None)
         sets the measurement operator for the data
+    get_covariance()
+        gets the measurement error covariance as a Covariance
+    apply_operator(x)
+        applies the measurement operator to the columns of x
+    log_likelihood(x)
+        computes the gaussian log-likelihood of the measurement for the columns of x
+    set_time(time)
+        sets the time of the measurement
     """
-    def __init__(self, covariance=None, measurement=None, operator=None):
+    def __init__(self, covariance=None, measurement=None, operator=None, linear=None, time=None):
         """
         Initializes Class
         
         Parameters
         ----------
-        covariance: np.ndarray or None
+        covariance: np.ndarray, scipy.sparse.spmatrix, Covariance or None
             the measurement error covariance
         measurement: np.ndarray or None
             the measurement for the data
-        operator: np.ndarray or None
-            the measurement operator for the data
+        operator: callable, np.ndarray, scipy.sparse.spmatrix, LinearOperator or None
+            the measurement operator for the data, see set_operator
+        linear: bool or None
+            whether the operator is linear, see set_operator
+        time: float or None
+            the time of the measurement, used by asynchronous filters
         """
 
-        self.covariance = covariance
+        self.set_covariance(covariance)
         self.measurement = measurement
-        self.operator = operator
+        self.set_operator(operator, linear)
+        self.time = time
 
     def set_covariance(self, covariance):
         """
@@ -44,13 +70,58 @@ class Measure(object):
 
         Parameters
         ----------
-        covariance: np.ndarray
-            the measurement error covariance
+        covariance: np.ndarray, scipy.sparse.spmatrix or Covariance
+            the measurement error covariance, see as_covariance
 
         Raises
         ------
         """
-        self.covariance = covariance
+        self._given_covariance = covariance
+        self._covariance = as_covariance(covariance)
+
+    @property
+    def covariance(self):
+        """
+        Gets the measurement error covariance as given to
+        set_covariance
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        return self._given_covariance
+
+    @covariance.setter
+    def covariance(self, covariance):
+        """
+        Sets the measurement error covariance with set_covariance,
+        so its cached factorizations are replaced
+
+        Parameters
+        ----------
+        covariance: np.ndarray, scipy.sparse.spmatrix or Covariance
+            the measurement error covariance, see as_covariance
+
+        Raises
+        ------
+        """
+        self.set_covariance(covariance)
+
+    def get_covariance(self):
+        """
+        Gets the measurement error covariance as a Covariance,
+        which keeps its cached factorizations until the next
+        call to set_covariance
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        return self._covariance
 
     def set_measurement(self, measurement):
         """
@@ -66,16 +137,740 @@ class Measure(object):
         """
         self.measurement = measurement
     
-    def set_operator(self, operator):
+    def set_time(self, time):
+        """
+        Sets the time of the measurement
+
+        Parameters
+        ----------
+        time: float or None
+            the time of the measurement
+
+        Raises
+        ------
         """
-        Sets the measurement operator for the measurement error
+        self.time = time
+
+    def set_operator(self, operator, linear=None):
+        """
+        Sets the measurement operator for the measurement error.
+        The operator is either a callable acting on the columns of
+        the state, a dense matrix, a scipy.sparse matrix, a
+        LinearOperator, or a 1-D list or array of state indices
+        (or a boolean mask) selecting the observed components
 
         Parameters
         ----------
-        operator: np.ndarray
+        operator: callable, np.ndarray, scipy.sparse.spmatrix, LinearOperator, list or None
             the measurement operator for the data
+        linear: bool or None
+            whether the operator is linear. Matrices, sparse matrices,
+            LinearOperators and index selections are always linear,
+            callables are taken as nonlinear unless linear is True
+
+        Raises
+        ------
+        ValueError
+            if a matrix, sparse matrix, LinearOperator or index selection is declared nonlinear
+        """
+        if isinstance(operator, list):
+            operator = np.asarray(operator)
+        structured = (operator is not None and not callable(operator)) or \
+            isinstance(operator, scipy.sparse.linalg.LinearOperator)
+        if structured and linear is False:
+            raise ValueError('matrix and index operators are linear')
+        self._operator = operator
+        self.linear = structured or bool(linear)
+
+    @property
+    def operator(self):
+        """
+        Gets the measurement operator
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        return self._operator
+
+    @operator.setter
+    def operator(self, operator):
+        """
+        Sets the measurement operator with set_operator, so its
+        linearity is found again
+
+        Parameters
+        ----------
+        operator: callable, np.ndarray, scipy.sparse.spmatrix, LinearOperator, list or None
+            the measurement operator for the data, see set_operator
+
+        Raises
+        ------
+        """
+        self.set_operator(operator)
+
+    def apply_operator(self, x):
+        """
+        Applies the measurement operator to the columns of x. Index
+        selections are applied as x[...,operator,:], without a matrix
+        product, and sparse matrices and LinearOperators with their
+        own products. A stack of ensembles is passed to callables as is
+
+        Parameters
+        ----------
+        x: np.ndarray
+            the states, of size (x_dim, ens_num) or a stack
+            (..., x_dim, ens_num)
+
+        Raises
+        ------
+        """
+        operator = self.operator
+        if isinstance(operator, scipy.sparse.linalg.LinearOperator):
+            return apply_columns(operator.matmat, x)
+        elif scipy.sparse.issparse(operator):
+            return apply_columns(lambda y: np.asarray(operator @ y), x)
+        elif isinstance(operator, np.ndarray):
+            if operator.ndim == 1:
+                return x[...,operator,:]
+            return operator @ x
+        return operator(x)
+
+    def log_likelihood(self, x):
+        """
+        Computes the gaussian log-likelihood
+        -1/2 (y - H(x))^T R^-1 (y - H(x)) - 1/2 log det(2 pi R)
+        of the measurement y for every column of x, with one
+        whitening solve against the cached factorization of R
+
+        Parameters
+        ----------
+        x: np.ndarray
+            the states, of size (x_dim, ens_num)
+
+        Raises
+        ------
+        """
+        R = self.get_covariance()
+        residual = self.measurement - self.apply_operator(x)
+        return -.5*(R.mahalanobis(residual) + R.logdet() + R.dim*np.log(2*np.pi))
+
+class Covariance(ABC):
+    """
+    The abstract base class used to represent a measurement error
+    covariance R. Each subclass stores R in a structured form and
+    computes its factorizations once, on first use, so repeated
+    analyses with the same covariance only pay for the applies.
+    Covariances are not modified after creation, a new covariance
+    is set with Measure.set_covariance
+
+    Attributes
+    ----------
+    dim
+        the dimension of the measurement
+
+    Methods
+    -------
+    solve(y)
+        Applies the inverse of R to the columns of y
+    sqrt_apply(z)
+        Applies a square root L, with L L^T = R, to the columns of z
+    whiten(y)
+        Applies the inverse of L to the columns of y
+    mahalanobis(y)
+        Computes y^T R^-1 y for each column of y
+    logdet()
+        Computes the log determinant of R
+    sample(size, rng=None)
+        Draws size samples of zero mean noise with covariance R
+    diagonal()
+        Gets the diagonal of R
+    is_diagonal()
+        Checks whether R is diagonal
+    to_dense()
+        Gets R as a dense array
+    to_sparse()
+        Gets R as a scipy.sparse csc matrix
+    """
+    @abstractmethod
+    def __init__(self, dim):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        dim: int
+            the dimension of the measurement
+        """
+        self.dim = dim
+
+    @abstractmethod
+    def solve(self, y):
+        """
+        Applies the inverse of R to the columns of y
+
+        Parameters
+        ----------
+        y: np.ndarray
+            the (dim, k) array to solve against
+
+        Raises
+        ------
+        """
+
+    @abstractmethod
+    def sqrt_apply(self, z):
+        """
+        Applies a square root L, with L L^T = R, to the columns of z
+
+        Parameters
+        ----------
+        z: np.ndarray
+            the (dim, k) array to apply L to
+
+        Raises
+        ------
+        """
+
+    @abstractmethod
+    def whiten(self, y):
+        """
+        Applies the inverse of the square root L to the columns of y
+
+        Parameters
+        ----------
+        y: np.ndarray
+            the (dim, k) array to whiten
+
+        Raises
+        ------
+        """
+
+    @abstractmethod
+    def logdet(self):
+        """
+        Computes the log determinant of R
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+
+    @abstractmethod
+    def diagonal(self):
+        """
+        Gets the diagonal of R
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+
+    def is_diagonal(self):
+        """
+        Checks whether R is diagonal from its structure, by
+        the off-diagonal nonzeros of R.to_sparse()
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        S = self.to_sparse()
+        return scipy.sparse.triu(S, 1).count_nonzero() == 0 and scipy.sparse.tril(S, -1).count_nonzero() == 0
+
+    @abstractmethod
+    def to_dense(self):
+        """
+        Gets R as a dense array
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+
+    def to_sparse(self):
+        """
+        Gets R as a scipy.sparse csc matrix
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        return scipy.sparse.csc_matrix(self.to_dense())
+
+    def mahalanobis(self, y):
+        """
+        Computes y^T R^-1 y for each column of y
+
+        Parameters
+        ----------
+        y: np.ndarray
+            the (dim, k) array of residuals
+
+        Raises
+        ------
+        """
+        white = self.whiten(y)
+        return np.sum(white*white, axis=0)
+
+    def sample(self, size, rng=None):
+        """
+        Draws size samples of zero mean gaussian noise with
+        covariance R, as the columns of a (dim, size) array
+
+        Parameters
+        ----------
+        size: int
+            the number of samples
+        rng: None, int or np.random.Generator
+            the random stream, see ens_assim.rng.as_generator
+
+        Raises
+        ------
+        """
+        return self.sqrt_apply(as_generator(rng).normal(0,1,(self.dim,size)))
+
+class DenseCovariance(Covariance):
+    """
+    A covariance stored as a dense symmetric positive definite
+    array, with its Cholesky factor cached
+
+    Attributes
+    ----------
+    covariance
+        the dense covariance array
+    """
+    def __init__(self, covariance):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        covariance: np.ndarray
+            the (dim, dim) covariance
+        """
+        super().__init__(covariance.shape[0])
+        self.covariance = covariance
+        self._cholesky = None
+
+    def cholesky(self):
+        """
+        Gets the cached lower Cholesky factor of R
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        if self._cholesky is None:
+            self._cholesky = scipy.linalg.cholesky(self.covariance, lower=True)
+        return self._cholesky
+
+    def solve(self, y):
+        return scipy.linalg.cho_solve((self.cholesky(), True), y)
+
+    def sqrt_apply(self, z):
+        return self.cholesky() @ z
+
+    def whiten(self, y):
+        return scipy.linalg.solve_triangular(self.cholesky(), y, lower=True)
+
+    def logdet(self):
+        return 2*np.sum(np.log(np.diag(self.cholesky())))
+
+    def diagonal(self):
+        return np.diag(self.covariance)
+
+    def is_diagonal(self):
+        return np.count_nonzero(self.covariance) == np.count_nonzero(np.diag(self.covariance))
+
+    def to_dense(self):
+        return self.covariance
+
+class DiagonalCovariance(Covariance):
+    """
+    A diagonal covariance of uncorrelated measurement errors
+
+    Attributes
+    ----------
+    variances
+        the diagonal of the covariance
+    """
+    def __init__(self, variances):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        variances: np.ndarray
+            the diagonal of the covariance
+        """
+        variances = np.asarray(variances, dtype=float).flatten()
+        super().__init__(len(variances))
+        self.variances = variances
+        self._std = np.sqrt(variances)
+
+    def solve(self, y):
+        return y/_column(self.variances, y)
+
+    def sqrt_apply(self, z):
+        return _column(self._std, z)*z
+
+    def whiten(self, y):
+        return y/_column(self._std, y)
+
+    def logdet(self):
+        return np.sum(np.log(self.variances))
+
+    def diagonal(self):
+        return self.variances
+
+    def is_diagonal(self):
+        return True
+
+    def to_dense(self):
+        return np.diag(self.variances)
+
+    def to_sparse(self):
+        return scipy.sparse.diags(self.variances, format='csc')
+
+class BandedCovariance(Covariance):
+    """
+    A banded covariance given in the lower banded storage of
+    scipy.linalg.cholesky_banded, ab[i, j] = R[i + j, j], with
+    its banded Cholesky factor cached
+
+    Attributes
+    ----------
+    ab
+        the (bandwidth + 1, dim) lower banded covariance
+    """
+    def __init__(self, ab):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        ab: np.ndarray
+            the (bandwidth + 1, dim) lower banded covariance
+        """
+        super().__init__(ab.shape[1])
+        self.ab = ab
+        self._cholesky = None
+
+    def cholesky(self):
+        """
+        Gets the cached lower banded Cholesky factor of R
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        if self._cholesky is None:
+            self._cholesky = scipy.linalg.cholesky_banded(self.ab, lower=True)
+        return self._cholesky
+
+    def solve(self, y):
+        return scipy.linalg.cho_solve_banded((self.cholesky(), True), y)
+
+    def sqrt_apply(self, z):
+        cb = self.cholesky()
+        Lz = cb[0][:,None]*z if z.ndim > 1 else cb[0]*z
+        for i in range(1, cb.shape[0]):
+            Lz[i:] += (cb[i,:-i][:,None] if z.ndim > 1 else cb[i,:-i])*z[:-i]
+        return Lz
+
+    def whiten(self, y):
+        bandwidth = self.ab.shape[0] - 1
+        return scipy.linalg.solve_banded((bandwidth, 0), self.cholesky(), y)
+
+    def logdet(self):
+        return 2*np.sum(np.log(self.cholesky()[0]))
+
+    def diagonal(self):
+        return self.ab[0]
+
+    def is_diagonal(self):
+        return not any(np.any(self.ab[i,:self.dim-i]) for i in range(1, self.ab.shape[0]))
+
+    def to_dense(self):
+        R = np.diag(self.ab[0])
+        for i in range(1, self.ab.shape[0]):
+            R += np.diag(self.ab[i,:-i], -i) + np.diag(self.ab[i,:-i], i)
+        return R
+
+    def to_sparse(self):
+        bands = [self.ab[0]] + [self.ab[i,:-i] for i in range(1, self.ab.shape[0])]*2
+        offsets = [0] + list(range(-1, -self.ab.shape[0], -1)) + list(range(1, self.ab.shape[0]))
+        return scipy.sparse.diags(bands, offsets, format='csc')
+
+class SparseCovariance(Covariance):
+    """
+    A covariance stored as a scipy.sparse matrix. A sparse
+    LDL^T factorization, computed once by a symmetric mode
+    sparse LU with fill reducing ordering, gives the solves,
+    square root and log determinant
+
+    Attributes
+    ----------
+    covariance
+        the sparse covariance matrix
+    """
+    def __init__(self, covariance):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        covariance: scipy.sparse.spmatrix
+            the (dim, dim) covariance
+        """
+        super().__init__(covariance.shape[0])
+        self.covariance = scipy.sparse.csc_matrix(covariance)
+        self._factor = None
+
+    def factor(self):
+        """
+        Gets the cached factorization P R P^T = (L D^1/2)(L D^1/2)^T,
+        as the permutation, the sparse factor L D^1/2 and D
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        ValueError
+            If the covariance is not symmetric positive definite
+        """
+        if self._factor is None:
+            lu = scipy.sparse.linalg.splu(self.covariance, permc_spec='MMD_AT_PLUS_A',
+                                          diag_pivot_thresh=0., options={'SymmetricMode':True})
+            d = lu.U.diagonal()
+            if np.any(lu.perm_r != lu.perm_c) or np.any(d <= 0):
+                raise ValueError('covariance must be symmetric positive definite')
+            self._factor = (lu.perm_r, scipy.sparse.csr_matrix(lu.L @ scipy.sparse.diags(np.sqrt(d))), d)
+        return self._factor
+
+    def solve(self, y):
+        perm, L, _ = self.factor()
+        w = self.whiten(y)
+        u = scipy.sparse.linalg.spsolve_triangular(L.T.tocsr(), w, lower=False)
+        return u[perm]
+
+    def sqrt_apply(self, z):
+        perm, L, _ = self.factor()
+        return (L @ z)[perm]
+
+    def whiten(self, y):
+        perm, L, _ = self.factor()
+        u = np.empty(y.shape)
+        u[perm] = y
+        return scipy.sparse.linalg.spsolve_triangular(L, u, lower=True)
+
+    def logdet(self):
+        return np.sum(np.log(self.factor()[2]))
+
+    def diagonal(self):
+        return self.covariance.diagonal()
+
+    def to_dense(self):
+        return self.covariance.toarray()
+
+    def to_sparse(self):
+        return self.covariance
+
+class LowRankCovariance(Covariance):
+    """
+    A covariance R = D + U U^T of a diagonal plus a rank k
+    term. Solves use the Woodbury identity with the cached
+    Cholesky factor of the k x k capacitance I + U^T D^-1 U.
+    The square root is the symmetric L = D^1/2 (I + V V^T)^1/2
+    with V = D^-1/2 U, applied through the cached thin SVD
+    V = Q S W^T as
+
+        (I + V V^T)^(+-1/2) = I + Q ((1 + S^2)^(+-1/2) - 1) Q^T
+
+    which costs O(dim k^2) once. Every apply costs O(dim k)
+
+    Attributes
+    ----------
+    variances
+        the diagonal D
+    factor
+        the (dim, k) low rank factor U
+    """
+    def __init__(self, variances, factor):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        variances: np.ndarray
+            the diagonal D
+        factor: np.ndarray
+            the (dim, k) low rank factor U
+        """
+        variances = np.asarray(variances, dtype=float).flatten()
+        super().__init__(len(variances))
+        self.variances = variances
+        self.factor = factor
+        self._capacitance = None
+        self._root = None
+
+    def capacitance(self):
+        """
+        Gets the cached lower Cholesky factor of the
+        capacitance I + U^T D^-1 U
+
+        Parameters
+        ----------
 
         Raises
         ------
         """
-        self.operator = operator
+        if self._capacitance is None:
+            rank = self.factor.shape[1]
+            C = np.eye(rank) + self.factor.T @ (self.factor/self.variances[:,None])
+            self._capacitance = scipy.linalg.cholesky(C, lower=True)
+        return self._capacitance
+
+    def solve(self, y):
+        Diy = y/_column(self.variances, y)
+        correction = scipy.linalg.cho_solve((self.capacitance(), True), self.factor.T @ Diy)
+        return Diy - (self.factor @ correction)/_column(self.variances, y)
+
+    def root(self):
+        """
+        Gets the cached thin SVD of V = D^-1/2 U, as its left
+        singular vectors Q and singular values S
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        if self._root is None:
+            V = self.factor/np.sqrt(self.variances)[:,None]
+            Q, S, _ = np.linalg.svd(V, full_matrices=False)
+            self._root = (Q, S)
+        return self._root
+
+    def _root_apply(self, y, power):
+        """
+        Applies (I + V V^T)^power to the columns of y
+
+        Parameters
+        ----------
+        y: np.ndarray
+            the (dim, k) array to apply the power to
+        power: float
+            1/2 or -1/2
+
+        Raises
+        ------
+        """
+        Q, S = self.root()
+        Qy = Q.T @ y
+        return y + Q @ (_column((1 + S**2)**power - 1, Qy)*Qy)
+
+    def sqrt_apply(self, z):
+        return _column(np.sqrt(self.variances), z)*self._root_apply(z, .5)
+
+    def whiten(self, y):
+        return self._root_apply(y/_column(np.sqrt(self.variances), y), -.5)
+
+    def mahalanobis(self, y):
+        return np.sum(y*self.solve(y), axis=0)
+
+    def logdet(self):
+        return np.sum(np.log(self.variances)) + 2*np.sum(np.log(np.diag(self.capacitance())))
+
+    def diagonal(self):
+        return self.variances + np.sum(self.factor**2, axis=1)
+
+    def is_diagonal(self):
+        # U U^T and U^T U have the same Frobenius norm, which is that of the
+        # diagonal of U U^T alone exactly when U U^T is diagonal
+        gram = np.sum((self.factor.T @ self.factor)**2)
+        return np.isclose(gram, np.sum(np.sum(self.factor**2, axis=1)**2), rtol=1e-12, atol=0)
+
+    def to_dense(self):
+        return np.diag(self.variances) + self.factor @ self.factor.T
+
+def as_covariance(covariance):
+    """
+    Wraps a covariance in a Covariance object: Covariance objects
+    are returned as they are, scipy.sparse matrices are wrapped
+    in a SparseCovariance, 1-D arrays are taken as the diagonal
+    of a DiagonalCovariance and 2-D arrays as a DenseCovariance
+
+    Parameters
+    ----------
+    covariance: Covariance, np.ndarray or scipy.sparse.spmatrix
+        the measurement error covariance
+
+    Raises
+    ------
+    """
+    if covariance is None or isinstance(covariance, Covariance):
+        return covariance
+    if scipy.sparse.issparse(covariance):
+        return SparseCovariance(covariance)
+    covariance = np.asarray(covariance)
+    if covariance.ndim == 1:
+        return DiagonalCovariance(covariance)
+    return DenseCovariance(covariance)
+
+def apply_columns(f, y):
+    """
+    Applies f, which acts on the columns of a 2-D array, to the
+    columns of y or of every matrix in a stack y of shape
+    (..., dim, k), with a single call on the stacked columns
+
+    Parameters
+    ----------
+    f: type.LambdaType
+        The function of a (dim, m) array
+    y: np.ndarray
+        The (dim, k) array or (..., dim, k) stack
+
+    Raises
+    ------
+    """
+    if y.ndim <= 2:
+        return f(y)
+    columns = np.moveaxis(y, -2, 0)
+    fy = f(columns.reshape(y.shape[-2], -1))
+    return np.moveaxis(fy.reshape((fy.shape[0],) + columns.shape[1:]), 0, -2)
+
+def _column(values, y):
+    """
+    Shapes values to broadcast against the rows of y
+
+    Parameters
+    ----------
+    values: np.ndarray
+        the (dim,) values
+    y: np.ndarray
+        the (dim,) or (dim, k) array
+
+    Raises
+    ------
+    """
+    return values[:,None] if y.ndim > 1 else values
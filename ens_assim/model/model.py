@@ -4,6 +4,7 @@
 ## Written by: Andrew Pensoneault
 from abc import ABC, abstractmethod
 import numpy as np
+from ens_assim import parallel
 
 class Model(ABC):
     """
@@ -15,12 +16,19 @@ class Model(ABC):
         The initial condition of the model
     ens_num
         the number of ensemble members
+    backend
+        the execution backend, 'serial' or 'process'
+    max_workers
+        the number of worker processes of the 'process'
+        backend, None for the number of cpus
 
     Methods
     -------
     set_initial_conditions(initial_conditions)
         Sets the initial condition, and gets the number of
         ensemble member
+    set_backend(backend, max_workers)
+        Sets the execution backend of the model
     advance(state, measure)
         Advances the model forward one step
     """
@@ -40,6 +48,8 @@ class Model(ABC):
 
         self.initial_conditions = initial_conditions
         self.ens_num = initial_conditions.shape[1]
+        self.backend = 'serial'
+        self.max_workers = None
     
     def set_initial_conditions(self, initial_conditions):
         """
@@ -57,6 +67,30 @@ class Model(ABC):
         self.initial_conditions = initial_conditions
         self.ens_num = initial_conditions.shape[1]
 
+    def set_backend(self, backend, max_workers=None):
+        """
+        Sets the execution backend of the model. With 'process'
+        the ensemble members are split across a pool of worker
+        processes, models which do not support it run serially
+
+        Parameters
+        ----------
+        backend : str
+            The backend, 'serial' or 'process'
+        max_workers : int or None
+            The number of worker processes, None for the
+            number of cpus
+
+        Raises
+        ------
+        ValueError
+            If backend is not 'serial' or 'process'
+        """
+        if backend not in ('serial', 'process'):
+            raise ValueError('backend must be "serial" or "process"')
+        self.backend = backend
+        self.max_workers = max_workers
+
     def advance(self):
         """
         Advances the model forward one step
@@ -135,20 +169,45 @@ class ODE(Model):
         the dictionary containing solver dict
     num_steps
         the number of steps for the solver
+    workspace
+        the dictionary of buffers the solver reuses
+        between steps and calls to advance
+    t
+        the current time of the ODE clock
+    state
+        the current state of the ensemble
+    params
+        the (n_params, ens_num) parameters of each
+        ensemble member, or None
 
     Methods
     -------
+    set_initial_conditions(initial_conditions)
+        Sets the initial condition and the current state
     set_solver(solver)
         Sets the solver of the ODE
     set_rhs(rhs)
         Sets the RHS function of the ODE
+    set_parameters(params)
+        Sets the parameters of each ensemble member
+    get_augmented_state()
+        Gets the current state stacked on the parameters
+    set_augmented_state(augmented_state)
+        Sets the current state and parameters from a stack
     set_t0(t0)
         Sets the initial time for the ODE
     set_solve_dict(solve_dict)
         Sets the stepsize of the ODE
     set_num_steps(num_steps)
         Sets the number of steps of the ODE
-    
+    set_backend(backend, max_workers)
+        Sets the execution backend of the ODE
+    advance()
+        Advances the ODE forward num_steps steps from t0
+    advance_by(num_steps)
+        Advances the current state forward num_steps steps
+    advance_to(t)
+        Advances the current state forward to time t
     """
     def __init__(self, initial_conditions):
         """
@@ -168,6 +227,28 @@ class ODE(Model):
         self.t0 = None
         self.solver_dict = None
         self.num_steps = None
+        self.workspace = {}
+        self.t = None
+        self.state = initial_conditions
+        self.params = None
+        self._pool = None
+
+    def set_initial_conditions(self, initial_conditions):
+        """
+        Sets the initial condition for the model, which also
+        replaces the current state without moving the clock,
+        e.g. after an analysis
+
+        Parameters
+        ----------
+        initial_conditions : np.ndarray
+            The initial condition for the model
+
+        Raises
+        ------
+        """
+        super().set_initial_conditions(initial_conditions)
+        self.state = initial_conditions
 
     def set_solver(self, solver):
         """
@@ -176,12 +257,15 @@ class ODE(Model):
         Parameters
         ----------
         Solver: type.LambdaType
-            The solver of the ode
+            The solver of the ode, called as
+            solver(t0, x0, rhs, num_steps, solver_dict, workspace=workspace)
 
         Raises
         ------
         """
         self.solver = solver
+        self.workspace = {}
+        self._close_pool()
 
     def set_rhs(self, rhs):
         """
@@ -196,6 +280,64 @@ class ODE(Model):
         ------
         """
         self.rhs = rhs
+        self._close_pool()
+
+    def set_parameters(self, params):
+        """
+        Sets the parameters of each ensemble member. Once set,
+        the rhs is called as rhs(t, x, p), with p the columns of
+        params belonging to the members in x, so an ensemble of
+        differently configured models is advanced together
+
+        Parameters
+        ----------
+        params: np.ndarray or None
+            The (n_params, ens_num) parameters, None to call
+            the rhs without parameters
+
+        Raises
+        ------
+        ValueError
+            If params does not have one column per member
+        """
+        if params is not None and (params.ndim != 2 or params.shape[1] != self.ens_num):
+            raise ValueError('params must be of shape (n_params, ens_num)')
+        self.params = params
+
+    def get_augmented_state(self):
+        """
+        Gets the current state with the parameters stacked
+        below it, so that an analysis can update the state
+        and parameters jointly
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        if self.params is None:
+            return self.state
+        return np.vstack((self.state, self.params))
+
+    def set_augmented_state(self, augmented_state):
+        """
+        Sets the current state and parameters from a stack
+        as returned by get_augmented_state, e.g. after an
+        analysis
+
+        Parameters
+        ----------
+        augmented_state: np.ndarray
+            The state stacked on the parameters
+
+        Raises
+        ------
+        """
+        x_dim = self.state.shape[0]
+        self.set_initial_conditions(augmented_state[:x_dim])
+        if self.params is not None:
+            self.set_parameters(augmented_state[x_dim:])
 
     def set_t0(self, t0):
         """
@@ -210,6 +352,7 @@ class ODE(Model):
         ------
         """
         self.t0 = t0
+        self.t = t0
 
     def set_solver_dict(self, solver_dict):
         """
@@ -241,26 +384,495 @@ class ODE(Model):
     def advance(self):
         """
         Advances the model forward n step 
-        using the solver
+        using the solver. Returns the states and times, or
+        a generator of (t, state) pairs if the solver_dict
+        sets 'output' to 'generator'
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        return self._integrate(self.t0,self.initial_conditions,self.num_steps)
+
+    def advance_by(self, num_steps):
+        """
+        Advances the current state forward num_steps steps
+        from the current time, then moves the clock and the
+        current state to the end of the integration. Returns
+        the same output as advance. In generator mode the
+        clock and state follow the yielded pairs
+
+        Parameters
+        ----------
+        num_steps: int
+            The number of steps
+
+        Raises
+        ------
+        ValueError
+            If num_steps is not a multiple of output_every
+        """
+        output_every = self.solver_dict.get('output_every', 1)
+        if num_steps % output_every != 0:
+            raise ValueError('num_steps must be a multiple of output_every')
+        result = self._integrate(self.t, self.state, num_steps)
+        if self.solver_dict.get('output', 'all') == 'generator':
+            return self._track(result)
+        x, t = result
+        if num_steps > 0:
+            self.t = t[-1]
+            self.state = np.ascontiguousarray(x[:,:,-1])
+        return x, t
+
+    def advance_to(self, t):
+        """
+        Advances the current state forward from the current
+        time to time t, which must lie a whole number of steps
+        of size solver_dict['h'] ahead. Returns the same output
+        as advance
+
+        Parameters
+        ----------
+        t: int or float
+            The time to advance to
+
+        Raises
+        ------
+        ValueError
+            If t is not a whole number of steps ahead
+        """
+        h = self.solver_dict['h']
+        num_steps = int(round((t - self.t)/h))
+        if num_steps < 0 or abs(num_steps*h - (t - self.t)) > 1e-9*max(1., abs(t)):
+            raise ValueError('t must be a whole number of steps after the current time')
+        result = self.advance_by(num_steps)
+        if self.solver_dict.get('output', 'all') != 'generator':
+            self.t = t
+        return result
+
+    def _integrate(self, t0, x0, num_steps):
+        """
+        Integrates num_steps steps from t0 and x0 with the
+        solver on the current backend
+
+        Parameters
+        ----------
+        t0: int or float
+            The initial time
+        x0: np.ndarray
+            The initial condition
+        num_steps: int
+            The number of steps
+
+        Raises
+        ------
+        """
+        if self.backend == 'process':
+            return self._advance_process(t0,x0,num_steps)
+        if self.params is not None:
+            return self.solver(t0,x0,self.rhs,num_steps,self.solver_dict,workspace=self.workspace,
+                               params=self.params)
+        return self.solver(t0,x0,self.rhs,num_steps,self.solver_dict,workspace=self.workspace)
+
+    def _track(self, steps):
+        """
+        Moves the clock and current state along with the
+        pairs yielded in generator mode
+
+        Parameters
+        ----------
+        steps: generator
+            Generator of (t, state) pairs
+
+        Raises
+        ------
+        """
+        for t, x in steps:
+            self.t = t
+            self.state = x
+            yield t, x
+
+    def set_backend(self, backend, max_workers=None):
+        """
+        Sets the execution backend of the ode. With 'process'
+        the ensemble columns are split across a pool of worker
+        processes which read the initial conditions and write
+        their trajectories through shared memory. The pool is
+        kept between calls to advance until the solver, rhs or
+        backend changes. The generator output mode is only
+        available with the 'serial' backend
+
+        Parameters
+        ----------
+        backend : str
+            The backend, 'serial' or 'process'
+        max_workers : int or None
+            The number of worker processes, None for the
+            number of cpus
+
+        Raises
+        ------
+        ValueError
+            If backend is not 'serial' or 'process'
+        """
+        super().set_backend(backend, max_workers)
+        self._close_pool()
+
+    def _advance_process(self, t0, x0, num_steps):
+        """
+        Advances the ensemble num_steps steps with the
+        columns split across the process pool
+
+        Parameters
+        ----------
+        t0: int or float
+            The initial time
+        x0: np.ndarray
+            The initial condition
+        num_steps: int
+            The number of steps
+
+        Raises
+        ------
+        ValueError
+            If the solver_dict asks for generator output
+        """
+        if self.solver_dict.get('output', 'all') == 'generator':
+            raise ValueError('generator output is not supported by the process backend')
+        if self._pool is None:
+            self._pool = parallel.make_pool(self.max_workers, _init_worker, (self.solver, self.rhs))
+
+        x_dim = x0.shape[0]
+        ens_num = x0.shape[1]
+        out_shape = (x_dim, ens_num, _num_outputs(num_steps, self.solver_dict))
+        x0_shm, _ = parallel.create(x0.shape, x0)
+        out_shm, out = parallel.create(out_shape)
+        try:
+            futures = [self._pool.submit(_advance_columns, x0_shm.name, x0.shape, out_shm.name,
+                                         out_shape, members, t0, num_steps, self.solver_dict,
+                                         None if self.params is None else self.params[:,members])
+                       for members in parallel.split(ens_num, parallel.num_workers(self.max_workers))]
+            t = [future.result() for future in futures][0]
+            x = out.copy()
+        finally:
+            del out
+            for shm in (x0_shm, out_shm):
+                shm.close()
+                shm.unlink()
+        return x, t
+
+    def _close_pool(self):
+        """
+        Shuts down the process pool, if any
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        if getattr(self, '_pool', None) is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+class Lorenz96(ODE):
+    """
+    The Lorenz 96 model
+
+        dx_i/dt = (x_{i+1} - x_{i-2}) x_{i-1} - x_i + F
+
+    with periodic indices, for any state dimension of at least
+    four. The rhs is evaluated in place on the whole ensemble,
+    and by default the model is advanced with rk4 from t0 = 0
+    with step size 0.05
+
+    Attributes
+    ----------
+    forcing
+        the constant forcing F
+
+    Methods
+    -------
+    set_forcing(forcing)
+        Sets the forcing of the model
+    set_solver_dict(solver_dict)
+        Sets the solver parameters, adding the in place flag
+    tendency(t, x, out)
+        Evaluates the rhs of the model into out
+    """
+    def __init__(self, initial_conditions, forcing=8.):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        initial_conditions : np.ndarray
+            The initial condition for the model
+        forcing : float
+            The constant forcing F
+
+        Raises
+        ------
+        ValueError
+            If the state dimension is less than four
+        """
+        super().__init__(initial_conditions)
+        if initial_conditions.shape[0] < 4:
+            raise ValueError('Lorenz96 needs a state dimension of at least 4')
+        self.forcing = forcing
+        self.set_solver(rk4)
+        self.set_solver_dict({'h':.05, 'in_place':True})
+        self.set_rhs(self.tendency)
+        self.set_t0(0)
+
+    def set_forcing(self, forcing):
+        """
+        Sets the forcing of the model, and shuts down the
+        process pool, whose workers hold the old forcing
+
+        Parameters
+        ----------
+        forcing : float
+            The constant forcing F
+
+        Raises
+        ------
+        """
+        self.forcing = forcing
+        self._close_pool()
+
+    def set_solver_dict(self, solver_dict):
+        """
+        Sets the solver parameter dictionary, adding the
+        in_place flag of the rhs if it is missing
+
+        Parameters
+        ----------
+        solver_dict: Dict
+            The dictionary containing the 
+            solver parameters
+
+        Raises
+        ------
+        """
+        solver_dict = dict(solver_dict)
+        solver_dict.setdefault('in_place', True)
+        super().set_solver_dict(solver_dict)
+
+    def tendency(self, t, x, out):
+        """
+        Evaluates the rhs of the model into out
+
+        Parameters
+        ----------
+        t : float
+            The current time
+        x : np.ndarray
+            The (x_dim, members) states
+        out : np.ndarray
+            The (x_dim, members) array the rhs is written to
+
+        Raises
+        ------
+        """
+        out[:-1] = x[1:]
+        out[-1] = x[0]
+        out[2:] -= x[:-2]
+        out[:2] -= x[-2:]
+        out[1:] *= x[:-1]
+        out[0] *= x[-1]
+        out -= x
+        out += self.forcing
+
+class KuramotoSivashinsky(ODE):
+    """
+    The Kuramoto-Sivashinsky equation
+
+        u_t = -u u_x - u_xx - u_xxxx
+
+    on the periodic domain [0, length) sampled at x_dim equally
+    spaced points. The stiff linear part is diagonal in Fourier
+    space, so by default the model is advanced with etdrk4 from
+    t0 = 0 with step size 0.25, the nonlinear term being evaluated
+    on the whole ensemble of Fourier coefficients at once
+
+    Attributes
+    ----------
+    length
+        the length of the periodic domain
+    wavenumbers
+        the wavenumbers of the real Fourier coefficients
+
+    Methods
+    -------
+    set_length(length)
+        Sets the length of the domain
+    set_solver_dict(solver_dict)
+        Sets the solver parameters, adding the linear operator
+    nonlinear(t, v)
+        Evaluates the nonlinear term in Fourier space
+    """
+    def __init__(self, initial_conditions, length=32*np.pi):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        initial_conditions : np.ndarray
+            The initial condition for the model
+        length : float
+            The length of the periodic domain
+
+        Raises
+        ------
+        """
+        super().__init__(initial_conditions)
+        self.set_length(length)
+        self.set_solver(etdrk4)
+        self.set_solver_dict({'h':.25})
+        self.set_rhs(self.nonlinear)
+        self.set_t0(0)
+
+    def set_length(self, length):
+        """
+        Sets the length of the domain, and the linear
+        operator of the solver_dict, and shuts down the
+        process pool, whose workers hold the old operators
+
+        Parameters
+        ----------
+        length : float
+            The length of the periodic domain
+
+        Raises
+        ------
+        """
+        x_dim = self.initial_conditions.shape[0]
+        self.length = length
+        self.wavenumbers = 2*np.pi/length*np.fft.rfftfreq(x_dim, 1/x_dim)
+        self._derivative = -0.5j*self.wavenumbers[:,None]
+        if self.solver_dict is not None:
+            self.solver_dict['linear'] = self.wavenumbers**2 - self.wavenumbers**4
+        self._close_pool()
+
+    def set_solver_dict(self, solver_dict):
+        """
+        Sets the solver parameter dictionary, adding the
+        linear operator of the equation if it is missing
+
+        Parameters
+        ----------
+        solver_dict: Dict
+            The dictionary containing the 
+            solver parameters
+
+        Raises
+        ------
+        """
+        solver_dict = dict(solver_dict)
+        solver_dict.setdefault('linear', self.wavenumbers**2 - self.wavenumbers**4)
+        super().set_solver_dict(solver_dict)
+
+    def nonlinear(self, t, v):
+        """
+        Evaluates the nonlinear term -u u_x = -(u^2)_x / 2
+        in Fourier space
 
         Parameters
         ----------
+        t : float
+            The current time
+        v : np.ndarray
+            The (x_dim//2 + 1, members) Fourier coefficients
 
         Raises
         ------
         """
-        state, t = self.solver(self.t0,self.initial_conditions,self.rhs,self.num_steps,self.solver_dict)
-        return state, t
+        x_dim = self.initial_conditions.shape[0]
+        u = np.fft.irfft(v, n=x_dim, axis=0)
+        return self._derivative*np.fft.rfft(u*u, axis=0)
 
+_WORKER = {}
 
+def _init_worker(solver, rhs):
+    """
+    Stores the solver and rhs in a pool worker
 
+    Parameters
+    ----------
+    solver: type.LambdaType
+        The solver of the ode
+    rhs: type.LambdaType
+        The right hand side of the ODE
 
+    Raises
+    ------
+    """
+    _WORKER['solver'] = solver
+    _WORKER['rhs'] = rhs
+    _WORKER['workspace'] = {}
 
-def rk4(t0, x0, rhs, num_steps,solver_dict):
+def _advance_columns(x0_name, x0_shape, out_name, out_shape, members, t0, num_steps, solver_dict, params=None):
+    """
+    Advances a slice of ensemble members in a pool worker,
+    reading and writing the shared memory arrays in place.
+    Returns the output times
+
+    Parameters
+    ----------
+    x0_name, out_name: str
+        The names of the shared initial condition and output
+    x0_shape, out_shape: tuple
+        The shapes of the shared initial condition and output
+    members: slice
+        The ensemble members advanced by this worker
+    t0: int or float
+        The initial time
+    num_steps: int
+        The number of steps
+    solver_dict: Dict
+        The dictionary containing the solver parameters
+    params: np.ndarray or None
+        The parameters of the members advanced by this worker
+
+    Raises
+    ------
+    """
+    x0_shm, x0 = parallel.attach(x0_name, x0_shape)
+    out_shm, out = parallel.attach(out_name, out_shape)
+    kwargs = {} if params is None else {'params': params}
+    try:
+        x, t = _WORKER['solver'](t0, x0[:,members], _WORKER['rhs'], num_steps, solver_dict,
+                                 workspace=_WORKER['workspace'], **kwargs)
+        out[:,members,:] = x
+    finally:
+        del x0, out
+        x0_shm.close()
+        out_shm.close()
+    return t
+
+
+
+
+
+def rk4(t0, x0, rhs, num_steps,solver_dict, workspace=None, params=None):
     """
     Advances the model forward n step 
     using the solver
 
+    The ensemble is advanced in one batched sweep: each stage of
+    the scheme evaluates rhs once on the whole (x_dim, ens_num)
+    block of members, or once per chunk of members if 'chunk_size'
+    is given. If the rhs only accepts a single (x_dim, 1) member,
+    set 'vectorized' to False to fall back to one call per member.
+
+    If 'in_place' is set the rhs is called as rhs(t, x, out) and
+    writes into out. The stages are then computed in preallocated
+    buffers kept in workspace, so no arrays are allocated per step
+    and, if the same workspace is passed again, none per call.
+
     Parameters
     ----------
     t0 - int or float
@@ -270,9 +882,19 @@ def rk4(t0, x0, rhs, num_steps,solver_dict):
     rhs - type.LambdaType
         Right hand side
     solver_dict - Dict
-        Dictionary containg parameters
+        Dictionary containg parameters. Must contain the step size
+        'h', and optionally 'vectorized' (bool, default True),
+        'in_place' (bool, default False), 'chunk_size' (int, default
+        None meaning all members at once) and the output keys
+        described in _output
     num_steps - int
         number of steps taken
+    workspace - Dict or None
+        Dictionary of buffers reused between calls
+    params - np.ndarray or None
+        The (n_params, ens_num) parameters of each member. If
+        given, the rhs is called as rhs(t, x, p) with p the
+        parameters of the members in x, or rhs(t, x, p, out)
     Raises
     ------
     KeyError
@@ -281,27 +903,664 @@ def rk4(t0, x0, rhs, num_steps,solver_dict):
 
     if 'h' not in solver_dict:
         raise KeyError('solver_dict is missing key "h"')
-    t0 = np.float(t0)
-    x0 = x0.astype(np.float)
+    t0 = float(t0)
     h = solver_dict['h']
+    vectorized = solver_dict.get('vectorized', True)
+    in_place = solver_dict.get('in_place', False)
+    chunk_size = solver_dict.get('chunk_size', None)
+
+    if in_place:
+        if workspace is None:
+            workspace = {}
+        xi = _buffer(workspace, 'rk4_state', x0.shape)
+        xi[...] = x0
+    else:
+        xi = x0.astype(float)
+    steps = _rk4_steps(t0, xi, rhs, num_steps, h, vectorized, chunk_size, in_place, workspace, params)
+    return _output(t0, x0, steps, num_steps, solver_dict)
+
+def _rk4_steps(t0, xi, rhs, num_steps, h, vectorized, chunk_size, in_place=False, workspace=None, params=None):
+    """
+    Generator taking num_steps rk4 steps in place on xi,
+    yielding the time and state after every step
+
+    Parameters
+    ----------
+    t0 - float
+        Initial time
+    xi - np.ndarray
+        The (x_dim, ens_num) state, updated in place
+    rhs - type.LambdaType
+        Right hand side
+    num_steps - int
+        number of steps taken
+    h - float
+        Step size
+    vectorized - bool
+        Whether rhs accepts the whole block at once
+    chunk_size - int or None
+        The number of members per rhs call
+    in_place - bool
+        Whether rhs is called as rhs(t, x, out)
+    workspace - Dict or None
+        Dictionary of stage buffers, used if in_place
+    params - np.ndarray or None
+        The (n_params, ens_num) parameters
+
+    Raises
+    ------
+    """
+    ens_num = xi.shape[1]
+    members = _chunks(ens_num, chunk_size)
+    if in_place:
+        stages = [_buffer(workspace, ('rk4_stages', i), (5, xi.shape[0], cols.stop - cols.start))
+                  for i, cols in enumerate(members)]
+    ti = t0
+    for time in range(num_steps):
+        for i, cols in enumerate(members):
+            block_params = None if params is None else params[:,cols]
+            if in_place:
+                _rk4_step_in_place(ti, xi[:,cols], rhs, h, vectorized, stages[i], block_params)
+            else:
+                _rk4_step(ti, xi[:,cols], rhs, h, vectorized, block_params)
+        ti += h
+        yield ti, xi
+
+def _output(t0, x0, steps, num_steps, solver_dict, transform=None):
+    """
+    Gathers the states yielded by a solver according to the
+    output keys of solver_dict:
+
+    'output' - 'all' (default) stores the state after every step,
+        'final' stores only the last state and 'generator' returns
+        a generator yielding (t, state) pairs as the solver runs
+    'output_every' - int, default 1
+        only every output_every-th step is stored or yielded
+
+    Except in generator mode, returns the states as an array of
+    shape (x_dim, ens_num, num_outputs) along with the times, so
+    'final' gives a single trailing slice. Only one state is held
+    in memory in the 'final' and 'generator' modes.
+
+    Parameters
+    ----------
+    t0 - float
+        Initial time
+    x0 - np.ndarray
+        Initial Condition
+    steps - generator
+        Generator of the (t, state) pairs after every step
+    num_steps - int
+        number of steps taken
+    solver_dict - Dict
+        Dictionary containg parameters
+    transform - type.LambdaType or None
+        Maps the yielded states to the returned states,
+        applied only to the states that are kept. Without
+        it the states are copied straight into the output
+
+    Raises
+    ------
+    ValueError
+        If output or output_every is not valid
+    """
+    output = solver_dict.get('output', 'all')
+    output_every = solver_dict.get('output_every', 1)
+    if output not in ('all', 'final', 'generator'):
+        raise ValueError('output must be one of "all", "final" or "generator"')
+    if int(output_every) != output_every or output_every < 1:
+        raise ValueError('output_every must be a positive integer')
+
+    if output == 'generator':
+        # the solvers may reuse the yielded array, so the generator hands out copies
+        copy = np.copy if transform is None else transform
+        return ((ti, copy(xi)) for step, (ti, xi) in enumerate(steps, 1) if step % output_every == 0)
 
     x_dim = x0.shape[0]
     ens_num = x0.shape[1]
+    if output == 'final':
+        ti, xi = t0, None
+        for ti, xi in steps:
+            pass
+        x = np.zeros((x_dim,ens_num,1))
+        if xi is None:
+            x[:,:,0] = x0
+        else:
+            x[:,:,0] = xi if transform is None else transform(xi)
+        return x, np.array([ti])
 
-    x = np.zeros((x_dim,ens_num,num_steps))
-    t = np.zeros(num_steps)
-
-    for ens in range(ens_num):
-        xi = np.expand_dims(x0[:,ens],1)
-        ti = t0
-        for time in range(num_steps):
-            k1 = h*rhs(ti, xi)
-            k2 = h*rhs(ti + 0.5*h, xi + 0.5*k1)
-            k3 = h*rhs(ti + 0.5*h, xi + 0.5*k2)
-            k4 = h*rhs(ti + h, xi + k3)
-    
-            xi += (1.0/6.0)*(k1 + 2*k2 + 2*k3 + k4)
-            ti += h
-            t[time] = ti
-            x[:,ens,time] = xi.flatten()
-    return x,t
\ No newline at end of file
+    num_outputs = _num_outputs(num_steps, solver_dict)
+    x = np.zeros((x_dim,ens_num,num_outputs))
+    t = np.zeros(num_outputs)
+    for step, (ti, xi) in enumerate(steps, 1):
+        if step % output_every == 0:
+            t[step//output_every - 1] = ti
+            x[:,:,step//output_every - 1] = xi if transform is None else transform(xi)
+    return x,t
+
+def _num_outputs(num_steps, solver_dict):
+    """
+    The number of states stored by _output for the given
+    number of steps and output keys of solver_dict
+
+    Parameters
+    ----------
+    num_steps - int
+        number of steps taken
+    solver_dict - Dict
+        Dictionary containg parameters
+
+    Raises
+    ------
+    """
+    if solver_dict.get('output', 'all') == 'final':
+        return 1
+    return num_steps // solver_dict.get('output_every', 1)
+
+def _rk4_step(ti, xi, rhs, h, vectorized, params=None):
+    """
+    Takes a single rk4 step in place on a block of members
+
+    Parameters
+    ----------
+    ti - float
+        Current time
+    xi - np.ndarray
+        The (x_dim, members) block, updated in place
+    rhs - type.LambdaType
+        Right hand side
+    h - float
+        Step size
+    vectorized - bool
+        Whether rhs accepts the whole block at once
+    params - np.ndarray or None
+        The (n_params, members) parameters of the block
+
+    Raises
+    ------
+    """
+    k1 = h*_evaluate(rhs, ti, xi, vectorized, params=params)
+    k2 = h*_evaluate(rhs, ti + 0.5*h, xi + 0.5*k1, vectorized, params=params)
+    k3 = h*_evaluate(rhs, ti + 0.5*h, xi + 0.5*k2, vectorized, params=params)
+    k4 = h*_evaluate(rhs, ti + h, xi + k3, vectorized, params=params)
+
+    xi += (1.0/6.0)*(k1 + 2*k2 + 2*k3 + k4)
+
+def _rk4_step_in_place(ti, xi, rhs, h, vectorized, stages, params=None):
+    """
+    Takes a single rk4 step in place on a block of members
+    with an in place rhs, computing every stage in the
+    preallocated stage buffers
+
+    Parameters
+    ----------
+    ti - float
+        Current time
+    xi - np.ndarray
+        The (x_dim, members) block, updated in place
+    rhs - type.LambdaType
+        Right hand side, called as rhs(t, x, out)
+    h - float
+        Step size
+    vectorized - bool
+        Whether rhs accepts the whole block at once
+    stages - np.ndarray
+        The (5, x_dim, members) stage buffers
+    params - np.ndarray or None
+        The (n_params, members) parameters of the block
+
+    Raises
+    ------
+    """
+    k1, k2, k3, k4, xs = stages
+    _evaluate_into(rhs, ti, xi, k1, vectorized, params)
+    np.multiply(k1, 0.5*h, out=xs)
+    xs += xi
+    _evaluate_into(rhs, ti + 0.5*h, xs, k2, vectorized, params)
+    np.multiply(k2, 0.5*h, out=xs)
+    xs += xi
+    _evaluate_into(rhs, ti + 0.5*h, xs, k3, vectorized, params)
+    np.multiply(k3, h, out=xs)
+    xs += xi
+    _evaluate_into(rhs, ti + h, xs, k4, vectorized, params)
+
+    k2 += k3
+    k2 *= 2
+    k1 += k2
+    k1 += k4
+    k1 *= h/6.0
+    xi += k1
+
+def _evaluate_into(rhs, ti, xi, out, vectorized, params=None):
+    """
+    Evaluates an in place rhs on a block of members into out,
+    one member at a time if the rhs is not vectorized
+
+    Parameters
+    ----------
+    ti - float
+        Current time
+    xi - np.ndarray
+        The (x_dim, members) block
+    out - np.ndarray
+        The (x_dim, members) block the rhs is written to
+    rhs - type.LambdaType
+        Right hand side, called as rhs(t, x, out), or
+        rhs(t, x, p, out) if params is given
+    vectorized - bool
+        Whether rhs accepts the whole block at once
+    params - np.ndarray or None
+        The (n_params, members) parameters of the block
+
+    Raises
+    ------
+    """
+    if vectorized:
+        rhs(ti, xi, *_member_params(params, slice(None)), out)
+    else:
+        for ens in range(xi.shape[1]):
+            rhs(ti, xi[:,ens:ens+1], *_member_params(params, slice(ens, ens+1)), out[:,ens:ens+1])
+
+def _buffer(workspace, name, shape):
+    """
+    Gets the named buffer of the given shape from the workspace,
+    allocating it only if it is missing or of another shape
+
+    Parameters
+    ----------
+    workspace - Dict
+        Dictionary of buffers
+    name - hashable
+        The name of the buffer
+    shape - tuple
+        The shape of the buffer
+
+    Raises
+    ------
+    """
+    buffer = workspace.get(name)
+    if buffer is None or buffer.shape != tuple(shape):
+        buffer = np.empty(shape)
+        workspace[name] = buffer
+    return buffer
+
+def _evaluate(rhs, ti, xi, vectorized, in_place=False, params=None):
+    """
+    Evaluates the rhs on a block of members, one member
+    at a time if the rhs is not vectorized
+
+    Parameters
+    ----------
+    ti - float
+        Current time
+    xi - np.ndarray
+        The (x_dim, members) block
+    rhs - type.LambdaType
+        Right hand side
+    vectorized - bool
+        Whether rhs accepts the whole block at once
+    in_place - bool
+        Whether rhs is called as rhs(t, x, out)
+    params - np.ndarray or None
+        The (n_params, members) parameters of the block,
+        passed to the rhs as rhs(t, x, p) if given
+
+    Raises
+    ------
+    """
+    if in_place:
+        dx = np.empty(xi.shape, dtype=xi.dtype)
+        _evaluate_into(rhs, ti, xi, dx, vectorized, params)
+        return dx
+    if vectorized:
+        return rhs(ti, xi, *_member_params(params, slice(None)))
+    dx = np.empty(xi.shape, dtype=xi.dtype)
+    for ens in range(xi.shape[1]):
+        dx[:,ens:ens+1] = rhs(ti, xi[:,ens:ens+1], *_member_params(params, slice(ens, ens+1)))
+    return dx
+
+def _member_params(params, members):
+    """
+    The extra rhs arguments for a slice of members, which
+    is empty if there are no parameters
+
+    Parameters
+    ----------
+    params - np.ndarray or None
+        The (n_params, ens_num) parameters
+    members - slice
+        The members the rhs is evaluated on
+
+    Raises
+    ------
+    """
+    if params is None:
+        return ()
+    return (params[:,members],)
+
+def _chunks(ens_num, chunk_size):
+    """
+    Splits the ensemble members into contiguous slices
+
+    Parameters
+    ----------
+    ens_num - int
+        The number of ensemble members
+    chunk_size - int or None
+        The number of members per slice, None for
+        a single slice containing every member
+
+    Raises
+    ------
+    """
+    if chunk_size is None or chunk_size >= ens_num:
+        return [slice(0, ens_num)]
+    return [slice(start, min(start + chunk_size, ens_num))
+            for start in range(0, ens_num, chunk_size)]
+
+## Dormand-Prince 5(4) coefficients, with the 4th order
+## continuous extension used for dense output
+DOPRI5_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1])
+DOPRI5_A = [np.array([]),
+            np.array([1/5]),
+            np.array([3/40, 9/40]),
+            np.array([44/45, -56/15, 32/9]),
+            np.array([19372/6561, -25360/2187, 64448/6561, -212/729]),
+            np.array([9017/3168, -355/33, 46732/5247, 49/176, -5103/18656])]
+DOPRI5_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+DOPRI5_E = np.array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40])
+DOPRI5_P = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]])
+
+def dopri5(t0, x0, rhs, num_steps, solver_dict, workspace=None, params=None):
+    """
+    Advances the model forward n output steps using the
+    adaptive Dormand-Prince 5(4) embedded Runge-Kutta pair
+
+    The internal step is chosen from the largest error norm
+    over the ensemble members, so the whole ensemble shares
+    one step sequence and each stage evaluates rhs once on
+    the (x_dim, ens_num) block. The states at the output
+    times t0 + h, t0 + 2h, ... are interpolated with the
+    dense output of the scheme, so h is the observation
+    spacing and not a bound on the internal step. The last
+    internal step size is kept in workspace, so a later call
+    with the same workspace starts from it.
+
+    Parameters
+    ----------
+    t0 - int or float
+        Initial time
+    x0 - np.ndarray
+        Initial Condition
+    rhs - type.LambdaType
+        Right hand side
+    solver_dict - Dict
+        Dictionary containg parameters. Must contain the output
+        spacing 'h', and optionally 'rtol' (default 1e-6), 'atol'
+        (default 1e-8), 'first_step' (default h), 'vectorized'
+        (bool, default True), 'in_place' (bool, default False) and
+        the output keys described in _output
+    num_steps - int
+        number of output steps taken
+    workspace - Dict or None
+        Dictionary of buffers reused between calls
+    params - np.ndarray or None
+        The (n_params, ens_num) parameters of each member. If
+        given, the rhs is called as rhs(t, x, p) with p the
+        parameters of the members in x, or rhs(t, x, p, out)
+    Raises
+    ------
+    KeyError
+        If h is a missing key
+    """
+    if 'h' not in solver_dict:
+        raise KeyError('solver_dict is missing key "h"')
+    t0 = float(t0)
+    h = solver_dict['h']
+    rtol = solver_dict.get('rtol', 1e-6)
+    atol = solver_dict.get('atol', 1e-8)
+    vectorized = solver_dict.get('vectorized', True)
+    in_place = solver_dict.get('in_place', False)
+    if workspace is None:
+        workspace = {}
+    first_step = workspace.get('dopri5_step', solver_dict.get('first_step', h))
+
+    steps = _dopri5_steps(t0, x0.astype(float), rhs, num_steps, h, rtol, atol, first_step, vectorized,
+                          in_place, workspace, params)
+    return _output(t0, x0, steps, num_steps, solver_dict)
+
+def _dopri5_steps(t0, y, rhs, num_steps, h, rtol, atol, dt, vectorized, in_place=False, workspace=None,
+                  params=None):
+    """
+    Generator taking adaptive Dormand-Prince steps from t0,
+    yielding the time and interpolated state at each of
+    the num_steps output times
+
+    Parameters
+    ----------
+    t0 - float
+        Initial time
+    y - np.ndarray
+        The (x_dim, ens_num) initial state
+    rhs - type.LambdaType
+        Right hand side
+    num_steps - int
+        number of output steps taken
+    h - float
+        Output spacing
+    rtol, atol - float
+        Relative and absolute error tolerance
+    dt - float
+        Initial internal step size
+    vectorized - bool
+        Whether rhs accepts the whole block at once
+    in_place - bool
+        Whether rhs is called as rhs(t, x, out)
+    workspace - Dict or None
+        Dictionary the last internal step size is stored in
+    params - np.ndarray or None
+        The (n_params, ens_num) parameters
+
+    Raises
+    ------
+    RuntimeError
+        If the step size underflows
+    """
+    t_final = t0 + num_steps*h
+    k = np.zeros((7,) + y.shape)
+    k[0] = _evaluate(rhs, t0, y, vectorized, in_place, params)
+    ti = t0
+    out = 1
+    while out <= num_steps:
+        step = min(dt, t_final - ti)
+        t_new = t_final if step == t_final - ti else ti + step
+        if t_new == ti:
+            raise RuntimeError('dopri5 step size underflow at t = {}'.format(ti))
+
+        for stage in range(1, 6):
+            dy = np.tensordot(DOPRI5_A[stage], k[:stage], axes=1)
+            k[stage] = _evaluate(rhs, ti + DOPRI5_C[stage]*step, y + step*dy, vectorized, in_place, params)
+        y_new = y + step*np.tensordot(DOPRI5_B, k[:6], axes=1)
+        k[6] = _evaluate(rhs, t_new, y_new, vectorized, in_place, params)
+
+        err = step*np.tensordot(DOPRI5_E, k, axes=1)
+        scale = atol + rtol*np.maximum(np.abs(y), np.abs(y_new))
+        err_norm = np.max(np.sqrt(np.mean((err/scale)**2, axis=0)))
+
+        if err_norm <= 1:
+            Q = None
+            while out <= num_steps and t0 + out*h <= t_new:
+                t_out = t0 + out*h
+                if t_out == t_new:
+                    yield t_out, y_new
+                else:
+                    if Q is None:
+                        Q = np.tensordot(DOPRI5_P.T, k, axes=1)
+                    theta = (t_out - ti)/step
+                    yield t_out, y + step*np.tensordot(theta**np.arange(1, 5), Q, axes=1)
+                out += 1
+            ti = t_new
+            y = y_new
+            k[0] = k[6]
+            factor = 10 if err_norm == 0 else min(10, 0.9*err_norm**-0.2)
+            dt = step*factor if step == dt else max(dt, step*factor)
+        else:
+            dt = step*max(0.2, 0.9*err_norm**-0.2)
+    if workspace is not None:
+        workspace['dopri5_step'] = dt
+
+def etdrk4(t0, x0, rhs, num_steps, solver_dict, workspace=None, params=None):
+    """
+    Advances a stiff semilinear model u' = Lu + N(t, u) forward
+    n steps with the fourth order exponential time differencing
+    Runge-Kutta scheme of Cox and Matthews, as formulated by
+    Kassam and Trefethen 2005
+
+    The state is periodic in its first dimension and L is
+    diagonal in Fourier space. The whole ensemble is moved to
+    Fourier space with a single real FFT, integrated there
+    and transformed back only for the states that are output.
+    The rhs is the nonlinear term in Fourier space, called as
+    rhs(t, v) with v the (x_dim//2 + 1, ens_num) complex
+    coefficients. The phi function coefficients are computed
+    once per step size and linear operator, and kept in
+    workspace for later calls.
+
+    Parameters
+    ----------
+    t0 - int or float
+        Initial time
+    x0 - np.ndarray
+        Initial Condition
+    rhs - type.LambdaType
+        The nonlinear term in Fourier space
+    solver_dict - Dict
+        Dictionary containg parameters. Must contain the step size
+        'h' and the diagonal 'linear' operator of length
+        x_dim//2 + 1, and optionally 'num_points' (default 32) for
+        the contour integrals, 'vectorized' (bool, default True),
+        'in_place' (bool, default False) and the output keys
+        described in _output
+    num_steps - int
+        number of steps taken
+    workspace - Dict or None
+        Dictionary of buffers reused between calls
+    params - np.ndarray or None
+        The (n_params, ens_num) parameters of each member. If
+        given, the rhs is called as rhs(t, x, p) with p the
+        parameters of the members in x, or rhs(t, x, p, out)
+    Raises
+    ------
+    KeyError
+        If h or linear is a missing key
+    ValueError
+        If linear is not of length x_dim//2 + 1
+    """
+    for key in ('h', 'linear'):
+        if key not in solver_dict:
+            raise KeyError('solver_dict is missing key "{}"'.format(key))
+    t0 = float(t0)
+    h = solver_dict['h']
+    linear = np.asarray(solver_dict['linear'])
+    num_points = solver_dict.get('num_points', 32)
+    vectorized = solver_dict.get('vectorized', True)
+    in_place = solver_dict.get('in_place', False)
+
+    x_dim = x0.shape[0]
+    if linear.shape != (x_dim//2 + 1,):
+        raise ValueError('linear must be of length x_dim//2 + 1')
+    if workspace is None:
+        workspace = {}
+    cached = workspace.get('etdrk4')
+    if (cached is None or cached[0] != h or cached[1] != num_points
+            or not np.array_equal(cached[2], linear)):
+        cached = (h, num_points, linear.copy(), _etdrk4_coefficients(linear, h, num_points))
+        workspace['etdrk4'] = cached
+    coefficients = cached[3]
+
+    v = np.fft.rfft(x0.astype(float), axis=0)
+    steps = _etdrk4_steps(t0, v, rhs, num_steps, h, coefficients, vectorized, in_place, params)
+    return _output(t0, x0, steps, num_steps, solver_dict, lambda vi: np.fft.irfft(vi, n=x_dim, axis=0))
+
+def _etdrk4_coefficients(linear, h, num_points):
+    """
+    Computes the ETDRK4 coefficients exp(hL), exp(hL/2) and the
+    phi function weights Q, f1, f2, f3 of Kassam and Trefethen,
+    evaluating the phi functions by contour integrals to avoid
+    cancellation for small hL. Each is returned as a column
+    broadcasting over the ensemble
+
+    Parameters
+    ----------
+    linear - np.ndarray
+        The diagonal linear operator
+    h - float
+        Step size
+    num_points - int
+        Number of points on the contour
+
+    Raises
+    ------
+    """
+    roots = np.exp(1j*np.pi*(np.arange(1, num_points + 1) - 0.5)/num_points)
+    LR = h*linear[:,None] + roots[None,:]
+    Q = h*np.mean((np.exp(LR/2) - 1)/LR, axis=1)
+    f1 = h*np.mean((-4 - LR + np.exp(LR)*(4 - 3*LR + LR**2))/LR**3, axis=1)
+    f2 = h*np.mean((2 + LR + np.exp(LR)*(-2 + LR))/LR**3, axis=1)
+    f3 = h*np.mean((-4 - 3*LR - LR**2 + np.exp(LR)*(4 - LR))/LR**3, axis=1)
+    if np.isrealobj(linear):
+        Q, f1, f2, f3 = np.real(Q), np.real(f1), np.real(f2), np.real(f3)
+    E = np.exp(h*linear)
+    E2 = np.exp(h*linear/2)
+    return tuple(c[:,None] for c in (E, E2, Q, f1, f2, f3))
+
+def _etdrk4_steps(t0, v, rhs, num_steps, h, coefficients, vectorized, in_place, params=None):
+    """
+    Generator taking num_steps ETDRK4 steps on the Fourier
+    coefficients v, yielding the time and coefficients after
+    every step
+
+    Parameters
+    ----------
+    t0 - float
+        Initial time
+    v - np.ndarray
+        The (x_dim//2 + 1, ens_num) Fourier coefficients
+    rhs - type.LambdaType
+        The nonlinear term in Fourier space
+    num_steps - int
+        number of steps taken
+    h - float
+        Step size
+    coefficients - tuple
+        The coefficients from _etdrk4_coefficients
+    vectorized - bool
+        Whether rhs accepts the whole block at once
+    in_place - bool
+        Whether rhs is called as rhs(t, v, out)
+    params - np.ndarray or None
+        The (n_params, ens_num) parameters
+
+    Raises
+    ------
+    """
+    E, E2, Q, f1, f2, f3 = coefficients
+    ti = t0
+    for time in range(num_steps):
+        Nv = _evaluate(rhs, ti, v, vectorized, in_place, params)
+        a = E2*v + Q*Nv
+        Na = _evaluate(rhs, ti + h/2, a, vectorized, in_place, params)
+        b = E2*v + Q*Na
+        Nb = _evaluate(rhs, ti + h/2, b, vectorized, in_place, params)
+        c = E2*a + Q*(2*Nb - Nv)
+        Nc = _evaluate(rhs, ti + h, c, vectorized, in_place, params)
+        v = E*v + Nv*f1 + 2*(Na + Nb)*f2 + Nc*f3
+        ti += h
+        yield ti, v
@@ -0,0 +1,125 @@
+## This file contains helpers for splitting work on an ensemble across a pool of
+## worker processes, with the ensemble arrays passed through shared memory
+##
+## Written by: Andrew Pensoneault
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+def get_context():
+    """
+    Gets the multiprocessing context used for worker pools. The fork
+    start method is used where available so that worker initializers
+    may receive unpicklable objects such as lambda functions
+
+    Parameters
+    ----------
+
+    Raises
+    ------
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+def make_pool(max_workers=None, initializer=None, initargs=()):
+    """
+    Creates a process pool for ensemble work
+
+    Parameters
+    ----------
+    max_workers: int or None
+        The number of worker processes, None for the number of cpus
+    initializer: type.LambdaType or None
+        Function called in every worker on start up
+    initargs: tuple
+        Arguments of the initializer
+
+    Raises
+    ------
+    """
+    return ProcessPoolExecutor(max_workers=num_workers(max_workers),
+                               mp_context=get_context(),
+                               initializer=initializer,
+                               initargs=initargs)
+
+def num_workers(max_workers=None):
+    """
+    Gets the number of workers to use
+
+    Parameters
+    ----------
+    max_workers: int or None
+        The number of worker processes, None for the number of cpus
+
+    Raises
+    ------
+    """
+    if max_workers is None:
+        return os.cpu_count() or 1
+    return max_workers
+
+def split(ens_num, num_parts):
+    """
+    Splits the ensemble members into at most num_parts contiguous
+    slices of nearly equal size
+
+    Parameters
+    ----------
+    ens_num: int
+        The number of ensemble members
+    num_parts: int
+        The number of slices
+
+    Raises
+    ------
+    """
+    bounds = np.linspace(0, ens_num, min(num_parts, ens_num) + 1).astype(int)
+    return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def create(shape, array=None):
+    """
+    Creates a float array in shared memory, copying array into it
+    if given and filling it with zeros otherwise. Returns the shared
+    memory block, which the caller must close and unlink, and the
+    array viewing it
+
+    Parameters
+    ----------
+    shape: tuple
+        The shape of the shared array
+    array: np.ndarray or None
+        The values of the shared array
+
+    Raises
+    ------
+    """
+    size = max(int(np.prod(shape))*np.dtype(float).itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    view = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    if array is None:
+        view[...] = 0
+    else:
+        view[...] = array
+    return shm, view
+
+def attach(name, shape):
+    """
+    Attaches to a float array in shared memory made by create.
+    Returns the shared memory block, which the caller must close,
+    and the array viewing it
+
+    Parameters
+    ----------
+    name: str
+        The name of the shared memory block
+    shape: tuple
+        The shape of the shared array
+
+    Raises
+    ------
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=float, buffer=shm.buf)
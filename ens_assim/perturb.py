@@ -1,51 +1,179 @@
-from numpy.random import normal
-from scipy.sparse import diags
 import numpy as np
+from ens_assim.rng import as_generator
 MEAN = 0
 STD = 1
 
-def absolute_uncorr_perturb(state, absolute_std):
+class UncorrelatedPerturbation(object):
+    """
+    Perturbs ensembles with uncorrelated gaussian noise, of
+    standard deviation std for each state component, or
+    std times the state if relative. The scaling is set up once
+    and broadcast across the whole ensemble, and the noise is
+    drawn into a buffer kept between calls when rng is a
+    numpy.random.Generator
+
+    Attributes
+    ----------
+    std
+        the standard deviation of each state component
+    relative
+        whether std is relative to the state
+    rng
+        the random stream of the noise
+
+    Methods
+    -------
+    set_std(std, relative=None)
+        Sets the standard deviation of each state component
+    set_rng(rng)
+        Sets the random stream of the noise
+    perturb(state, out)
+        Perturbs the ensemble
+    """
+    def __init__(self, std, relative=False, rng=None):
+        """
+        Initializes Class
+
+        Parameters
+        ----------
+        std: np.ndarray
+            The standard deviation of each state component
+        relative: bool
+            Whether std is relative to the state
+        rng: None, int, np.random.Generator or NoiseBlock
+            The random stream, see ens_assim.rng.as_generator
+
+        Raises
+        ------
+        """
+        self.set_std(std, relative)
+        self.set_rng(rng)
+        self._noise = None
+        self._scale = None
+
+    def set_std(self, std, relative=None):
+        """
+        Sets the standard deviation of each state component
+
+        Parameters
+        ----------
+        std: np.ndarray
+            The standard deviation of each state component
+        relative: bool or None
+            Whether std is relative to the state, None to keep
+            the current mode
+
+        Raises
+        ------
+        """
+        self.std = np.asarray(std, dtype=float)
+        if relative is not None:
+            self.relative = relative
+        self._column = self.std[:,None]
+
+    def set_rng(self, rng):
+        """
+        Sets the random stream of the noise
+
+        Parameters
+        ----------
+        rng: None, int, np.random.Generator or NoiseBlock
+            The stream or its seed, see ens_assim.rng.as_generator
+
+        Raises
+        ------
+        """
+        self.rng = as_generator(rng)
+
+    def perturb(self, state, out=None):
+        """
+        Perturbs the ensemble state, of shape (x_dim, ens_num) or a
+        stack (batch, x_dim, ens_num)
+
+        Parameters
+        ----------
+        state : np.ndarray
+            The ensemble of states
+        out : np.ndarray or None
+            The array the perturbed states are written to, which
+            may be state itself, None for a new array
+
+        Raises
+        ------
+        """
+        noise = self._draw(state.shape)
+        if self.relative:
+            if self._scale is None or self._scale.shape != state.shape:
+                self._scale = np.empty(state.shape)
+            np.multiply(state, self._column, out=self._scale)
+            noise *= self._scale
+        else:
+            noise *= self._column
+        return np.add(state, noise, out=out)
+
+    def _draw(self, shape):
+        """
+        Draws standard normal noise of the given shape, into the
+        kept buffer for Generators, which can fill it in place
+
+        Parameters
+        ----------
+        shape : tuple
+            The shape of the noise
+
+        Raises
+        ------
+        """
+        if not isinstance(self.rng, np.random.Generator):
+            return self.rng.normal(loc = MEAN, scale = STD, size = shape)
+        if self._noise is None or self._noise.shape != shape:
+            self._noise = np.empty(shape)
+        return self.rng.standard_normal(out=self._noise)
+
+def absolute_uncorr_perturb(state, absolute_std, rng=None, out=None):
     """
     Perturbs the state array given absolute standard
-    deviation diagonal of covariance matrix. Thus, it 
+    deviation diagonal of covariance matrix. Thus, it
     makes an assumption of uncorrelated random noise.
-        
+
     Parameters
     ----------
     state : np.ndarray
-        The ensemble of states 
+        The ensemble of states
     absolute_std: np.ndarray
         The absolute standard deviation of the states
+    rng: None, int, np.random.Generator or NoiseBlock
+        The random stream, see ens_assim.rng.as_generator
+    out : np.ndarray or None
+        The array the perturbed states are written to, which
+        may be state itself, None for a new array
 
     Raises
     ------
     """
 
-    return state + diags(absolute_std)@normal(loc = MEAN,
-                                              scale = STD,
-                                              size = state.shape)
+    return UncorrelatedPerturbation(absolute_std, rng=rng).perturb(state, out)
 
-def percent_uncorr_perturb(state, percent_std):
+def percent_uncorr_perturb(state, percent_std, rng=None, out=None):
     """
     Perturbs the state array given percent standard
-    deviation diagonal of covariance matrix. Thus, it 
+    deviation diagonal of covariance matrix. Thus, it
     makes an assumption of uncorrelated random noise.
-        
+
     Parameters
     ----------
     state : np.ndarray
-        The ensemble of states 
+        The ensemble of states
     percent_std: np.ndarray
         The percent standard deviation of the states
+    rng: None, int, np.random.Generator or NoiseBlock
+        The random stream, see ens_assim.rng.as_generator
+    out : np.ndarray or None
+        The array the perturbed states are written to, which
+        may be state itself, None for a new array
 
 
     Raises
     ------
     """
-    ens_num = state.shape[1]
-    x_dim = state.shape[0]
-    random_pert = normal(loc = MEAN, scale = STD, size = (x_dim,ens_num))
-
-    for i in range(ens_num):
-        state[:,i] = state[:,i] + (diags(state[:,i]*percent_std)@np.expand_dims(random_pert[:,i],1)).flatten()
-    return state
+    return UncorrelatedPerturbation(percent_std, relative=True, rng=rng).perturb(state, out)
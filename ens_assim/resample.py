@@ -0,0 +1,118 @@
+## This file contains the resampling schemes of the particle filters. Each scheme
+## takes normalized weights and returns the indices of the resampled particles, drawing
+## from the given random stream, see ens_assim.rng
+##
+## Written by: Andrew Pensoneault
+import numpy as np
+from ens_assim.rng import as_generator
+
+def _search(weights, u):
+    """
+    Gets the indices of the particles whose cumulative weight
+    intervals contain the points u in [0, 1)
+
+    Parameters
+    ----------
+    weights: np.ndarray
+        The normalized weights of the particles
+    u: np.ndarray
+        The points in [0, 1)
+
+    Raises
+    ------
+    """
+    cumulative = np.cumsum(weights)
+    cumulative[-1] = 1.
+    return np.searchsorted(cumulative, u, side='right')
+
+def multinomial_resample(weights, size=None, rng=None):
+    """
+    Draws size independent particle indices with probabilities
+    weights, by a binary search of uniform draws in the
+    cumulative weights
+
+    Parameters
+    ----------
+    weights: np.ndarray
+        The normalized weights of the particles
+    size: int or None
+        The number of indices, None for the number of particles
+    rng: None, int or np.random.Generator
+        The random stream, see as_generator
+
+    Raises
+    ------
+    """
+    size = len(weights) if size is None else size
+    return _search(weights, as_generator(rng).random(size))
+
+def systematic_resample(weights, size=None, rng=None):
+    """
+    Draws size particle indices with a single uniform draw u,
+    from the evenly spaced points (u + i)/size
+
+    Parameters
+    ----------
+    weights: np.ndarray
+        The normalized weights of the particles
+    size: int or None
+        The number of indices, None for the number of particles
+    rng: None, int or np.random.Generator
+        The random stream, see as_generator
+
+    Raises
+    ------
+    """
+    size = len(weights) if size is None else size
+    return _search(weights, (as_generator(rng).random() + np.arange(size))/size)
+
+def stratified_resample(weights, size=None, rng=None):
+    """
+    Draws size particle indices with one uniform draw u_i in
+    each stratum, from the points (u_i + i)/size
+
+    Parameters
+    ----------
+    weights: np.ndarray
+        The normalized weights of the particles
+    size: int or None
+        The number of indices, None for the number of particles
+    rng: None, int or np.random.Generator
+        The random stream, see as_generator
+
+    Raises
+    ------
+    """
+    size = len(weights) if size is None else size
+    return _search(weights, (as_generator(rng).random(size) + np.arange(size))/size)
+
+def residual_resample(weights, size=None, rng=None):
+    """
+    Keeps floor(size w_i) copies of each particle and draws the
+    remaining indices multinomially from the residual weights
+
+    Parameters
+    ----------
+    weights: np.ndarray
+        The normalized weights of the particles
+    size: int or None
+        The number of indices, None for the number of particles
+    rng: None, int or np.random.Generator
+        The random stream, see as_generator
+
+    Raises
+    ------
+    """
+    size = len(weights) if size is None else size
+    counts = np.floor(size*weights).astype(int)
+    indices = np.repeat(np.arange(len(weights)), counts)
+    remaining = size - len(indices)
+    if remaining > 0:
+        residual = size*weights - counts
+        indices = np.concatenate([indices, multinomial_resample(residual/np.sum(residual), remaining, rng)])
+    return indices
+
+RESAMPLERS = {'multinomial': multinomial_resample,
+              'systematic': systematic_resample,
+              'stratified': stratified_resample,
+              'residual': residual_resample}
@@ -0,0 +1,202 @@
+## This file contains the random number streams of the stochastic components. Each
+## component takes an rng, which may be None for the legacy global numpy.random state,
+## a seed, or a numpy.random.Generator. The helpers spawn independent, reproducible
+## streams for each cycle and worker from one SeedSequence
+##
+## Written by: Andrew Pensoneault
+import numpy as np
+
+def as_generator(rng=None):
+    """
+    Gets the random number stream of rng. None gives the legacy
+    global numpy.random state, so np.random.seed still reproduces
+    the draws. An int or SeedSequence seeds a new Generator, and
+    Generators, RandomStates and NoiseBlocks are returned as they are
+
+    Parameters
+    ----------
+    rng: None, int, np.random.SeedSequence or np.random.Generator
+        The stream or its seed
+
+    Raises
+    ------
+    """
+    if rng is None:
+        return np.random
+    if isinstance(rng, (int, np.integer, np.random.SeedSequence)):
+        return np.random.default_rng(rng)
+    return rng
+
+def spawn(seed, num):
+    """
+    Spawns num independent Generators from seed, e.g. one for
+    each worker or cycle. Spawning again from the same
+    SeedSequence or Generator gives new streams
+
+    Parameters
+    ----------
+    seed: None, int, np.random.SeedSequence or np.random.Generator
+        The parent seed, None for fresh entropy
+    num: int
+        The number of streams
+
+    Raises
+    ------
+    """
+    if isinstance(seed, np.random.Generator):
+        # Generator.spawn and the public seed_seq need numpy >= 1.25
+        bit_generator = seed.bit_generator
+        seed = getattr(bit_generator, 'seed_seq', None) or bit_generator._seed_seq
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(num)]
+
+def stream(seed, *key):
+    """
+    Gets the Generator of the child of seed at key, e.g.
+    stream(seed, cycle, worker). It is the stream spawn would
+    give at that position, so stream(seed, i) is spawn(seed, n)[i]
+    for a new seed, but it does not depend on the order streams
+    are asked for, and no state has to be passed to the workers
+
+    Parameters
+    ----------
+    seed: int or np.random.SeedSequence
+        The parent seed
+    key: int
+        The indices of the child, one per level of spawning
+
+    Raises
+    ------
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    child = np.random.SeedSequence(seed.entropy, spawn_key=tuple(seed.spawn_key) + key,
+                                   pool_size=seed.pool_size)
+    return np.random.default_rng(child)
+
+class NoiseBlock(object):
+    """
+    Standard normal noise generated in bulk, e.g. for all the
+    draws of an assimilation window, to cut the overhead of many
+    small calls to the stream. A NoiseBlock may be passed as the
+    rng of any component: normal and standard_normal hand out the
+    next values of the block, which is refilled from the stream
+    when it runs out, and uniform draws go to the stream. The
+    normal draws are those of the stream, in order
+
+    Attributes
+    ----------
+    rng
+        the underlying stream
+    count
+        the number of values generated per fill
+    block
+        the generated values
+    position
+        the index of the next value of the block
+
+    Methods
+    -------
+    fill(count)
+        Generates count more values now
+    standard_normal(size)
+        Hands out standard normal noise
+    normal(loc, scale, size)
+        Hands out normal noise
+    random(size)
+        Draws uniform noise in [0, 1) from the stream
+    """
+    def __init__(self, count, rng=None):
+        """
+        Initializes Class, generating the first block
+
+        Parameters
+        ----------
+        count: int
+            The number of values generated per fill
+        rng: None, int, np.random.SeedSequence or np.random.Generator
+            The stream or its seed, see as_generator
+
+        Raises
+        ------
+        """
+        self.rng = as_generator(rng)
+        self.count = count
+        self.block = np.empty(0)
+        self.position = 0
+        self.fill(count)
+
+    def fill(self, count=None):
+        """
+        Generates count more values now, after those not yet
+        handed out
+
+        Parameters
+        ----------
+        count: int or None
+            The number of values, None for count
+
+        Raises
+        ------
+        """
+        count = self.count if count is None else count
+        self.block = np.concatenate([self.block[self.position:], self.rng.standard_normal(count)])
+        self.position = 0
+
+    def standard_normal(self, size=None):
+        """
+        Hands out the next values of the block as an array of
+        shape size, or a float if size is None
+
+        Parameters
+        ----------
+        size: int, tuple or None
+            The shape of the noise
+
+        Raises
+        ------
+        """
+        num = 1 if size is None else int(np.prod(size))
+        if self.position + num > len(self.block):
+            self.fill(max(self.count, num - len(self.block) + self.position))
+        values = self.block[self.position:self.position+num]
+        self.position += num
+        if size is None:
+            return values[0]
+        return values.reshape(size)
+
+    def normal(self, loc=0., scale=1., size=None):
+        """
+        Hands out normal noise with mean loc and standard
+        deviation scale
+
+        Parameters
+        ----------
+        loc: float or np.ndarray
+            The mean
+        scale: float or np.ndarray
+            The standard deviation
+        size: int, tuple or None
+            The shape of the noise, None for that of loc and scale
+
+        Raises
+        ------
+        """
+        if size is None:
+            size = np.broadcast(loc, scale).shape or None
+        return loc + scale*self.standard_normal(size)
+
+    def random(self, size=None):
+        """
+        Draws uniform noise in [0, 1) from the stream
+
+        Parameters
+        ----------
+        size: int, tuple or None
+            The shape of the noise
+
+        Raises
+        ------
+        """
+        return self.rng.random(size)
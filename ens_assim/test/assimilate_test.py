@@ -1,8 +1,11 @@
 import unittest
 import numpy as np
 import scipy.linalg
-from ens_assim.assimilate.assimilate import No_Assimilate, EnKF, SREnKF, SIR
-from ens_assim.measure.measure import Measure
+import scipy.sparse
+import scipy.sparse.linalg
+from ens_assim.assimilate.assimilate import No_Assimilate, EnKF, SREnKF, EnKS, AsyncSREnKF, RSREnKF, EnSRF, LETKF, SIR
+from ens_assim.measure.measure import Measure, DiagonalCovariance
+from ens_assim.localize import gaspari_cohn, as_coordinates, distance
 WEIGHTS = np.array([1.,1.])
 DATA_COV = np.array([[.25]])
 DATA_STD = np.array([[.5]])
@@ -15,6 +18,19 @@ THRESHOLD = 1
 MEASURE = Measure(DATA_COV,DATA_MEAS,H)
 ENS_NUM=2
 
+STATE_BIG = np.array([[1.,2.,0.],[0.,1.,3.],[2.,2.,1.],[1.,-1.,0.]])
+H_BIG_MAT = np.array([[1.,0.,0.,0.],[0.,1.,0.,0.],[0.,0.,1.,0.],[0.,0.,0.,1.],[1.,1.,0.,0.]])
+H_BIG = lambda x: H_BIG_MAT @ x
+DATA_COV_BIG = np.diag([.5,.25,1.,.5,2.])
+DATA_MEAS_BIG = np.array([[1.],[2.],[1.],[0.],[3.]])
+MEASURE_BIG = Measure(DATA_COV_BIG,DATA_MEAS_BIG,H_BIG)
+STATE_COORDS_BIG = np.array([0.,1.,2.,3.])
+OBS_COORDS_BIG = np.array([0.,1.,2.,3.,.5])
+
+np.random.seed(2)
+STATE_GRID = np.random.normal(0,1,(40,10))
+MEASURE_GRID = Measure(.5*np.ones(20),np.random.normal(0,1,(20,1)),np.arange(0,40,2))
+
 class TestAssimilate(unittest.TestCase):
     """
     Performs tests on the file ./assimilate/assimilate.py
@@ -28,10 +44,34 @@ class TestAssimilate(unittest.TestCase):
         Tests the no assimilation algorithm
     test_srenkf()
         Tests the SREnKF algorithm
+    test_srenkf_ensemble_space()
+        Tests the SREnKF algorithm with more observations than members
+    test_srenkf_operators()
+        Tests the SREnKF algorithm with linear measurement operators
+    test_enks()
+        Tests the EnKS smoother and the SREnKF transform
+    test_async_srenkf()
+        Tests the AsyncSREnKF algorithm
+    test_rsrenkf()
+        Tests the RSREnKF algorithm
     test_enkf()
         Tests the EnKF algorithm
+    test_enkf_ensemble_space()
+        Tests the EnKF algorithm with more observations than members
+    test_ensrf()
+        Tests the EnSRF algorithm
+    test_letkf()
+        Tests the LETKF algorithm
+    test_localization()
+        Tests the localized EnKF and SREnKF algorithms
+    test_batched()
+        Tests the SREnKF and EnKF algorithms on stacks of ensembles
     test_sir()
         Tests the SIR algorithm
+    test_sir_log_weights()
+        Tests the SIR log-weights and resampling
+    test_sir_gaussian()
+        Tests the SIR with the gaussian log-likelihood of the Measure
     """
     def test_no_assimilate(self):
         """
@@ -49,7 +89,8 @@ class TestAssimilate(unittest.TestCase):
 
     def test_srenkf(self):
         """
-        Tests the SREnKF algorithm
+        Tests the SREnKF algorithm against the symmetric
+        square root of the transform
 
         Parameters
         ----------
@@ -61,11 +102,165 @@ class TestAssimilate(unittest.TestCase):
         pert = (STATE-xmean)/np.sqrt(ENS_NUM-1)
         xpostmean = xmean + (pert@H(pert).T)@np.linalg.inv(H(pert)@H(pert).T+DATA_COV)@(DATA_MEAS-H(xmean))
         Tinv = np.linalg.inv(np.eye(ENS_NUM,ENS_NUM) + (H(pert).T @ np.linalg.solve(DATA_COV,H(pert))))
-        Tsqrtinv = scipy.linalg.cholesky(Tinv) 
+        Tsqrtinv = np.real(scipy.linalg.sqrtm(Tinv))
         xpost = xpostmean + np.sqrt(ENS_NUM-1)*pert @ Tsqrtinv 
         model = SREnKF()
         x = model.analyze(STATE,MEASURE)
-        self.assertTrue(np.all(x==xpost))
+        self.assertTrue(np.all(np.abs(x-xpost)<10e-12))
+
+    def test_srenkf_ensemble_space(self):
+        """
+        Tests the SREnKF algorithm with more observations than members
+        against the Kalman mean and covariance in observation space
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        ens_num = STATE_BIG.shape[1]
+        xmean = np.mean(STATE_BIG,axis=1, keepdims=1)
+        pert = (STATE_BIG-xmean)/np.sqrt(ens_num-1)
+        S = H_BIG(pert)@H_BIG(pert).T+DATA_COV_BIG
+        K = (pert@H_BIG(pert).T)@np.linalg.inv(S)
+        xpostmean = xmean + K@(DATA_MEAS_BIG-H_BIG(xmean))
+        Ppost = pert@pert.T - K@H_BIG(pert)@pert.T
+        model = SREnKF()
+        x = model.analyze(STATE_BIG,MEASURE_BIG)
+        xpert = (x-np.mean(x,axis=1,keepdims=1))/np.sqrt(ens_num-1)
+        self.assertTrue(np.all(np.abs(np.mean(x,axis=1,keepdims=1)-xpostmean)<10e-12))
+        self.assertTrue(np.all(np.abs(xpert@xpert.T-Ppost)<10e-12))
+
+    def test_srenkf_operators(self):
+        """
+        Tests the SREnKF algorithm with matrix, sparse, LinearOperator,
+        index and linear callable measurement operators against the
+        nonlinear callable
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        model = SREnKF()
+        for state, measure in [(STATE, MEASURE), (STATE_BIG, MEASURE_BIG)]:
+            x = model.analyze(state,measure)
+            operator = H(np.eye(2)) if state is STATE else H_BIG_MAT
+            operators = [operator, scipy.sparse.csr_matrix(operator), scipy.sparse.linalg.aslinearoperator(operator)]
+            for op in operators:
+                xop = model.analyze(state,Measure(measure.covariance,measure.measurement,op))
+                self.assertTrue(np.all(np.abs(xop-x)<10e-12))
+            xop = model.analyze(state,Measure(measure.covariance,measure.measurement,measure.operator,linear=True))
+            self.assertTrue(np.all(np.abs(xop-x)<10e-12))
+        x = model.analyze(STATE,MEASURE)
+        xop = model.analyze(STATE,Measure(DATA_COV,DATA_MEAS,[0]))
+        self.assertTrue(np.all(np.abs(xop-x)<10e-12))
+
+    def test_enks(self):
+        """
+        Tests the EnKS smoother and the SREnKF transform. With a
+        steady model the smoothed ensemble of one cycle ago is the
+        new analysis, and the smoothed ensemble of two cycles ago has
+        the mean and covariance of the SREnKF with both measurements
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        model = SREnKF()
+        x = model.analyze(STATE_BIG,MEASURE_BIG)
+        self.assertTrue(np.all(np.abs(STATE_BIG@model.transform-x)<10e-12))
+        x = model.analyze(np.stack([STATE_BIG,2*STATE_BIG]),MEASURE_BIG)
+        self.assertTrue(np.all(np.abs(np.stack([STATE_BIG,2*STATE_BIG])@model.transform-x)<10e-12))
+
+        measures = [Measure(DATA_COV_BIG[:3,:3],DATA_MEAS_BIG[:3],H_BIG_MAT[:3]),
+                    Measure(DATA_COV_BIG[3:,3:],DATA_MEAS_BIG[3:],H_BIG_MAT[3:]),
+                    Measure(DATA_COV_BIG[:2,:2],DATA_MEAS_BIG[:2],H_BIG_MAT[:2])]
+        smoother = EnKS()
+        smoother.set_lag(1)
+        x = STATE_BIG
+        for measure in measures:
+            x = smoother.analyze(x,measure)
+        self.assertTrue(np.all(np.abs(smoother.get_smoothed(0)-x)<10e-12))
+        self.assertTrue(np.all(np.abs(smoother.get_smoothed(1)-x)<10e-12))
+        with self.assertRaises(ValueError):
+            smoother.get_smoothed(2)
+        smoother.set_lag(2)
+        x1 = smoother.analyze(STATE_BIG,measures[0])
+        smoother.analyze(x1,measures[1])
+        smoother.analyze(np.zeros(STATE_BIG.shape),Measure(DATA_COV,np.zeros((0,1)),H))
+        xs = smoother.get_smoothed(2)
+        x = SREnKF().analyze(STATE_BIG,MEASURE_BIG)
+        self.assertTrue(np.all(np.abs(np.mean(xs,axis=1)-np.mean(x,axis=1))<10e-12))
+        self.assertTrue(np.all(np.abs(np.cov(xs)-np.cov(x))<10e-12))
+
+    def test_async_srenkf(self):
+        """
+        Tests the AsyncSREnKF algorithm, on a steady trajectory with
+        the observations split over two times, against the SREnKF
+        with all the observations
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        trajectory = np.stack([2*STATE_BIG, STATE_BIG], axis=2)
+        measures = [Measure(DATA_COV_BIG[:3,:3],DATA_MEAS_BIG[:3],H_BIG_MAT[:3],time=.2),
+                    Measure(DATA_COV_BIG[3:,3:],DATA_MEAS_BIG[3:],H_BIG_MAT[3:],time=.2)]
+        model = AsyncSREnKF()
+        model.set_times([.1,.2])
+        x = model.analyze(trajectory,measures)
+        self.assertTrue(np.all(np.abs(x-SREnKF().analyze(STATE_BIG,MEASURE_BIG))<10e-12))
+
+        trajectory = np.stack([STATE_BIG, STATE_BIG+1, STATE_BIG+2], axis=2)
+        measures[0].set_time(.1)
+        measures[1].set_time(.2)
+        model.set_times([.1,.2,.3])
+        x = model.analyze(trajectory,measures)
+        shift = np.vstack([H_BIG_MAT[:3]@(2*np.ones((4,1))), H_BIG_MAT[3:]@np.ones((4,1))])
+        measure = Measure(DATA_COV_BIG,DATA_MEAS_BIG+shift,H_BIG_MAT)
+        self.assertTrue(np.all(np.abs(x-SREnKF().analyze(STATE_BIG+2,measure))<10e-12))
+        measures[1].set_time(.4)
+        with self.assertRaises(ValueError):
+            model.analyze(trajectory,measures)
+
+    def test_rsrenkf(self):
+        """
+        Tests the RSREnKF algorithm without regularization against the
+        SREnKF, with a quadratic regularization of the differences of
+        the state against its closed form, and its warm start
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        model = RSREnKF()
+        x = model.analyze(STATE_BIG,MEASURE_BIG)
+        self.assertTrue(np.all(np.abs(x-SREnKF().analyze(STATE_BIG,MEASURE_BIG))<10e-12))
+
+        ens_num = STATE_BIG.shape[1]
+        lam = 2.
+        D = np.diff(np.eye(4),axis=0)
+        xmean = np.mean(STATE_BIG,axis=1, keepdims=1)
+        pert = (STATE_BIG-xmean)/np.sqrt(ens_num-1)
+        Ri = np.linalg.inv(DATA_COV_BIG)
+        A = np.eye(ens_num) + H_BIG(pert).T@Ri@H_BIG(pert) + lam*(D@pert).T@(D@pert)
+        w = np.linalg.solve(A, H_BIG(pert).T@Ri@(DATA_MEAS_BIG-H_BIG(xmean)) - lam*(D@pert).T@D@xmean)
+        model.set_regularizer(lambda z: .5*np.sum(z**2), lambda z: z, D, lam)
+        model.set_iterations(100, 1e-12)
+        x = model.analyze(STATE_BIG,MEASURE_BIG)
+        self.assertTrue(model.iterations > 0)
+        self.assertTrue(np.all(np.abs(np.mean(x,axis=1,keepdims=1)-(xmean+pert@w))<10e-10))
+        model.analyze(STATE_BIG,MEASURE_BIG)
+        self.assertEqual(model.iterations, 0)
 
     def test_enkf(self):
         """
@@ -87,6 +282,188 @@ class TestAssimilate(unittest.TestCase):
         x = model.analyze(STATE,MEASURE)
         self.assertTrue(np.all(x==xpost))
 
+    def test_enkf_ensemble_space(self):
+        """
+        Tests the EnKF algorithm with more observations than members
+        and a diagonal covariance against the gain in observation space
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        ens_num = STATE_BIG.shape[1]
+        np.random.seed(1)
+        rand = np.random.normal(0,1,(5,ens_num))
+        xmean = np.mean(STATE_BIG,axis=1, keepdims=1)
+        pert = (STATE_BIG-xmean)/np.sqrt(ens_num-1)
+        K = (pert@H_BIG(pert).T)@np.linalg.inv(H_BIG(pert)@H_BIG(pert).T+DATA_COV_BIG)
+        xpost = STATE_BIG + K@(DATA_MEAS_BIG+np.sqrt(DATA_COV_BIG)@rand-H_BIG(STATE_BIG))
+        np.random.seed(1)
+        model = EnKF()
+        x = model.analyze(STATE_BIG,Measure(DiagonalCovariance(np.diag(DATA_COV_BIG)),DATA_MEAS_BIG,H_BIG))
+        self.assertTrue(np.all(np.abs(x-xpost)<10e-12))
+
+    def test_ensrf(self):
+        """
+        Tests the EnSRF algorithm against the Kalman mean and
+        covariance, and that it rejects a nondiagonal covariance
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        model = EnSRF()
+        for state, measure, operator, cov, meas in [(STATE, MEASURE, H, DATA_COV, DATA_MEAS),
+                                                    (STATE_BIG, MEASURE_BIG, H_BIG, DATA_COV_BIG, DATA_MEAS_BIG)]:
+            ens_num = state.shape[1]
+            xmean = np.mean(state,axis=1, keepdims=1)
+            pert = (state-xmean)/np.sqrt(ens_num-1)
+            K = (pert@operator(pert).T)@np.linalg.inv(operator(pert)@operator(pert).T+cov)
+            xpostmean = xmean + K@(meas-operator(xmean))
+            Ppost = pert@pert.T - K@operator(pert)@pert.T
+            x = model.analyze(state,measure)
+            xpert = (x-np.mean(x,axis=1,keepdims=1))/np.sqrt(ens_num-1)
+            self.assertTrue(np.all(np.abs(np.mean(x,axis=1,keepdims=1)-xpostmean)<10e-12))
+            self.assertTrue(np.all(np.abs(xpert@xpert.T-Ppost)<10e-12))
+        sparse = Measure(scipy.sparse.csc_matrix(DATA_COV_BIG),DATA_MEAS_BIG,H_BIG)
+        self.assertTrue(np.all(np.abs(model.analyze(STATE_BIG,sparse)-model.analyze(STATE_BIG,MEASURE_BIG))<10e-12))
+        with self.assertRaises(ValueError):
+            model.analyze(STATE_BIG,Measure(DATA_COV_BIG+.1,DATA_MEAS_BIG,H_BIG))
+
+    def test_letkf(self):
+        """
+        Tests the LETKF algorithm without tapering against the
+        Kalman mean and covariance, and with localization on a
+        periodic grid against the process backend
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        ens_num = STATE_BIG.shape[1]
+        xmean = np.mean(STATE_BIG,axis=1, keepdims=1)
+        pert = (STATE_BIG-xmean)/np.sqrt(ens_num-1)
+        K = (pert@H_BIG(pert).T)@np.linalg.inv(H_BIG(pert)@H_BIG(pert).T+DATA_COV_BIG)
+        xpostmean = xmean + K@(DATA_MEAS_BIG-H_BIG(xmean))
+        Ppost = pert@pert.T - K@H_BIG(pert)@pert.T
+        model = LETKF()
+        model.set_coordinates(STATE_COORDS_BIG, OBS_COORDS_BIG)
+        model.set_radius(10., taper=lambda dist, radius: np.ones(dist.shape))
+        x = model.analyze(STATE_BIG,MEASURE_BIG)
+        xpert = (x-np.mean(x,axis=1,keepdims=1))/np.sqrt(ens_num-1)
+        self.assertTrue(np.all(np.abs(np.mean(x,axis=1,keepdims=1)-xpostmean)<10e-12))
+        self.assertTrue(np.all(np.abs(xpert@xpert.T-Ppost)<10e-12))
+
+        model.set_coordinates(np.arange(40), np.arange(0,40,2)+.5, boxsize=40)
+        model.set_radius(4.)
+        x = model.analyze(STATE_GRID,MEASURE_GRID)
+        self.assertTrue(np.all(np.abs(x[[0,39]]-STATE_GRID[[0,39]])>0))
+        model.set_radius(.4)
+        xnear = model.analyze(STATE_GRID,MEASURE_GRID)
+        self.assertTrue(np.all(xnear[1::2]==STATE_GRID[1::2]))
+        model.set_radius(4.)
+        model.set_backend('process', max_workers=2)
+        try:
+            xproc = model.analyze(STATE_GRID,MEASURE_GRID)
+        finally:
+            model.set_backend('serial')
+        self.assertTrue(np.all(np.abs(xproc-x)<10e-12))
+
+    def test_localization(self):
+        """
+        Tests the localized EnKF and SREnKF algorithms without
+        tapering against the unlocalized EnKF and the DEnKF update,
+        and with tapering against the dense tapered gain
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        ones = lambda dist, radius: np.ones(dist.shape)
+        ens_num = STATE_BIG.shape[1]
+        xmean = np.mean(STATE_BIG,axis=1, keepdims=1)
+        pert = (STATE_BIG-xmean)/np.sqrt(ens_num-1)
+        K = (pert@H_BIG(pert).T)@np.linalg.inv(H_BIG(pert)@H_BIG(pert).T+DATA_COV_BIG)
+        xpostmean = xmean + K@(DATA_MEAS_BIG-H_BIG(xmean))
+        xpostpert = pert - .5*K@H_BIG(pert)
+
+        model = EnKF()
+        np.random.seed(1)
+        xpost = model.analyze(STATE_BIG,MEASURE_BIG)
+        model.set_localization(STATE_COORDS_BIG, OBS_COORDS_BIG, 10., taper=ones)
+        np.random.seed(1)
+        x = model.analyze(STATE_BIG,MEASURE_BIG)
+        self.assertTrue(np.all(np.abs(x-xpost)<10e-12))
+
+        model = SREnKF()
+        model.set_localization(STATE_COORDS_BIG, OBS_COORDS_BIG, 10., taper=ones)
+        x = model.analyze(STATE_BIG,MEASURE_BIG)
+        xpert = (x-np.mean(x,axis=1,keepdims=1))/np.sqrt(ens_num-1)
+        self.assertTrue(np.all(np.abs(np.mean(x,axis=1,keepdims=1)-xpostmean)<10e-12))
+        self.assertTrue(np.all(np.abs(xpert-xpostpert)<10e-12))
+
+        state_coords = as_coordinates(np.arange(40))
+        obs_coords = as_coordinates(np.arange(0,40,2)+.5)
+        rho_xy = gaspari_cohn(distance(state_coords[:,None],obs_coords[None,:],40.),4.)
+        rho_yy = gaspari_cohn(distance(obs_coords[:,None],obs_coords[None,:],40.),4.)
+        ens_num = STATE_GRID.shape[1]
+        xmean = np.mean(STATE_GRID,axis=1, keepdims=1)
+        pert = (STATE_GRID-xmean)/np.sqrt(ens_num-1)
+        Hpert = MEASURE_GRID.apply_operator(pert)
+        K = (rho_xy*(pert@Hpert.T))@np.linalg.inv(rho_yy*(Hpert@Hpert.T)+.5*np.eye(20))
+        xpostmean = xmean + K@(MEASURE_GRID.measurement-MEASURE_GRID.apply_operator(xmean))
+        model.set_localization(state_coords, obs_coords, 4., boxsize=40.)
+        x = model.analyze(STATE_GRID,MEASURE_GRID)
+        self.assertTrue(np.all(np.abs(np.mean(x,axis=1,keepdims=1)-xpostmean)<10e-12))
+        model.set_localization(None, None, None)
+        self.assertTrue(model.localization is None)
+
+    def test_batched(self):
+        """
+        Tests the SREnKF and EnKF algorithms on stacks of ensembles,
+        with shared and stacked measurements, against the analyses
+        of each ensemble
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        np.random.seed(3)
+        stack = np.stack([STATE_BIG, 2*STATE_BIG, np.random.normal(0,1,STATE_BIG.shape)])
+        meas = np.stack([DATA_MEAS_BIG, -DATA_MEAS_BIG, 2*DATA_MEAS_BIG])
+        localized = SREnKF()
+        for measure in [Measure(DATA_COV_BIG,DATA_MEAS_BIG,H_BIG_MAT), Measure(DATA_COV_BIG,meas,H_BIG_MAT),
+                        Measure(DATA_COV_BIG[:2,:2],DATA_MEAS_BIG[:2],np.arange(2))]:
+            y0 = np.broadcast_to(measure.measurement, (3,) + measure.measurement.shape[-2:])
+            localized.set_localization(STATE_COORDS_BIG, OBS_COORDS_BIG[:len(y0[0])], 3.)
+            for model in [SREnKF(), localized]:
+                x = model.analyze(stack,measure)
+                for i in range(3):
+                    xi = model.analyze(stack[i],Measure(measure.covariance,y0[i],measure.operator))
+                    self.assertTrue(np.all(np.abs(x[i]-xi)<10e-12))
+            model = EnKF()
+            np.random.seed(1)
+            x = model.analyze(stack,measure)
+            np.random.seed(1)
+            noise = np.moveaxis(measure.get_covariance().sample(3*3).reshape(-1,3,3),0,1)
+            for i in range(3):
+                xmean = np.mean(stack[i],axis=1, keepdims=1)
+                pert = (stack[i]-xmean)/np.sqrt(2)
+                Hpert = measure.apply_operator(pert)
+                K = (pert@Hpert.T)@np.linalg.inv(Hpert@Hpert.T+measure.get_covariance().to_dense())
+                xi = stack[i] + K@(y0[i]+noise[i]-measure.apply_operator(stack[i]))
+                self.assertTrue(np.all(np.abs(x[i]-xi)<10e-12))
+
     def test_sir(self):
         """
         Tests the SIR algorithm
@@ -106,3 +483,64 @@ class TestAssimilate(unittest.TestCase):
         weights = model.weights
         self.assertTrue(np.all(x==STATE))
         self.assertTrue(np.all(weights == WEIGHTS/np.sum(WEIGHTS)))
+
+    def test_sir_log_weights(self):
+        """
+        Tests the SIR log-weights with likelihoods that underflow,
+        and the resampled indices
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        model = SIR()
+        model.set_log_likelihood(lambda x: np.array([-1000.,-1000.-np.log(3)]))
+        model.set_threshold(0)
+        x = model.analyze(STATE,MEASURE)
+        self.assertTrue(np.all(x==STATE))
+        self.assertTrue(np.all(np.abs(model.weights-np.array([.75,.25]))<10e-12))
+        self.assertTrue(np.all(model.indices==np.arange(2)))
+        with self.assertRaises(ValueError):
+            model.set_resampling('uniform')
+        for resampling in ['multinomial', 'systematic', 'stratified', 'residual']:
+            np.random.seed(1)
+            model.set_resampling(resampling)
+            model.set_threshold(3)
+            model.set_weights(WEIGHTS)
+            x = model.analyze(STATE,MEASURE)
+            self.assertTrue(np.all(x==STATE[:,model.indices]))
+            self.assertTrue(np.all(model.weights==.5))
+
+    def test_sir_gaussian(self):
+        """
+        Tests the SIR with the gaussian log-likelihood of the Measure,
+        serially and over a thread pool, against the likelihood
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        model = SIR()
+        model.set_threshold(0)
+        model.set_likelihood(LIKELIHOOD)
+        model.analyze(STATE_BIG[:2],MEASURE)
+        weights = model.weights
+        model = SIR()
+        model.set_threshold(0)
+        model.analyze(STATE_BIG[:2],MEASURE)
+        self.assertTrue(np.all(np.abs(model.weights-weights)<10e-12))
+        np.random.seed(4)
+        particles = np.random.normal(0,1,(4,101))
+        model = SIR()
+        model.set_threshold(0)
+        model.analyze(particles,MEASURE_BIG)
+        weights = model.weights
+        model = SIR()
+        model.set_threshold(0)
+        model.set_workers(3)
+        model.analyze(particles,MEASURE_BIG)
+        self.assertTrue(np.all(np.abs(model.weights-weights)<10e-12))
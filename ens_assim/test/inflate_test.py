@@ -0,0 +1,171 @@
+import unittest
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+from ens_assim.inflate import AdaptiveInflation
+from ens_assim.measure.measure import Measure
+from ens_assim.assimilate.assimilate import SREnKF, EnKF, EnKS
+
+XB = np.array([[1.,-1.,0.],[0.,1.,-1.],[2.,0.,-2.],[1.,1.,-2.]])/np.sqrt(2)
+MEASURE = Measure(np.diag([.5,.5]),np.array([[4.],[-3.]]),[0,2])
+INNOV = np.array([[3.],[-4.]])
+STATE = np.array([[1.,2.,0.],[0.,1.,3.],[2.,2.,1.],[1.,-1.,0.]])
+
+class TestInflate(unittest.TestCase):
+    """
+    Performs tests on the file inflate.py
+
+    Attributes
+    ----------
+
+    Methods
+    -------
+    test_multiplicative()
+        Tests the multiplicative inflation estimate and apply
+    test_additive()
+        Tests the additive inflation estimate and apply
+    test_filters()
+        Tests the inflation in the SREnKF and EnKF
+    test_transform()
+        Tests the SREnKF and EnKS transforms with inflation
+    test_operator_trace()
+        Tests tr(R^-1 H H^T) for every kind of linear operator
+    """
+    def test_multiplicative(self):
+        """
+        Tests the multiplicative inflation estimate, running average,
+        bounds and apply
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        Yb = MEASURE.apply_operator(XB)
+        estimate = (np.sum(INNOV**2)/.5 - 2)/(np.sum(Yb**2)/.5)
+        inflation = AdaptiveInflation(memory=0.)
+        self.assertTrue(np.abs(inflation.estimate(XB, Yb, INNOV, MEASURE)-estimate)<10e-12)
+        inflation = AdaptiveInflation(memory=.5)
+        self.assertTrue(np.abs(inflation.estimate(XB, Yb, INNOV, MEASURE)-(1+estimate)/2)<10e-12)
+        inflation.set_bounds(1., 2.)
+        inflation.set_memory(0.)
+        self.assertEqual(inflation.estimate(XB, Yb, INNOV, MEASURE), 2.)
+        Xb = XB.copy()
+        inflation.apply(Xb, Yb, INNOV, MEASURE)
+        self.assertTrue(np.all(np.abs(Xb-np.sqrt(2)*XB)<10e-12))
+        self.assertTrue(np.all(np.abs(Yb-MEASURE.apply_operator(Xb))<10e-12))
+
+    def test_additive(self):
+        """
+        Tests the additive inflation estimate and apply
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        Yb = MEASURE.apply_operator(XB)
+        estimate = (np.sum(INNOV**2)/.5 - 2 - np.sum(Yb**2)/.5)/(2/.5)
+        inflation = AdaptiveInflation('additive', memory=0.)
+        self.assertTrue(np.abs(inflation.estimate(XB, Yb, INNOV, MEASURE)-estimate)<10e-12)
+        Xb = XB.copy()
+        np.random.seed(1)
+        inflation.apply(Xb, Yb, INNOV, MEASURE)
+        self.assertTrue(np.all(np.abs(np.sum(Xb-XB,axis=1))<10e-12))
+        self.assertTrue(np.all(np.abs(Yb-MEASURE.apply_operator(Xb))<10e-12))
+        with self.assertRaises(ValueError):
+            AdaptiveInflation('constant')
+        with self.assertRaises(ValueError):
+            inflation.estimate(XB, Yb, INNOV, Measure(np.diag([.5,.5]),INNOV,lambda x: x[[0,2]]))
+
+    def test_filters(self):
+        """
+        Tests the inflation in the SREnKF and EnKF against the
+        analyses of the inflated ensemble
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        mean = np.mean(STATE,axis=1,keepdims=1)
+        Xb = (STATE-mean)/np.sqrt(2)
+        Yb = MEASURE.apply_operator(Xb)
+        factor = AdaptiveInflation(memory=0.).estimate(Xb, Yb, MEASURE.measurement-MEASURE.apply_operator(mean), MEASURE)
+        inflated = mean + np.sqrt(factor)*(STATE-mean)
+        for model in [SREnKF(), EnKF()]:
+            np.random.seed(1)
+            x = model.analyze(inflated, MEASURE)
+            model.set_inflation(AdaptiveInflation(memory=0.))
+            np.random.seed(1)
+            self.assertTrue(np.all(np.abs(model.analyze(STATE, MEASURE)-x)<10e-12))
+            self.assertEqual(model.inflation.value, factor)
+
+    def test_transform(self):
+        """
+        Tests that the SREnKF transform maps the background to the
+        analysis with multiplicative inflation, that the EnKS smooths
+        with it, and that additive inflation leaves no transform
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        np.random.seed(1)
+        state = np.random.normal(0,1,(6,5))
+        measure = Measure(np.eye(4),np.random.normal(0,30,(4,1)),np.random.normal(0,1,(4,6)))
+        model = SREnKF()
+        model.set_inflation(AdaptiveInflation(memory=0.))
+        x = model.analyze(state, measure)
+        self.assertTrue(model.inflation.value > 1)
+        self.assertTrue(np.all(np.abs(state @ model.transform - x)<10e-12))
+        smoother = EnKS()
+        smoother.set_lag(1)
+        smoother.set_inflation(AdaptiveInflation(memory=0.))
+        x0 = smoother.analyze(state, measure)
+        x1 = smoother.analyze(x0 + np.random.normal(0,1,(6,5)), measure)
+        self.assertTrue(np.all(np.abs(smoother.get_smoothed(0)-x1)<10e-12))
+        self.assertTrue(np.all(np.abs(smoother.get_smoothed(1)-x0 @ smoother.transform)<10e-12))
+        model.set_inflation(AdaptiveInflation('additive', memory=0.))
+        model.analyze(state, measure)
+        self.assertIsNone(model.transform)
+        smoother.set_inflation(AdaptiveInflation('additive'))
+        with self.assertRaises(ValueError):
+            smoother.analyze(state, measure)
+
+    def test_operator_trace(self):
+        """
+        Tests tr(R^-1 H H^T) of the additive inflation for index
+        selections with repeated indices, dense and sparse matrices,
+        LinearOperators and linear callables, over more state
+        components than one block
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        np.random.seed(1)
+        x_dim = 300
+        indices = [0,299,299,150,7]
+        select = np.zeros((5,x_dim))
+        select[range(5),indices] = 1
+        B = np.random.normal(0,1,(5,5))
+        cov = B @ B.T + np.eye(5)
+        H = np.random.normal(0,1,(5,x_dim))
+        operators = [(indices, select), (select, select), (scipy.sparse.csr_matrix(select), select),
+                     (H, H), (scipy.sparse.linalg.aslinearoperator(H), H)]
+        for given, covariance in [(cov, cov), (np.diag(cov), np.diag(np.diag(cov)))]:
+            for operator, matrix in operators:
+                measure = Measure(given,np.zeros((5,1)),operator)
+                trace = np.trace(np.linalg.solve(covariance, matrix @ matrix.T))
+                self.assertTrue(np.abs(AdaptiveInflation('additive')._operator_trace(measure, measure.get_covariance(), x_dim)-trace)<10e-10)
+            measure.set_operator(lambda x: H @ x, linear=True)
+            trace = np.trace(np.linalg.solve(covariance, H @ H.T))
+            self.assertTrue(np.abs(AdaptiveInflation('additive')._operator_trace(measure, measure.get_covariance(), x_dim)-trace)<10e-10)
@@ -0,0 +1,69 @@
+import unittest
+import numpy as np
+from ens_assim.localize import gaspari_cohn, as_coordinates, distance, taper_matrix
+
+DIST = np.array([0.,.5,1.,1.5,2.,3.])
+TAPER = np.array([1.,.68489583333333,.20833333333333,.01649305555556,0.,0.])
+
+class TestLocalize(unittest.TestCase):
+    """
+    Performs tests on the file localize.py
+
+    Attributes
+    ----------
+
+    Methods
+    -------
+    test_gaspari_cohn()
+        Tests the gaspari_cohn taper
+    test_distance()
+        Tests the distance with and without periodic boundaries
+    test_taper_matrix()
+        Tests the sparse taper_matrix against the dense taper
+    """
+    def test_gaspari_cohn(self):
+        """
+        Tests the gaspari_cohn taper
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        self.assertTrue(np.all(np.abs(gaspari_cohn(DIST,2.)-TAPER)<10e-12))
+        self.assertTrue(np.all(np.diff(gaspari_cohn(np.linspace(0,2,101),2.))<=0))
+
+    def test_distance(self):
+        """
+        Tests the distance with and without periodic boundaries
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        x = as_coordinates(np.array([1.,9.]))
+        self.assertEqual(x.shape, (2,1))
+        self.assertTrue(np.all(distance(x[0],x) == np.array([0.,8.])))
+        self.assertTrue(np.all(distance(x[0],x,boxsize=10.) == np.array([0.,2.])))
+        self.assertEqual(distance(np.array([0.,0.]),np.array([3.,4.])), 5.)
+
+    def test_taper_matrix(self):
+        """
+        Tests the sparse taper_matrix against the dense taper
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        x = as_coordinates(np.arange(10.))
+        y = as_coordinates(np.arange(10.)+.5)
+        for boxsize in [None, 10.]:
+            rho = taper_matrix(x, y, 3., boxsize=boxsize)
+            dense = gaspari_cohn(distance(x[:,None],y[None,:],boxsize),3.)
+            self.assertTrue(np.all(np.abs(rho.toarray()-dense)<10e-12))
+            self.assertEqual(rho.nnz, np.count_nonzero(dense))
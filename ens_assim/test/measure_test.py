@@ -0,0 +1,262 @@
+import unittest
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+import scipy.stats
+from ens_assim.assimilate.assimilate import SREnKF
+from ens_assim.measure.measure import Measure, DenseCovariance, DiagonalCovariance, BandedCovariance, \
+    SparseCovariance, LowRankCovariance, as_covariance
+
+DIM = 6
+VARIANCES = np.array([1.,2.,.5,1.5,1.,3.])
+FACTOR = np.array([[1.,0.],[.5,1.],[0.,.5],[1.,1.],[-1.,0.],[0.,2.]])
+BANDED = np.array([[4.,4.,4.,4.,4.,4.],[1.,1.,1.,1.,1.,0.],[.5,.5,.5,.5,0.,0.]])
+DENSE = np.diag(VARIANCES) + FACTOR @ FACTOR.T
+SPARSE = scipy.sparse.csc_matrix(np.diag(VARIANCES+2) + np.diag(np.ones(DIM-2),2) + np.diag(np.ones(DIM-2),-2))
+Y = np.array([[1.,0.,2.],[0.,1.,-1.],[1.,1.,0.],[-2.,0.,1.],[.5,.5,.5],[0.,3.,1.]])
+
+class TestMeasure(unittest.TestCase):
+    """
+    Performs tests on the file ./measure/measure.py
+
+    Attributes
+    ----------
+
+    Methods
+    -------
+    check_covariance(covariance, dense)
+        Checks the applies of a covariance against its dense form
+    test_dense_covariance()
+        Tests the DenseCovariance
+    test_diagonal_covariance()
+        Tests the DiagonalCovariance
+    test_banded_covariance()
+        Tests the BandedCovariance
+    test_sparse_covariance()
+        Tests the SparseCovariance
+    test_low_rank_covariance()
+        Tests the LowRankCovariance
+    test_measure_covariance()
+        Tests the covariance cache of Measure
+    test_measure_operator()
+        Tests the measurement operators of Measure
+    test_log_likelihood()
+        Tests the gaussian log-likelihood of Measure
+    test_measure_assignment()
+        Tests assigning the covariance and operator of Measure
+    test_is_diagonal()
+        Tests the structural diagonal check of every covariance
+    """
+    def check_covariance(self, covariance, dense):
+        """
+        Checks the applies of a covariance against its dense form
+
+        Parameters
+        ----------
+        covariance: Covariance
+            The covariance to check
+        dense: np.ndarray
+            The dense covariance
+
+        Raises
+        ------
+        """
+        self.assertTrue(np.all(np.abs(covariance.to_dense()-dense)<10e-12))
+        self.assertTrue(np.all(np.abs(covariance.to_sparse().toarray()-dense)<10e-12))
+        self.assertTrue(np.all(np.abs(covariance.diagonal()-np.diag(dense))<10e-12))
+        self.assertTrue(np.all(np.abs(covariance.solve(Y)-np.linalg.solve(dense,Y))<10e-12))
+        self.assertTrue(np.all(np.abs(covariance.mahalanobis(Y)-np.sum(Y*np.linalg.solve(dense,Y),axis=0))<10e-12))
+        self.assertTrue(np.abs(covariance.logdet()-np.linalg.slogdet(dense)[1])<10e-12)
+        self.assertEqual(covariance.is_diagonal(), not np.any(dense-np.diag(np.diag(dense))))
+
+    def test_dense_covariance(self):
+        """
+        Tests the DenseCovariance
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        covariance = DenseCovariance(DENSE)
+        self.check_covariance(covariance, DENSE)
+        sqrt = covariance.sqrt_apply(np.eye(DIM))
+        self.assertTrue(np.all(np.abs(sqrt@sqrt.T-DENSE)<10e-12))
+        self.assertTrue(np.all(np.abs(covariance.sqrt_apply(covariance.whiten(Y))-Y)<10e-12))
+
+    def test_diagonal_covariance(self):
+        """
+        Tests the DiagonalCovariance
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        covariance = DiagonalCovariance(VARIANCES)
+        self.check_covariance(covariance, np.diag(VARIANCES))
+        self.assertTrue(np.all(np.abs(covariance.whiten(Y)-Y/np.sqrt(VARIANCES)[:,None])<10e-12))
+
+    def test_banded_covariance(self):
+        """
+        Tests the BandedCovariance
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        covariance = BandedCovariance(BANDED)
+        dense = covariance.to_dense()
+        self.assertEqual(dense[2,0], .5)
+        self.check_covariance(covariance, dense)
+        sqrt = covariance.sqrt_apply(np.eye(DIM))
+        self.assertTrue(np.all(np.abs(sqrt@sqrt.T-dense)<10e-12))
+        self.assertTrue(np.all(np.abs(covariance.sqrt_apply(covariance.whiten(Y))-Y)<10e-12))
+
+    def test_sparse_covariance(self):
+        """
+        Tests the SparseCovariance
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        covariance = SparseCovariance(SPARSE)
+        self.check_covariance(covariance, SPARSE.toarray())
+        sqrt = covariance.sqrt_apply(np.eye(DIM))
+        self.assertTrue(np.all(np.abs(sqrt@sqrt.T-SPARSE.toarray())<10e-12))
+        self.assertTrue(np.all(np.abs(covariance.sqrt_apply(covariance.whiten(Y))-Y)<10e-12))
+
+    def test_low_rank_covariance(self):
+        """
+        Tests the LowRankCovariance
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        covariance = LowRankCovariance(VARIANCES, FACTOR)
+        self.check_covariance(covariance, DENSE)
+        sqrt = covariance.sqrt_apply(np.eye(DIM))
+        self.assertTrue(np.all(np.abs(sqrt@sqrt.T-DENSE)<10e-12))
+        self.assertTrue(np.all(np.abs(covariance.sqrt_apply(covariance.whiten(Y))-Y)<10e-12))
+        white = covariance.whiten(np.eye(DIM))
+        self.assertTrue(np.all(np.abs(white.T@white-np.linalg.inv(DENSE))<10e-12))
+        self.assertEqual(covariance.sample(4).shape, (DIM,4))
+
+    def test_measure_covariance(self):
+        """
+        Tests the covariance cache of Measure
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        measure = Measure(DENSE)
+        covariance = measure.get_covariance()
+        covariance.solve(Y)
+        self.assertTrue(measure.get_covariance() is covariance)
+        self.assertTrue(covariance.cholesky() is covariance.cholesky())
+        measure.set_covariance(VARIANCES)
+        self.assertTrue(isinstance(measure.get_covariance(), DiagonalCovariance))
+        self.assertTrue(isinstance(as_covariance(SPARSE), SparseCovariance))
+        self.assertTrue(as_covariance(covariance) is covariance)
+
+    def test_measure_operator(self):
+        """
+        Tests the measurement operators of Measure
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        selection = np.eye(DIM)[[1,4],:]
+        for operator in [[1,4], np.array([1,4]), np.arange(DIM) % 3 == 1, selection,
+                         scipy.sparse.csr_matrix(selection), scipy.sparse.linalg.aslinearoperator(selection)]:
+            measure = Measure(DENSE, None, operator)
+            self.assertTrue(measure.linear)
+            self.assertTrue(np.all(measure.apply_operator(Y)==Y[[1,4],:]))
+            stack = measure.apply_operator(np.stack([Y, 2*Y]))
+            self.assertTrue(np.all(stack==np.stack([Y[[1,4],:], 2*Y[[1,4],:]])))
+        measure = Measure(DENSE, None, lambda x: x[[1,4],:]**2)
+        self.assertFalse(measure.linear)
+        self.assertTrue(np.all(measure.apply_operator(Y)==Y[[1,4],:]**2))
+        measure.set_operator(lambda x: x[[1,4],:], linear=True)
+        self.assertTrue(measure.linear)
+        with self.assertRaises(ValueError):
+            measure.set_operator(selection, linear=False)
+
+    def test_log_likelihood(self):
+        """
+        Tests the gaussian log-likelihood of Measure against scipy.stats
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        y0 = np.arange(DIM)[:,None]/2
+        for covariance in [DENSE, VARIANCES, LowRankCovariance(VARIANCES, FACTOR)]:
+            measure = Measure(covariance, y0, lambda x: 2*x)
+            exact = scipy.stats.multivariate_normal(np.ravel(y0), measure.get_covariance().to_dense())
+            self.assertTrue(np.all(np.abs(measure.log_likelihood(Y)-exact.logpdf((2*Y).T))<10e-12))
+
+    def test_measure_assignment(self):
+        """
+        Tests that assigning the covariance and operator of Measure
+        directly replaces the cached covariance and the linearity
+        of the operator, so the analysis matches a new Measure
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        state = Y[:4]
+        y0 = np.array([[1.],[0.],[2.]])
+        square = lambda x: x[:3]**2
+        measure = Measure(DENSE[:3,:3], y0, np.eye(3,4))
+        SREnKF().analyze(state, measure)
+        measure.covariance = VARIANCES[:3]
+        measure.operator = square
+        self.assertTrue(isinstance(measure.get_covariance(), DiagonalCovariance))
+        self.assertFalse(measure.linear)
+        x = SREnKF().analyze(state, measure)
+        self.assertTrue(np.all(np.abs(x-SREnKF().analyze(state, Measure(VARIANCES[:3], y0, square)))<10e-12))
+
+    def test_is_diagonal(self):
+        """
+        Tests the structural diagonal check of every covariance
+        on diagonal covariances stored in each form
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        banded = np.zeros((3,DIM))
+        banded[0] = VARIANCES
+        banded[1,-1:] = banded[2,-2:] = 1.
+        factor = np.zeros((DIM,2))
+        factor[0,0] = factor[3,1] = 1.
+        for covariance in [DenseCovariance(np.diag(VARIANCES)), DiagonalCovariance(VARIANCES), BandedCovariance(banded),
+                           SparseCovariance(scipy.sparse.diags(VARIANCES, format='csc')),
+                           LowRankCovariance(VARIANCES, factor)]:
+            self.assertTrue(covariance.is_diagonal())
+        factor[3,0] = 1.
+        self.assertFalse(LowRankCovariance(VARIANCES, factor).is_diagonal())
@@ -1,6 +1,6 @@
 import unittest
 import numpy as np
-from ens_assim.model.model import ODE, Identity, rk4
+from ens_assim.model.model import ODE, Identity, Lorenz96, KuramotoSivashinsky, rk4, dopri5, etdrk4
 T0 = 0
 T = np.array([.1,.2])
 X0 = np.array([[1.,2.,3.],[2.,3.,4.]]).T
@@ -20,6 +20,13 @@ SOL_1[:,:,1] = FUNC_1(T0+2*STEP_SIZE,X0)
 
 SOLVER_DICT = {'h':STEP_SIZE}
 
+LORENZ = lambda t,x: np.array([10*(x[1,:]-x[0,:]),x[0,:]*(28-x[2,:]),x[0,:]*x[1,:]-(8/3)*x[2,:]])
+def LORENZ_IN_PLACE(t, x, out):
+    out[0] = 10*(x[1,:]-x[0,:])
+    out[1] = x[0,:]*(28-x[2,:])
+    out[2] = x[0,:]*x[1,:]-(8/3)*x[2,:]
+X0_LORENZ = np.array([[1.1,1.,1.],[1.,1.1,1.],[1.,1.,1.1],[-1.,2.,3.],[.5,-.5,20.]]).T
+
 
 class TestModel(unittest.TestCase): 
     """
@@ -32,10 +39,32 @@ class TestModel(unittest.TestCase):
     -------
     test_rk4()
         Tests the runga kutta function with constant function
+    test_rk4_batched()
+        Tests the batched, chunked and per member rk4 sweeps agree
+    test_rk4_output()
+        Tests the final, strided and generator output modes of rk4
+    test_rk4_in_place()
+        Tests rk4 with an in place rhs and a reused workspace
+    test_dopri5()
+        Tests the adaptive Dormand-Prince solver against a fine rk4
+    test_etdrk4()
+        Tests the ETDRK4 solver against an exact solution
     test_ode_const()
         Tests the class ODE with linear function
+    test_ode_process()
+        Tests the process backend of the class ODE
+    test_ode_clock()
+        Tests the class ODE advancing its clock and state
+    test_ode_parameters()
+        Tests the class ODE with per member parameters
     test_identity()
         Tests the identity Model
+    test_lorenz96()
+        Tests the Lorenz 96 Model
+    test_kuramoto_sivashinsky()
+        Tests the Kuramoto-Sivashinsky Model
+    test_model_setters_process()
+        Tests the process backend after changing model parameters
     """
     def test_rk4(self):
         """
@@ -51,6 +80,120 @@ class TestModel(unittest.TestCase):
         self.assertTrue(np.all(x==SOL_0))
         self.assertTrue(np.all(t==T))
 
+    def test_rk4_batched(self):
+        """
+        Tests the batched, chunked and per member rk4 sweeps agree
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        x_batch, t_batch = rk4(T0, X0_LORENZ, LORENZ, 20, {'h':.01})
+        x_chunk, t_chunk = rk4(T0, X0_LORENZ, LORENZ, 20, {'h':.01,'chunk_size':2})
+        x_member, t_member = rk4(T0, X0_LORENZ, LORENZ, 20, {'h':.01,'vectorized':False})
+        self.assertTrue(np.all(np.abs(x_batch-x_member)<10e-12))
+        self.assertTrue(np.all(np.abs(x_chunk-x_member)<10e-12))
+        self.assertTrue(np.all(t_batch==t_member))
+        self.assertTrue(np.all(t_chunk==t_member))
+
+    def test_rk4_output(self):
+        """
+        Tests the final, strided and generator output modes of rk4
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        x_all, t_all = rk4(T0, X0_LORENZ, LORENZ, 20, {'h':.01})
+        x_final, t_final = rk4(T0, X0_LORENZ, LORENZ, 20, {'h':.01,'output':'final'})
+        x_every, t_every = rk4(T0, X0_LORENZ, LORENZ, 20, {'h':.01,'output_every':5})
+        steps = rk4(T0, X0_LORENZ, LORENZ, 20, {'h':.01,'output':'generator','output_every':5})
+        self.assertTrue(np.all(x_final==x_all[:,:,-1:]))
+        self.assertTrue(np.all(t_final==t_all[-1:]))
+        self.assertTrue(np.all(x_every==x_all[:,:,4::5]))
+        self.assertTrue(np.all(t_every==t_all[4::5]))
+        for i, (t, x) in enumerate(steps):
+            self.assertTrue(t==t_every[i])
+            self.assertTrue(np.all(x==x_every[:,:,i]))
+        self.assertEqual(i, 3)
+
+    def test_rk4_in_place(self):
+        """
+        Tests rk4 with an in place rhs and a reused workspace
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        workspace = {}
+        x, t = rk4(T0, X0_LORENZ, LORENZ, 20, {'h':.01})
+        x_in_place, t_in_place = rk4(T0, X0_LORENZ, LORENZ_IN_PLACE, 20, {'h':.01,'in_place':True}, workspace)
+        buffers = {name: id(buffer) for name, buffer in workspace.items()}
+        x_chunk, _ = rk4(T0, X0_LORENZ, LORENZ_IN_PLACE, 20, {'h':.01,'in_place':True,'chunk_size':2})
+        x_member, _ = rk4(T0, X0_LORENZ, LORENZ_IN_PLACE, 20, {'h':.01,'in_place':True,'vectorized':False})
+        rk4(T0, X0_LORENZ, LORENZ_IN_PLACE, 20, {'h':.01,'in_place':True}, workspace)
+        self.assertTrue(np.all(np.abs(x_in_place-x)<10e-12))
+        self.assertTrue(np.all(np.abs(x_chunk-x)<10e-12))
+        self.assertTrue(np.all(np.abs(x_member-x)<10e-12))
+        self.assertTrue(np.all(t_in_place==t))
+        self.assertEqual(buffers, {name: id(buffer) for name, buffer in workspace.items()})
+
+    def test_dopri5(self):
+        """
+        Tests the adaptive Dormand-Prince solver against a fine rk4
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        calls = []
+        def counted(t, x):
+            calls.append(t)
+            return LORENZ(t, x)
+        x_rk4, t_rk4 = rk4(T0, X0_LORENZ, counted, 1000, {'h':.0005})
+        rk4_calls = len(calls)
+        del calls[:]
+        x, t = dopri5(T0, X0_LORENZ, counted, 10, {'h':.05,'rtol':1e-8,'atol':1e-10})
+        self.assertTrue(np.all(np.abs(x-x_rk4[:,:,99::100])<10e-6))
+        self.assertTrue(np.all(np.abs(t-t_rk4[99::100])<10e-12))
+        self.assertTrue(len(calls) < rk4_calls/4)
+
+    def test_etdrk4(self):
+        """
+        Tests the ETDRK4 solver against an exact solution
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        x_dim = 16
+        linear = -.1*np.fft.rfftfreq(x_dim, 1/x_dim)**2
+        forcing = np.zeros((x_dim//2+1,1))
+        forcing[0] = x_dim
+        nonlinear = lambda t,v: forcing*np.ones((1,v.shape[1]))
+        x0 = np.cos(2*np.pi*np.arange(x_dim)/x_dim)[:,None]*np.array([[1.,2.]])
+
+        workspace = {}
+        x, t = etdrk4(T0, x0, nonlinear, 10, {'h':.5,'linear':linear}, workspace)
+        coefficients = workspace['etdrk4'][3]
+        etdrk4(T0, x0, nonlinear, 10, {'h':.5,'linear':linear}, workspace)
+
+        decay = np.exp(-.1*t)
+        exact = t + decay[None,None,:]*x0[:,:,None]
+        self.assertTrue(np.all(np.abs(x-exact)<10e-12))
+        self.assertTrue(np.all(np.abs(t-.5*np.arange(1,11))<10e-12))
+        self.assertTrue(workspace['etdrk4'][3] is coefficients)
+
     def test_ode_const(self):
         """
         Tests the class ODE with constant ODE
@@ -73,6 +216,98 @@ class TestModel(unittest.TestCase):
         self.assertTrue(np.all(np.abs(x-SOL_1)<10e-12))
         self.assertTrue(np.all(t==T))
 
+    def test_ode_process(self):
+        """
+        Tests the process backend of the class ODE
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        model = ODE(X0_LORENZ)
+        model.set_solver(SOLVER)
+        model.set_rhs(LORENZ)
+        model.set_t0(T0)
+        model.set_solver_dict({'h':.01})
+        model.set_num_steps(20)
+        x_serial, t_serial = model.advance()
+
+        model.set_backend('process', 2)
+        x, t = model.advance()
+        model.set_backend('serial')
+
+        self.assertTrue(np.all(x==x_serial))
+        self.assertTrue(np.all(t==t_serial))
+
+    def test_ode_clock(self):
+        """
+        Tests the class ODE advancing its clock and state
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        rhs = lambda t,x: np.cos(t)*np.ones(x.shape)
+        model = ODE(X0)
+        model.set_solver(SOLVER)
+        model.set_rhs(rhs)
+        model.set_t0(T0)
+        model.set_solver_dict({'h':.01,'output':'final'})
+        model.set_num_steps(20)
+        x_full, t_full = model.advance()
+
+        for i in range(1, 5):
+            x, t = model.advance_to(T0 + .05*i)
+            self.assertEqual(model.t, T0 + .05*i)
+            self.assertTrue(np.all(model.state==x[:,:,-1]))
+        self.assertTrue(np.all(np.abs(model.state-x_full[:,:,-1])<10e-12))
+        self.assertTrue(np.all(np.abs(model.state-X0-np.sin(model.t))<10e-9))
+
+        model.set_initial_conditions(X0)
+        x, t = model.advance_by(5)
+        self.assertTrue(np.all(np.abs(t-(T0+.25))<10e-12))
+        self.assertTrue(np.all(np.abs(x[:,:,-1]-X0-np.sin(.25)+np.sin(.2))<10e-9))
+        self.assertRaises(ValueError, model.advance_to, T0)
+
+    def test_ode_parameters(self):
+        """
+        Tests the class ODE with per member parameters
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        rhs = lambda t,x,p: np.array([p[0]*(x[1,:]-x[0,:]),x[0,:]*(p[1]-x[2,:]),x[0,:]*x[1,:]-p[2]*x[2,:]])
+        params = np.array([[10.,10.,9.,11.,10.],[28.,27.,28.,29.,30.],[8/3,8/3,2.,3.,8/3]])
+        model = ODE(X0_LORENZ)
+        model.set_solver(SOLVER)
+        model.set_rhs(rhs)
+        model.set_t0(T0)
+        model.set_solver_dict({'h':.01,'output':'final'})
+        model.set_parameters(params)
+        x, t = model.advance_by(20)
+
+        for ens in range(X0_LORENZ.shape[1]):
+            member = lambda t,x: rhs(t,x,params[:,[ens]])
+            x_ens, _ = rk4(T0, X0_LORENZ[:,[ens]], member, 20, {'h':.01,'output':'final'})
+            self.assertTrue(np.all(np.abs(x[:,[ens],:]-x_ens)<10e-12))
+
+        x_member, _ = rk4(T0, X0_LORENZ, rhs, 20, {'h':.01,'output':'final','vectorized':False}, params=params)
+        self.assertTrue(np.all(np.abs(x-x_member)<10e-12))
+
+        augmented = model.get_augmented_state()
+        self.assertEqual(augmented.shape, (6,5))
+        model.set_augmented_state(2*augmented)
+        self.assertTrue(np.all(model.params==2*params))
+        self.assertTrue(np.all(model.state==2*x[:,:,-1]))
+        self.assertRaises(ValueError, model.set_parameters, params[:,:2])
+
     def test_identity(self):
         """
         Tests the class Identity
@@ -86,3 +321,87 @@ class TestModel(unittest.TestCase):
         model = Identity(X0)
         x = model.advance()
         self.assertTrue(np.all(x==X0))
+
+    def test_lorenz96(self):
+        """
+        Tests the Lorenz 96 Model
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        rhs = lambda t,x: (np.roll(x,-1,axis=0)-np.roll(x,2,axis=0))*np.roll(x,1,axis=0) - x + 8.
+        x0 = 8. + np.cos(np.arange(40))[:,None]*np.array([[.1,.2,.3]])
+        model = Lorenz96(x0)
+        model.set_num_steps(20)
+        x, t = model.advance()
+        x_roll, t_roll = rk4(T0, x0, rhs, 20, {'h':.05})
+        self.assertTrue(np.all(np.abs(x-x_roll)<10e-12))
+        self.assertTrue(np.all(t==t_roll))
+
+        model.set_initial_conditions(8.*np.ones((40,2)))
+        x, t = model.advance_by(20)
+        self.assertTrue(np.all(x==8.))
+
+        model = Lorenz96(x0)
+        model.set_solver_dict({'h':.01})
+        model.set_num_steps(20)
+        x, t = model.advance()
+        x_roll, t_roll = rk4(T0, x0, rhs, 20, {'h':.01})
+        self.assertTrue(np.all(np.abs(x-x_roll)<10e-12))
+
+    def test_kuramoto_sivashinsky(self):
+        """
+        Tests the Kuramoto-Sivashinsky Model against rk4
+        with a small step
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        x_dim = 32
+        grid = 32*np.pi*np.arange(x_dim)/x_dim
+        u0 = np.cos(grid/16)*(1+np.sin(grid/16))
+        x0 = np.stack([u0,1.01*u0],1)
+        model = KuramotoSivashinsky(x0)
+        model.set_solver_dict({'h':.25,'output':'final'})
+        x, t = model.advance_by(40)
+
+        linear = model.solver_dict['linear'][:,None]
+        rhs = lambda t,u: np.fft.irfft(linear*np.fft.rfft(u,axis=0)+model.nonlinear(t,np.fft.rfft(u,axis=0)),n=x_dim,axis=0)
+        x_rk4, t_rk4 = rk4(T0, x0, rhs, 1000, {'h':.01,'output':'final'})
+        self.assertTrue(np.all(np.abs(x-x_rk4)<10e-4))
+        self.assertTrue(np.all(np.abs(t-t_rk4)<10e-12))
+        self.assertTrue(np.all(np.abs(np.mean(x,axis=0))<10e-12))
+
+    def test_model_setters_process(self):
+        """
+        Tests that the process backend agrees with the serial one
+        after the forcing of Lorenz96 or the length of the
+        Kuramoto-Sivashinsky domain is changed
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        x0 = 8. + np.cos(np.arange(40))[:,None]*np.array([[.1,.2,.3]])
+        grid = 32*np.pi*np.arange(32)/32
+        u0 = np.cos(grid/16)*(1+np.sin(grid/16))
+        models = [(Lorenz96(x0), lambda model: model.set_forcing(20.)),
+                  (KuramotoSivashinsky(np.stack([u0,1.01*u0],1)), lambda model: model.set_length(20*np.pi))]
+        for model, change in models:
+            model.set_num_steps(10)
+            model.set_backend('process', 2)
+            model.advance()
+            change(model)
+            x, t = model.advance()
+            model.set_backend('serial')
+            x_serial, t_serial = model.advance()
+            self.assertTrue(np.all(x==x_serial))
+            self.assertTrue(np.all(t==t_serial))
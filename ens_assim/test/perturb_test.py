@@ -1,6 +1,6 @@
 import unittest
 import numpy as np
-from ens_assim.perturb import absolute_uncorr_perturb, percent_uncorr_perturb
+from ens_assim.perturb import absolute_uncorr_perturb, percent_uncorr_perturb, UncorrelatedPerturbation
 
 STATE_1 = np.array([[1.,1.,1.,1.]]).T
 STD_1 = np.array([0.,0.,0.,0.])
@@ -34,6 +34,10 @@ class TestPerturb(unittest.TestCase):
         Tests the absolute_uncorr_perturb with error
     test_percent_uncorr_perturb_error()
         Tests the percent_uncorr_perturb with error
+    test_out()
+        Tests the perturbations written in place
+    test_engine()
+        Tests the UncorrelatedPerturbation with a Generator and stacks
     """
     def test_absolute_uncorr_perturb_no_error(self):
         """
@@ -87,4 +91,43 @@ class TestPerturb(unittest.TestCase):
         """
         np.random.seed(1)
         state_pert = percent_uncorr_perturb(STATE_2,STD_2)
-        self.assertTrue(np.all(state_pert==PERT_2_2))
\ No newline at end of file
+        self.assertTrue(np.all(state_pert==PERT_2_2))
+
+    def test_out(self):
+        """
+        Tests the perturbations written in place
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        for perturb, expected in [(absolute_uncorr_perturb, PERT_2_1), (percent_uncorr_perturb, PERT_2_2)]:
+            state = STATE_2.copy()
+            np.random.seed(1)
+            self.assertIs(perturb(state, STD_2, out=state), state)
+            self.assertTrue(np.all(state==expected))
+
+    def test_engine(self):
+        """
+        Tests the UncorrelatedPerturbation against the noise of its
+        Generator, over repeated calls reusing the buffer and stacks
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        engine = UncorrelatedPerturbation(STD_2, relative=True, rng=3)
+        rng = np.random.default_rng(3)
+        for i in range(2):
+            err = rng.standard_normal((2,2))
+            self.assertTrue(np.all(engine.perturb(STATE_2)==STATE_2 + (STATE_2*STD_2[:,None])*err))
+        stack = np.stack([STATE_2, 2*STATE_2])
+        engine.set_std(2*STD_2)
+        self.assertTrue(engine.relative)
+        engine.set_std(STD_2, relative=False)
+        err = rng.standard_normal((2,2,2))
+        self.assertTrue(np.all(engine.perturb(stack)==stack + STD_2[:,None]*err))
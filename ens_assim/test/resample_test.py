@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+from ens_assim.resample import multinomial_resample, systematic_resample, stratified_resample, \
+    residual_resample
+
+WEIGHTS = np.array([.1,.4,0.,.25,.25])
+NUM = 100000
+
+class TestResample(unittest.TestCase):
+    """
+    Performs tests on the file resample.py
+
+    Attributes
+    ----------
+
+    Methods
+    -------
+    test_frequencies()
+        Tests that every scheme draws the particles with their weights
+    test_low_variance()
+        Tests the copies made by the systematic, stratified and residual schemes
+    """
+    def test_frequencies(self):
+        """
+        Tests that every scheme draws the particles with their weights
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        np.random.seed(1)
+        for resample in [multinomial_resample, systematic_resample, stratified_resample, residual_resample]:
+            indices = resample(WEIGHTS, NUM)
+            self.assertEqual(len(indices), NUM)
+            self.assertTrue(np.all(np.abs(np.bincount(indices, minlength=5)/NUM-WEIGHTS)<.01))
+            self.assertEqual(len(resample(WEIGHTS)), 5)
+
+    def test_low_variance(self):
+        """
+        Tests the copies made by the systematic, stratified and residual
+        schemes, which differ from the expected number by less than one
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        np.random.seed(1)
+        weights = np.random.random(20)
+        weights = weights/np.sum(weights)
+        for resample in [systematic_resample, residual_resample]:
+            for _ in range(10):
+                counts = np.bincount(resample(weights), minlength=20)
+                self.assertTrue(np.all(counts >= np.floor(20*weights)))
+        self.assertTrue(np.all(np.sort(stratified_resample(np.ones(4)/4))==np.arange(4)))
+        self.assertTrue(np.all(residual_resample(np.array([.5,0.,.25,.25]))==np.array([0,0,2,3])))
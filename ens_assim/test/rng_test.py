@@ -0,0 +1,112 @@
+import unittest
+import numpy as np
+from ens_assim.rng import as_generator, spawn, stream, NoiseBlock
+from ens_assim.measure.measure import Measure
+from ens_assim.assimilate.assimilate import EnKF, SIR
+from ens_assim.perturb import absolute_uncorr_perturb
+
+STATE = np.array([[1.,2.,0.,1.],[0.,1.,3.,2.],[2.,2.,1.,0.]])
+MEASURE = Measure(np.diag([.5,.5]),np.array([[1.],[2.]]),[0,2])
+
+class TestRng(unittest.TestCase):
+    """
+    Performs tests on the file rng.py
+
+    Attributes
+    ----------
+
+    Methods
+    -------
+    test_as_generator()
+        Tests the streams of None, seeds and Generators
+    test_spawn()
+        Tests the spawned streams and the streams at keys
+    test_noise_block()
+        Tests that a NoiseBlock hands out the draws of its stream
+    test_components()
+        Tests the reproducibility of the stochastic components
+    """
+    def test_as_generator(self):
+        """
+        Tests the streams of None, seeds and Generators
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        np.random.seed(1)
+        x = as_generator().normal(0,1,5)
+        np.random.seed(1)
+        self.assertTrue(np.all(x==np.random.normal(0,1,5)))
+        self.assertTrue(np.all(as_generator(3).random(5)==np.random.default_rng(3).random(5)))
+        rng = np.random.default_rng(3)
+        self.assertIs(as_generator(rng), rng)
+
+    def test_spawn(self):
+        """
+        Tests that the streams at keys are the spawned streams,
+        and that spawned streams are independent
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        cycles = spawn(5, 3)
+        self.assertTrue(np.all(stream(5, 2).random(5)==cycles[2].random(5)))
+        workers = spawn(np.random.SeedSequence(5).spawn(2)[1], 4)
+        self.assertTrue(np.all(stream(5, 1, 3).random(5)==workers[3].random(5)))
+        draws = [rng.random(5) for rng in spawn(5, 3)]
+        self.assertFalse(np.any(draws[0]==draws[1]))
+        self.assertEqual(len(spawn(np.random.default_rng(5), 2)), 2)
+
+    def test_noise_block(self):
+        """
+        Tests that a NoiseBlock hands out the normal draws of its
+        stream in order, across refills
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        block = NoiseBlock(7, 4)
+        noise = np.concatenate([block.standard_normal(3).ravel(), block.normal(1, 2, (2,3)).ravel(),
+                                [block.standard_normal()], block.standard_normal(10)])
+        expected = np.random.default_rng(4).standard_normal(20)
+        expected[3:9] = 1 + 2*expected[3:9]
+        self.assertTrue(np.all(np.abs(noise-expected)<10e-12))
+
+    def test_components(self):
+        """
+        Tests that the EnKF, SIR and perturb are reproduced from
+        their streams, and that a NoiseBlock gives the EnKF the
+        draws of its stream
+
+        Parameters
+        ----------
+
+        Raises
+        ------
+        """
+        model = EnKF()
+        model.set_rng(2)
+        x = model.analyze(STATE, MEASURE)
+        model.set_rng(np.random.default_rng(2))
+        self.assertTrue(np.all(model.analyze(STATE, MEASURE)==x))
+        model.set_rng(NoiseBlock(100, 2))
+        self.assertTrue(np.all(np.abs(model.analyze(STATE, MEASURE)-x)<10e-12))
+        model = SIR()
+        model.set_threshold(5)
+        model.set_rng(2)
+        model.analyze(STATE, MEASURE)
+        indices = model.indices
+        model.set_log_weights(np.zeros(4))
+        model.set_rng(2)
+        model.analyze(STATE, MEASURE)
+        self.assertTrue(np.all(model.indices==indices))
+        self.assertTrue(np.all(absolute_uncorr_perturb(STATE, np.ones(3), 2)==absolute_uncorr_perturb(STATE, np.ones(3), 2)))
@@ -11,6 +11,7 @@ setup(
     license='LICENSE.txt',
     description='Ensemble Data Assimilation framework.',
     long_description=open('README.txt').read(),
+    python_requires='>=3.8',
     install_requires=[
         "numpy >= 1.17.4",
         "scipy >= 1.4.1",